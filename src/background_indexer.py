@@ -0,0 +1,169 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import sys
+import threading
+import time
+
+from db_shard_manager import DBShardManager
+
+class BackgroundIndexer(object):
+  """
+  Runs a DBIndexer to completion on a thread of its own and builds a
+  DBShardManager for the result, so that none of it happens on the thread
+  that serves searches. If snapshot_filename is given, the new index is
+  written there too before it is handed out.
+
+  The owner polls done and then calls take_shard_manager. close() abandons
+  the work: the thread notices at its next step and throws away whatever it
+  built.
+
+  If collect_found_files is set, the files the indexer finds are also handed
+  out in batches as it goes, see take_found_files.
+
+  num_shards is passed on to the DBShardManager.
+  """
+  def __init__(self, indexer, snapshot_filename = None, snapshot_header = None,
+               collect_found_files = False, num_shards = 0):
+    self.indexer = indexer
+    self._num_shards = num_shards
+    self.start_time = None
+    self._snapshot_filename = snapshot_filename
+    self._snapshot_header = snapshot_header
+    self._collect_found_files = collect_found_files
+    self._num_file_ids_collected = 0
+    self._found_files = []
+    self._priority_paths = None
+    self._lock = threading.Lock()
+    self._done = threading.Event()
+    self._cancelled = False
+    self._shard_manager = None
+    self._exc_info = None
+    self._thread = None
+
+  @property
+  def started(self):
+    return self._thread != None
+
+  @property
+  def done(self):
+    return self._done.is_set()
+
+  @property
+  def progress(self):
+    if self.indexer.complete:
+      return "building index"
+    return self.indexer.progress
+
+  def start(self):
+    assert not self._thread
+    self.start_time = time.time()
+    self._thread = threading.Thread(target=self._main, name="BackgroundIndexer")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def wait(self, timeout):
+    self._done.wait(timeout)
+    return self.done
+
+  def take_shard_manager(self):
+    """Returns the finished DBShardManager, re-raising any error the thread hit."""
+    assert self.done
+    if self._exc_info:
+      exc_info = self._exc_info
+      self._exc_info = None
+      raise exc_info[0], exc_info[1], exc_info[2]
+    shard_manager = self._shard_manager
+    self._shard_manager = None
+    return shard_manager
+
+  def take_found_files(self, max_files = None):
+    """Returns up to max_files of the files found since the last call."""
+    with self._lock:
+      if max_files == None or len(self._found_files) <= max_files:
+        res = self._found_files
+        self._found_files = []
+      else:
+        res = self._found_files[:max_files]
+        self._found_files = self._found_files[max_files:]
+    return res
+
+  def prioritize_paths(self, paths):
+    """Asks the indexer to look near paths first. Safe to call at any time."""
+    with self._lock:
+      self._priority_paths = list(paths)
+
+  def close(self):
+    with self._lock:
+      self._cancelled = True
+      if not self._thread:
+        self.indexer.close()
+      shard_manager = self._shard_manager
+      self._shard_manager = None
+    if shard_manager:
+      shard_manager.close()
+
+  def _is_cancelled(self):
+    with self._lock:
+      return self._cancelled
+
+  def _collect_new_files(self):
+    file_table = self.indexer.file_table
+    n = len(file_table)
+    new_files = [file_table.get_filename(i)
+                 for i in xrange(self._num_file_ids_collected, n)
+                 if not file_table.is_removed(i)]
+    self._num_file_ids_collected = n
+    if len(new_files):
+      with self._lock:
+        self._found_files.extend(new_files)
+
+  def _main(self):
+    shard_manager = None
+    try:
+      while not self.indexer.complete:
+        with self._lock:
+          cancelled = self._cancelled
+          priority_paths = self._priority_paths
+          self._priority_paths = None
+        if cancelled:
+          self.indexer.close()
+          return
+        if priority_paths:
+          self.indexer.prioritize_paths(priority_paths)
+        self.indexer.index_a_bit_more()
+        if self._collect_found_files:
+          self._collect_new_files()
+      logging.debug("Indexing with %s took %s seconds",
+                    type(self.indexer), time.time() - self.start_time)
+
+      shard_manager = DBShardManager(self.indexer, num_shards=self._num_shards)
+      if self._snapshot_filename and not self._is_cancelled():
+        try:
+          shard_manager.write_snapshot(self._snapshot_filename,
+                                       self._snapshot_header)
+        except (IOError, OSError), ex:
+          logging.warning("Could not write index snapshot: %s", ex)
+    except:
+      self._exc_info = sys.exc_info()
+    finally:
+      with self._lock:
+        if self._cancelled:
+          keep = None
+        else:
+          keep = shard_manager
+          self._shard_manager = shard_manager
+      if shard_manager and not keep:
+        shard_manager.close()
+      self._done.set()
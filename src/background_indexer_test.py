@@ -0,0 +1,84 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import unittest
+
+from background_indexer import BackgroundIndexer
+from src import db_indexer
+from src import mock_db_indexer
+
+class _BlockingIndexer(db_indexer.DBIndexer):
+  """Never completes until told to, and records being closed."""
+  def __init__(self):
+    super(_BlockingIndexer, self).__init__([])
+    self.may_complete = threading.Event()
+    self.closed = False
+
+  @property
+  def progress(self):
+    return "blocked"
+
+  def index_a_bit_more(self):
+    if self.may_complete.wait(0.01):
+      self.file_table.add_file("a/b.txt")
+      self.complete = True
+
+  def close(self):
+    self.closed = True
+
+class _FailingIndexer(db_indexer.DBIndexer):
+  def index_a_bit_more(self):
+    raise Exception("boom")
+
+class BackgroundIndexerTest(unittest.TestCase):
+  def test_builds_shard_manager(self):
+    indexer = mock_db_indexer.MockDBIndexer(["a/"], ["a/b.txt", "a/c.txt"])
+    b = BackgroundIndexer(indexer)
+    b.start()
+    self.assertTrue(b.wait(10))
+    shard_manager = b.take_shard_manager()
+    try:
+      self.assertEquals(set(["a/b.txt", "a/c.txt"]),
+                        set(shard_manager.file_table.iterfilenames()))
+    finally:
+      shard_manager.close()
+
+  def test_does_not_block_caller(self):
+    indexer = _BlockingIndexer()
+    b = BackgroundIndexer(indexer)
+    b.start()
+    self.assertFalse(b.wait(0.05))
+    self.assertEquals("blocked", b.progress)
+    indexer.may_complete.set()
+    self.assertTrue(b.wait(10))
+    shard_manager = b.take_shard_manager()
+    try:
+      self.assertEquals(["a/b.txt"], list(shard_manager.file_table.iterfilenames()))
+    finally:
+      shard_manager.close()
+
+  def test_close_abandons_work(self):
+    indexer = _BlockingIndexer()
+    b = BackgroundIndexer(indexer)
+    b.start()
+    b.close()
+    self.assertTrue(b.wait(10))
+    self.assertTrue(indexer.closed)
+    self.assertEquals(None, b.take_shard_manager())
+
+  def test_error_is_reraised(self):
+    b = BackgroundIndexer(_FailingIndexer([]))
+    b.start()
+    self.assertTrue(b.wait(10))
+    self.assertRaises(Exception, b.take_shard_manager)
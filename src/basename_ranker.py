@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import heapq
 import re
 import os
 import math
@@ -201,3 +202,35 @@ class BasenameRanker(object):
           query,
           subcandidate)
     return best_rank, for_best_rank__num_word_hits
+
+def rank_basenames(query, basenames, max_hits = None):
+  """
+  Ranks basenames against query. Returns them as (basename, rank) pairs, best
+  first with ties going to the smaller basename, keeping only the first
+  max_hits if it is given.
+  """
+  ranker = BasenameRanker()
+  keyed_hits = [(-ranker.rank_query(query, basename), basename) for basename in basenames]
+  keyed_hits.sort()
+  if max_hits != None:
+    del keyed_hits[max_hits:]
+  return [(basename, -neg_rank) for neg_rank, basename in keyed_hits]
+
+def merge_ranked_basenames(ranked_lists, max_hits = None):
+  """
+  Merges lists of (basename, rank) pairs ordered like rank_basenames returns
+  them into one such list, keeping only the first max_hits if it is given.
+  A basename that is in several lists, in any case, is kept once.
+  """
+  keyed_lists = [[(-rank, basename) for basename, rank in l] for l in ranked_lists]
+  res = []
+  seen_lower_basenames = set()
+  for neg_rank, basename in heapq.merge(*keyed_lists):
+    if max_hits != None and len(res) >= max_hits:
+      break
+    lower_basename = basename.lower()
+    if lower_basename in seen_lower_basenames:
+      continue
+    seen_lower_basenames.add(lower_basename)
+    res.append((basename, -neg_rank))
+  return res
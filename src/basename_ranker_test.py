@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import unittest
-from basename_ranker import BasenameRanker
+from basename_ranker import BasenameRanker, merge_ranked_basenames, rank_basenames
 
 class BasenameRankerTest(unittest.TestCase):
   def setUp(self):
@@ -257,3 +257,19 @@ class BasenameRankerTest(unittest.TestCase):
     self.assertEquals(q1, r1)
     self.assertEquals(q2, r2)
 
+
+  def test_rank_basenames(self):
+    r = BasenameRanker()
+    hits = rank_basenames("bar", ["rebar.txt", "bar.txt", "bar.h"])
+    self.assertEquals([("bar.h", r.rank_query("bar", "bar.h")),
+                       ("bar.txt", r.rank_query("bar", "bar.txt")),
+                       ("rebar.txt", r.rank_query("bar", "rebar.txt"))], hits)
+    self.assertEquals(hits[:2], rank_basenames("bar", ["rebar.txt", "bar.txt", "bar.h"], 2))
+
+  def test_merge_ranked_basenames(self):
+    a = [("a.txt", 10), ("c.txt", 8)]
+    b = [("b.txt", 10), ("A.txt", 9), ("d.txt", 2)]
+    self.assertEquals([("a.txt", 10), ("b.txt", 10), ("c.txt", 8), ("d.txt", 2)],
+                      merge_ranked_basenames([a, b]))
+    self.assertEquals([("a.txt", 10), ("b.txt", 10)], merge_ranked_basenames([a, b], 2))
+    self.assertEquals([], merge_ranked_basenames([[], []]))
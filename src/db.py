@@ -12,20 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import hashlib
-import logging
 import os
 import time
 
 from db_exception import DBException
-from db_shard_manager import DBShardManager
+from db_partition import DBPartition, get_partition_roots
 from db_status import DBStatus
-from dir_cache import DirCache
 from event import Event
+from shard_manager_group import ShardManagerGroup
 from trace_event import *
 from query import Query
 from query_cache import QueryCache
 from query_result import QueryResult
-from src import db_indexer
 
 DEFAULT_IGNORES=[
   ".*",
@@ -55,37 +53,67 @@ class DBDir(object):
     return cmp(self.path, other.path)
 
 class DB(object):
-  def __init__(self, settings):
+  """
+  The index is split into a DBPartition per root, that is per dir that is
+  not nested in another one. Adding a root indexes just that root, removing
+  one drops its partition, and searches run across all of them.
+
+  If snapshot_filename is given, the finished index of each root is written
+  next to it after every sync, and a later DB with the same root and ignores
+  serves searches from it while its own first sync runs.
+
+  If watch_for_changes is set, the changes to the indexed dirs that have been
+  seen are applied to the index whenever step_watcher is called; searches
+  don't call it. They are found with inotify where possible, and by periodic
+  mtime based rescans on a thread of their own otherwise.
+
+  Indexing runs on a BackgroundIndexer thread per partition. The current
+  index keeps serving searches until step_indexer swaps in the one the thread
+  built. When a root has no index yet, searches run against the files found
+  in it so far, and are marked truncated.
+  """
+  def __init__(self, settings, snapshot_filename = None, watch_for_changes = False):
     self.settings = settings
+    self._snapshot_filename = snapshot_filename
+    self._watch_for_changes = watch_for_changes
     self.needs_indexing = Event() # fired when the database gets dirtied and needs syncing
-    self._pending_indexer = None # non-None if a DBIndexer is running
-    self._cur_shard_manager = None # the current DBShardManager object. This has all the DBIndexShards.
-    self._cur_query_cache = None
-
-    self._dir_cache = DirCache() # thread only state
-
-    self.settings.register('dirs', list, [], self._on_settings_dirs_changed)
-    self._on_settings_dirs_changed(None, self.settings.dirs)
+    self._partitions = {} # root -> DBPartition
+    self._cur_query_cache = QueryCache()
 
     self.settings.register('ignores', list, [], self._on_settings_ignores_changed)
     if self.settings.ignores == []:
       self.settings.ignores = DEFAULT_IGNORES;
 
-    self._on_settings_ignores_changed(None, self.settings.ignores)
-
     self.settings.register('token', str, "", self._on_settings_token_changed)
-    self._on_settings_token_changed(None, self.settings.token)
+
+    # How many shards each index is split across, or 0 to plan it from the
+    # size of the index and the cores of the machine.
+    self.settings.register('shards', int, 0, self._on_settings_shards_changed)
+
+    self.settings.register('dirs', list, [], self._on_settings_dirs_changed)
+    self._on_settings_dirs_changed(None, self.settings.dirs)
 
   def close(self):
-    if self._cur_shard_manager:
-      self._cur_shard_manager.close()
-      self._cur_shard_manager = None
+    for partition in self._partitions.values():
+      partition.close()
+    self._partitions = {}
 
   ###########################################################################
 
   def _on_settings_dirs_changed(self, old, new):
     self._dirs = map(lambda d: DBDir(d), new)
-    self._set_dirty()
+    was_up_to_date = self.is_up_to_date
+    roots = get_partition_roots(new)
+    for root in self._partitions.keys():
+      if root not in roots:
+        self._partitions.pop(root).close()
+    for root in roots:
+      if root not in self._partitions:
+        self._partitions[root] = DBPartition(root, self.settings.ignores,
+                                             self._snapshot_filename,
+                                             self._watch_for_changes,
+                                             self.settings.shards)
+    self._did_change(was_up_to_date)
 
   @property
   def dirs(self):
@@ -115,7 +143,12 @@ class DB(object):
   ###########################################################################
 
   def _on_settings_ignores_changed(self, old, new):
-    self._set_dirty()
+    # Partitions filter their index with the new ignores where they can,
+    # instead of walking their root again.
+    was_up_to_date = self.is_up_to_date
+    for partition in self._partitions.values():
+      partition.set_ignores(new)
+    self._did_change(was_up_to_date)
 
   @property
   def ignores(self):
@@ -148,41 +181,63 @@ class DB(object):
 
   ###########################################################################
 
+  def _on_settings_shards_changed(self, old, new):
+    was_up_to_date = self.is_up_to_date
+    for partition in self._partitions.values():
+      partition.set_num_shards(new)
+    self._did_change(was_up_to_date)
+
+  @property
+  def shards(self):
+    return self.settings.shards
+
+  @shards.setter
+  def shards(self, shards):
+    self.settings.shards = shards
+
+  ###########################################################################
+
   @property
   def has_index(self):
-    return self._cur_shard_manager != None
+    for partition in self._partitions.values():
+      if not partition.has_index:
+        return False
+    return True
 
   @property
   def is_up_to_date(self):
-    return self._pending_indexer == None
+    for partition in self._partitions.values():
+      if not partition.is_up_to_date:
+        return False
+    return True
 
   def begin_reindex(self):
     self._set_dirty()
 
   def _set_dirty(self):
-    was_indexing = self._pending_indexer != None
-    if self._pending_indexer:
-      self._pending_indexer = None
-    self._pending_indexer = 1 # set to 1 as indication to step_indexer to create new indexer
-    if not was_indexing:
+    was_up_to_date = self.is_up_to_date
+    for partition in self._partitions.values():
+      partition.set_dirty()
+    self._did_change(was_up_to_date)
+
+  def _did_change(self, was_up_to_date):
+    """Drops cached results, and fires needs_indexing if a partition became dirty."""
+    self._cur_query_cache = QueryCache()
+    if was_up_to_date and not self.is_up_to_date:
       self.needs_indexing.fire()
 
+  def _get_sorted_partitions(self):
+    return [self._partitions[root] for root in sorted(self._partitions.keys())]
+
   @traced
   def status(self):
-    if self._pending_indexer:
-      # Is an integer briefly between _set_dirty and first step_indexer
-      if not isinstance(self._pending_indexer, int): 
-        if self._cur_shard_manager:
-          status = "syncing: %s, %s" % (self._pending_indexer.progress, self._cur_shard_manager.status)
-        else:
-          status = "first-time sync: %s" % self._pending_indexer.progress
-      else:
-        status = "sync scheduled"
+    partitions = self._get_sorted_partitions()
+    if len(partitions) == 0:
+      status = "up-to-date: no dirs"
+    elif len(partitions) == 1:
+      status = partitions[0].status
     else:
-      if self._cur_shard_manager:
-        status = "up-to-date: %s" % self._cur_shard_manager.status
-      else:
-        status = "sync required"
+      status = "; ".join(["%s: %s" % (p.root, p.status) for p in partitions])
 
     res = DBStatus()
     res.is_up_to_date = self.is_up_to_date
@@ -191,34 +246,36 @@ class DB(object):
     return res
 
   @traced
-  def step_indexer(self):
-    if not self._pending_indexer:
-      return
-
-    # _pending_indexer is an integer if recreation should be triggered.
-    if isinstance(self._pending_indexer, int):
-      self._dir_cache.set_ignores(self.settings.ignores)
-      self._pending_indexer = db_indexer.Create(self.settings.dirs, self._dir_cache)
-      self._pending_indexer_start_time = time.time()
-
-    if self._pending_indexer.complete:
-      elapsed = time.time() - self._pending_indexer_start_time
-      logging.debug("Indexing with %s took %s seconds",
-                    type(self._pending_indexer),
-                    elapsed)
-      self._cur_shard_manager = DBShardManager(self._pending_indexer)
-      self._cur_query_cache = QueryCache()
-      self._pending_indexer = None
-
+  def step_indexer(self, timeout = 0):
+    """
+    Advances the pending reindexes without doing any of the indexing itself,
+    waiting up to timeout seconds in all for the BackgroundIndexers to finish.
+    """
+    deadline = time.time() + timeout
+    for partition in self._get_sorted_partitions():
+      if partition.is_up_to_date:
+        continue
+      if partition.step_indexer(max(0, deadline - time.time())):
+        self._cur_query_cache = QueryCache()
 
-    else:
-      self._pending_indexer.index_a_bit_more()
+  @traced
+  def step_watcher(self):
+    """
+    Applies the changes that the watchers have seen to the current index.
+    Falls back to reindexing a root if its watcher lost track of changes.
+    """
+    was_up_to_date = self.is_up_to_date
+    changed = False
+    for partition in self._partitions.values():
+      changed |= partition.step_watcher()
+    if changed:
+      self._did_change(was_up_to_date)
 
   def sync(self):
     """Ensures database index is up-to-date"""
     self.begin_reindex()
     while not self.is_up_to_date:
-      self.step_indexer()
+      self.step_indexer(timeout = 0.1)
 
   ###########################################################################
   @traced
@@ -228,11 +285,37 @@ class DB(object):
 
     args/kwargs should be either a Query object, or arguments to the Query-object constructor.
     """
-    if self._pending_indexer:
-      self.step_indexer()
-      # step sync might change the db sync status
-      if not self._cur_shard_manager:
-        return QueryResult()
-
     query = Query.from_kargs(args, kwargs)
-    return query.execute(self._cur_shard_manager, self._cur_query_cache)
+    if not self.is_up_to_date:
+      # Only picks up indices that the BackgroundIndexers have finished.
+      self.step_indexer()
+      hints = list(query.open_filenames)
+      if query.current_filename:
+        hints.insert(0, query.current_filename)
+      if len(hints):
+        for partition in self._partitions.values():
+          partition.prioritize_paths(hints)
+
+    shard_managers = []
+    query_cache = self._cur_query_cache
+    searches_provisional = False
+    for partition in self._get_sorted_partitions():
+      if not partition.has_index:
+        partition.step_provisional_shard_manager()
+        # The provisional index grows between searches, so results can't be
+        # cached.
+        query_cache = QueryCache()
+        searches_provisional = True
+      shard_manager = partition.searchable_shard_manager
+      if shard_manager:
+        shard_managers.append(shard_manager)
+    if not len(shard_managers):
+      return QueryResult()
+
+    group = ShardManagerGroup(self.settings.dirs, shard_managers)
+    res = query.execute(group, query_cache)
+    # Exact matches are looked up without asking the shards, so they don't
+    # hear from a provisional index that its results are incomplete.
+    if searches_provisional:
+      res.truncated = True
+    return res
@@ -11,54 +11,376 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import array
+import bisect
+import fixed_size_dict
 import fnmatch
 import re
 import sys
 
 from basename_ranker import BasenameRanker
+from subsequence_matcher import SubsequenceMatcher
+from suffix_array import SuffixArray
 from trace_event import *
 
+# Engines that a shard can use for its exact and substring stages. The regex
+# engine scans the whole shard with a regex, the suffix array engine answers by
+# binary search at the cost of a larger, slower to build index.
+ENGINE_REGEX = 'regex'
+ENGINE_SUFFIX_ARRAY = 'suffix_array'
+ENGINES = [ENGINE_REGEX, ENGINE_SUFFIX_ARRAY]
+
+# Longest letter sequence that gets a posting list in the ngram index.
+NGRAM_SIZE = 3
+
+# Candidate lists covering more than 1/MAX_CANDIDATE_FRACTION of the shard are
+# thrown away in favor of scanning the full index, which is cheaper at that point.
+MAX_CANDIDATE_FRACTION = 4
+
+# Number of recent queries whose full superfuzzy match sets are kept around so
+# that a query extending one of them only has to search that set.
+NUM_REFINABLE_QUERIES = 16
+
+# Full superfuzzy match sets are only computed from scratch when the ngram index
+# narrows the query down to 1/MAX_REFINABLE_FRACTION of the shard. Broader
+# queries are cheaper to answer with the early-exiting scans.
+MAX_REFINABLE_FRACTION = 16
+
+def _find_sorted(sorted_list, item):
+  """Returns the index of item in sorted_list, or None if it isn't there."""
+  i = bisect.bisect_left(sorted_list, item)
+  if i < len(sorted_list) and sorted_list[i] == item:
+    return i
+  return None
+
 class DBIndexShard(object):
-  def __init__(self, basenames):
+  def __init__(self, basenames, engine = ENGINE_REGEX, snapshot = None, snapshot_prefix = ''):
+    """
+    If snapshot is given, the indices are loaded from the sections that
+    get_snapshot_sections stored in it under snapshot_prefix rather than built.
+    Their arrays stay in the snapshot's mapping, and the structures that only
+    some searches need are built by the first search that needs them.
+    """
+    if engine not in ENGINES:
+      raise Exception("Unrecognized engine %s" % engine)
     reload(sys)
     sys.setdefaultencoding('utf8')
 
-    # The basenames come out of a hashtable so they are usually pretty badly
-    # shuffled around. Sort them here so that we get somewhat predictable results
-    # as a query is incrementally refined.
-    basenames.sort()
+    if snapshot:
+      # The snapshot has the lower basenames sorted and without dupes already.
+      self.lower_basenames = snapshot.get_strings(snapshot_prefix + "lower_basenames")
+    else:
+      # The basenames come out of a hashtable so they are usually pretty badly
+      # shuffled around. Sort them here so that we get somewhat predictable results
+      # as a query is incrementally refined.
+      basenames.sort()
+
+      # Build the lower basenames list, removing dupes as needed. The position of
+      # a lower basename in this list is its id in the ngram index.
+      self.lower_basenames = list(set([basename.lower() for basename in basenames]))
+      self.lower_basenames.sort()
+
+    # The two giant strings that contain all the basenames [and lowercase
+    # basenames] concatenated together, used to handle fuzzy queries. They are
+    # joined when first searched.
+    self._basenames = basenames
+    self._basenames_unsplit = None
+    self._lower_basenames_unsplit = None
+
+    if snapshot:
+      self._load_ngram_index(snapshot, snapshot_prefix)
+    else:
+      self._build_ngram_index()
+    self._lazy_subsequence_matcher = None
+    self._superfuzzy_ids_by_query = fixed_size_dict.FixedSizeDict(NUM_REFINABLE_QUERIES)
+
+    self.engine = engine
+    if engine == ENGINE_SUFFIX_ARRAY:
+      if snapshot:
+        self._suffix_array = SuffixArray.from_snapshot(self.lower_basenames, snapshot, snapshot_prefix + "suffix_array.")
+      else:
+        self._suffix_array = SuffixArray(self.lower_basenames)
+    else:
+      self._suffix_array = None
+
+    self._basename_ranker = BasenameRanker()
+    if snapshot:
+      self._load_wordstart_index(snapshot, snapshot_prefix)
+    else:
+      self._build_wordstart_index(basenames)
+
+    # Lower basenames that arrived through add_basenames after the indices were
+    # built. There are few of them, so they are simply scanned on every search.
+    self._added_lower_basenames = []
+    self._added_lower_basename_set = set()
+    if snapshot and snapshot.has_section(snapshot_prefix + "added_basenames"):
+      self.add_basenames(snapshot.get_strings(snapshot_prefix + "added_basenames"))
+
+    # Lower basenames of this shard that no file has anymore. Searches skip
+    # them, so that they don't take the place of hits that do have files.
+    self._removed_lower_basename_set = set()
+    if snapshot and snapshot.has_section(snapshot_prefix + "removed_basenames"):
+      self.set_basenames_removed(snapshot.get_strings(snapshot_prefix + "removed_basenames"), [])
+
+  @property
+  def basenames_unsplit(self):
+    if self._basenames_unsplit == None:
+      self._basenames_unsplit = (u"\n" + u"\n".join(self._basenames) + u"\n")
+      self._basenames = None
+    return self._basenames_unsplit
+
+  @property
+  def lower_basenames_unsplit(self):
+    if self._lower_basenames_unsplit == None:
+      self._lower_basenames_unsplit = (u"\n" + u"\n".join(self.lower_basenames) + u"\n")
+      assert type(self._lower_basenames_unsplit) == unicode
+    return self._lower_basenames_unsplit
 
-    # Build the lower basenames list, removing dupes as needed.
-    lower_basenames = set()
+  @property
+  def _subsequence_matcher(self):
+    if self._lazy_subsequence_matcher == None:
+      self._lazy_subsequence_matcher = SubsequenceMatcher(self.lower_basenames)
+    return self._lazy_subsequence_matcher
+
+  def add_basenames(self, basenames):
+    """Makes basenames searchable without rebuilding the indices."""
     for basename in basenames:
       lower_basename = basename.lower()
-      lower_basenames.add(lower_basename)
+      if lower_basename in self._added_lower_basename_set:
+        continue
+      self._added_lower_basename_set.add(lower_basename)
+      self._added_lower_basenames.append(lower_basename)
 
-    # Build two giant strings that contain all the basenames [and lowercase basenames]
-    # concatenated together. This is what we will use to handle fuzzy queries.
-    self.basenames_unsplit = (u"\n" + u"\n".join(basenames) + u"\n")
-    self.lower_basenames_unsplit = (u"\n" + u"\n".join(lower_basenames) + u"\n")
-    assert type(self.lower_basenames_unsplit) == unicode
+  def has_lower_basename(self, lower_basename):
+    i = bisect.bisect_left(self.lower_basenames, lower_basename)
+    if i < len(self.lower_basenames) and self.lower_basenames[i] == lower_basename:
+      return True
+    return lower_basename in self._added_lower_basename_set
+
+  def set_basenames_removed(self, removed_lower_basenames, restored_lower_basenames):
+    """
+    Stops searches from finding the removed_lower_basenames that this shard
+    has, and lets them find the restored_lower_basenames again.
+    """
+    for lower_basename in removed_lower_basenames:
+      if self.has_lower_basename(lower_basename):
+        self._removed_lower_basename_set.add(lower_basename)
+    for lower_basename in restored_lower_basenames:
+      self._removed_lower_basename_set.discard(lower_basename)
+
+  def _add_all_added_matching(self, lower_hits, lower_query, match_subsequence, max_hits_hint):
+    for lower_basename in self._added_lower_basenames:
+      if len(lower_hits) >= max_hits_hint:
+        return
+      if lower_basename in self._removed_lower_basename_set:
+        continue
+      if match_subsequence:
+        i = 0
+        for c in lower_query:
+          i = lower_basename.find(c, i) + 1
+          if i == 0:
+            break
+        if i == 0:
+          continue
+      elif lower_basename.find(lower_query) == -1:
+        continue
+      lower_hits.add(lower_basename)
+
+  @staticmethod
+  def from_snapshot(snapshot, prefix, engine):
+    basenames = snapshot.get_strings(prefix + "basenames")
+    return DBIndexShard(basenames, engine, snapshot, prefix)
+
+  def get_snapshot_sections(self, prefix):
+    """
+    Returns the sections from which from_snapshot can recreate this shard
+    without rebuilding any of its indices.
+    """
+    if self._basenames != None:
+      basenames = self._basenames
+    elif len(self.basenames_unsplit) > 2:
+      basenames = self.basenames_unsplit[1:-1].split(u"\n")
+    else:
+      basenames = []
+    sections = {prefix + "basenames": basenames,
+                prefix + "lower_basenames": self.lower_basenames}
+
+    sections[prefix + "ngrams"] = self._ngrams
+    sections[prefix + "ngram_offsets"] = self._ngram_offsets
+    sections[prefix + "ngram_ids"] = self._ngram_ids
+
+    sections[prefix + "wordstarts"] = self._wordstarts
+    sections[prefix + "wordstart_offsets"] = self._wordstart_offsets
+    sections[prefix + "wordstart_ids"] = self._wordstart_ids
+
+    if self._suffix_array:
+      sections.update(self._suffix_array.get_snapshot_sections(prefix + "suffix_array."))
+    sections[prefix + "added_basenames"] = self._added_lower_basenames
+    sections[prefix + "removed_basenames"] = list(self._removed_lower_basename_set)
+    return sections
+
+  def _load_ngram_index(self, snapshot, prefix):
+    self._ngrams = snapshot.get_strings(prefix + "ngrams")
+    self._ngram_offsets = snapshot.get_array(prefix + "ngram_offsets")
+    self._ngram_ids = snapshot.get_array(prefix + "ngram_ids")
+
+  def _load_wordstart_index(self, snapshot, prefix):
+    self._wordstarts = snapshot.get_strings(prefix + "wordstarts")
+    self._wordstart_offsets = snapshot.get_array(prefix + "wordstart_offsets")
+    self._wordstart_ids = snapshot.get_array(prefix + "wordstart_ids")
+
+  def _build_wordstart_index(self, basenames):
+    """
+    Builds the index from every prefix of a basename's word start letters to the
+    ids of the lower basenames having those start letters, e.g. rwh for
+    RenderWidgetHost.cpp. The ids for all prefixes are stored back to back in
+    one array, in the order of the sorted prefixes in _wordstarts.
+    """
+    lower_basename_ids = {}
+    for id in range(len(self.lower_basenames)):
+      lower_basename_ids[self.lower_basenames[id]] = id
 
-    self._basename_ranker = BasenameRanker()
     wordstarts = {}
     for basename in basenames:
       start_letters = self._basename_ranker.get_start_letters(basename)
       if len(start_letters) <= 1:
         continue
-      lower_basename = basename.lower()
+      id = lower_basename_ids[basename.lower()]
       for i in range(len(start_letters) + 1 - 2): # abcd -> ab abc abcd
         ws = ''.join(start_letters[0:2+i])
         if ws not in wordstarts:
           wordstarts[ws] = []
         loss = len(start_letters) - (2 + i)
-        wordstarts[ws].append((lower_basename, loss))
+        wordstarts[ws].append((id, loss))
 
     # now, order the actual entries so high qualities are at front
-    self.basenames_by_wordstarts = {}
-    for ws,items in wordstarts.iteritems():
-      items.sort(lambda x,y: cmp(x[1],y[1]))
-      self.basenames_by_wordstarts[ws] = [i[0] for i in items]
+    self._wordstarts = sorted(wordstarts.keys())
+    self._wordstart_offsets = array.array('i')
+    self._wordstart_ids = array.array('i')
+    for ws in self._wordstarts:
+      items = wordstarts[ws]
+      items.sort(key=lambda item: item[1])
+      self._wordstart_offsets.append(len(self._wordstart_ids))
+      self._wordstart_ids.extend([item[0] for item in items])
+    self._wordstart_offsets.append(len(self._wordstart_ids))
+
+  def get_wordstart_ids(self, query):
+    """Returns the lower basename ids having query as their start letters, best first."""
+    slot = _find_sorted(self._wordstarts, query.lower())
+    if slot == None:
+      return []
+    return self._wordstart_ids[self._wordstart_offsets[slot]:self._wordstart_offsets[slot + 1]]
+
+  def _build_ngram_index(self):
+    """
+    Builds codesearch-style posting lists that map every 1, 2 and 3 letter
+    sequence found in a lower basename to the ids of the basenames containing it.
+    The lists are used to narrow down the set of basenames before running the
+    substring and superfuzzy regexes.
+    """
+    postings = {}
+    for id in range(len(self.lower_basenames)):
+      lower_basename = self.lower_basenames[id]
+      grams = set()
+      for n in range(1, NGRAM_SIZE + 1):
+        for i in range(len(lower_basename) + 1 - n):
+          grams.add(lower_basename[i:i+n])
+      for gram in grams:
+        if gram not in postings:
+          postings[gram] = []
+        postings[gram].append(id)
+
+    # Ids were appended in increasing order, so the lists are already sorted.
+    # They are stored back to back in one array, in the order of the sorted
+    # grams in _ngrams.
+    self._ngrams = sorted(postings.keys())
+    self._ngram_offsets = array.array('i')
+    self._ngram_ids = array.array('i')
+    for gram in self._ngrams:
+      self._ngram_offsets.append(len(self._ngram_ids))
+      self._ngram_ids.extend(postings[gram])
+    self._ngram_offsets.append(len(self._ngram_ids))
+
+  def _get_ngram_candidates(self, grams):
+    """
+    Returns a sorted list of basename ids whose basenames contain every one of
+    the given grams, or None if the grams dont narrow the search enough to be
+    worth using over a scan of the full index.
+    """
+    if len(grams) == 0:
+      return None
+    postings = []
+    for gram in set(grams):
+      i = _find_sorted(self._ngrams, gram)
+      if i == None:
+        return []
+      postings.append(self._ngram_ids[self._ngram_offsets[i]:self._ngram_offsets[i + 1]])
+    postings.sort(key=len)
+    max_candidates = len(self.lower_basenames) / MAX_CANDIDATE_FRACTION
+    if len(postings[0]) > max_candidates:
+      return None
+
+    # Intersecting with the two rarest grams gets rid of most of the
+    # non-matches. The regex run on the candidates will reject the rest.
+    candidates = set(postings[0])
+    if len(postings) > 1:
+      candidates.intersection_update(postings[1])
+    if len(candidates) > max_candidates:
+      return None
+    return sorted(candidates)
+
+  def get_substring_candidates(self, query):
+    lower_query = query.lower()
+    n = min(len(lower_query), NGRAM_SIZE)
+    grams = [lower_query[i:i+n] for i in range(len(lower_query) + 1 - n)]
+    return self._get_ngram_candidates(grams)
+
+  def get_superfuzzy_candidates(self, query):
+    # Superfuzzy matches may have anything between the query letters, so only
+    # the single letter postings are useful.
+    return self._get_ngram_candidates(list(query.lower()))
+
+  def get_superfuzzy_matches(self, query, limit = None):
+    """
+    Returns (ids, positions) for the lower basenames that contain query as a
+    subsequence, where positions[i] gives the index that each query letter was
+    matched to in the basename with id ids[i]. If limit is given, only the
+    first limit matches are returned.
+    """
+    lower_query = query.lower()
+    return self._subsequence_matcher.match(lower_query, self.get_superfuzzy_candidates(lower_query), limit)
+
+  def get_all_superfuzzy_ids(self, query):
+    """
+    Returns the sorted ids of every lower basename matching query as a
+    subsequence, or None if the query is too broad for the full set to be worth
+    computing.
+
+    Every hit of every stage of search_basenames is also a superfuzzy match, and
+    so is every hit of any query that extends this one. So the sets are
+    remembered, and a query that extends a recent one, e.g. rwhc after rwh, is
+    answered by searching only the recent query's set.
+    """
+    lower_query = query.lower()
+    for i in range(len(lower_query), 0, -1):
+      prefix = lower_query[:i]
+      if prefix not in self._superfuzzy_ids_by_query:
+        continue
+      prefix_ids = self._superfuzzy_ids_by_query[prefix]
+      if prefix == lower_query:
+        return prefix_ids
+      ids = self._subsequence_matcher.match(lower_query, prefix_ids)[0]
+      self._superfuzzy_ids_by_query[lower_query] = ids
+      return ids
+
+    candidates = self.get_superfuzzy_candidates(lower_query)
+    if candidates == None:
+      return None
+    if len(candidates) > len(self.lower_basenames) / MAX_REFINABLE_FRACTION:
+      return None
+    ids = self._subsequence_matcher.match(lower_query, candidates)[0]
+    self._superfuzzy_ids_by_query[lower_query] = ids
+    return ids
 
   @traced
   def search_basenames(self, query):
@@ -74,10 +396,22 @@ class DBIndexShard(object):
     lower_hits = set()
 
     max_hits_hint = 25
+    # Stages that fetch a limited number of ids fetch enough more that the
+    # removed basenames among them can't leave them short.
+    num_removed = len(self._removed_lower_basename_set)
+
+    # All stages only ever find superfuzzy matches, so if the full set of them
+    # is known, the stages below can be restricted to it.
+    trace_begin("refine")
+    superfuzzy_ids = self.get_all_superfuzzy_ids(lower_query)
+    trace_end("refine")
 
     # add exact matches first
     trace_begin("exact")
-    self.add_all_matching( lower_hits, query, self.get_exact_match_filter(lower_query), max_hits_hint )
+    if self._suffix_array:
+      self.add_all_ids( lower_hits, self.get_exact_match_ids(lower_query), max_hits_hint )
+    else:
+      self.add_all_ids( lower_hits, self.get_sorted_exact_match_ids(lower_query, max_hits_hint + num_removed), max_hits_hint )
     trace_end("exact")
 
     # add in word starts
@@ -85,9 +419,23 @@ class DBIndexShard(object):
     self.add_all_wordstarts_matching( lower_hits, query, max_hits_hint )
     trace_end("wordstarts")
 
+    # add in prefix matches, which are the substring matches that rank best
+    trace_begin("prefixes")
+    self.add_all_ids( lower_hits, self.get_prefix_ids(lower_query, max_hits_hint + num_removed), max_hits_hint )
+    trace_end("prefixes")
+
     # add in substring matches
     trace_begin("substrings")
-    self.add_all_matching( lower_hits, query, self.get_substring_filter(lower_query), max_hits_hint )
+    if self._suffix_array:
+      self.add_all_ids( lower_hits, self._suffix_array.get_ids_containing(lower_query), max_hits_hint )
+    else:
+      if superfuzzy_ids != None:
+        candidates = superfuzzy_ids
+      else:
+        candidates = self.get_substring_candidates(lower_query)
+      self.add_all_matching( lower_hits, query, self.get_substring_filter(lower_query), max_hits_hint,
+                             candidates )
+    self._add_all_added_matching( lower_hits, lower_query, False, max_hits_hint )
     trace_end("substrings")
 
     # add in superfuzzy matches ONLY if we have no high-quality hit
@@ -99,19 +447,63 @@ class DBIndexShard(object):
         break
     if not has_hq:
       trace_begin("superfuzzy")
-      self.add_all_matching( lower_hits, query, self.get_superfuzzy_filter(lower_query), max_hits_hint )
+      if superfuzzy_ids != None:
+        ids = superfuzzy_ids
+      else:
+        # Some of the matches may be hits already, so ask for enough to fill
+        # lower_hits even if every existing hit turns up again.
+        ids, positions = self.get_superfuzzy_matches(lower_query, max_hits_hint + len(lower_hits) + num_removed)
+      self.add_all_ids( lower_hits, ids, max_hits_hint )
+      self._add_all_added_matching( lower_hits, lower_query, True, max_hits_hint )
       trace_end("superfuzzy")
 
     return lower_hits, len(lower_hits) == max_hits_hint
 
   def add_all_wordstarts_matching( self, lower_hits, query, max_hits_hint ):
+    for id in self.get_wordstart_ids(query):
+      lower_basename = self.lower_basenames[id]
+      if lower_basename in self._removed_lower_basename_set:
+        continue
+      lower_hits.add(lower_basename)
+      if len(lower_hits) >= max_hits_hint:
+        return
+
+
+  def get_prefix_ids(self, query, limit = None):
+    """
+    Returns the ids of the lower basenames starting with query. They are
+    consecutive since lower_basenames is sorted, so finding them takes a
+    binary search plus one step per id. If limit is given, only the first
+    limit ids are returned.
+    """
     lower_query = query.lower()
-    if lower_query in self.basenames_by_wordstarts:
-      for basename in self.basenames_by_wordstarts[lower_query]:
-        lower_hits.add(basename)
-        if len(lower_hits) >= max_hits_hint:
-          return
+    begin = bisect.bisect_left(self.lower_basenames, lower_query)
+    end = begin
+    while (end < len(self.lower_basenames) and
+           (limit == None or end - begin < limit) and
+           self.lower_basenames[end].startswith(lower_query)):
+      end += 1
+    return xrange(begin, end)
+
+  def get_sorted_exact_match_ids(self, query, limit = None):
+    """Binary search version of get_exact_match_filter."""
+    lower_query = query.lower()
+    ids = []
+    id = bisect.bisect_left(self.lower_basenames, lower_query)
+    if id < len(self.lower_basenames) and self.lower_basenames[id] == lower_query:
+      ids.append(id)
+    ids.extend(self.get_prefix_ids(lower_query + '.', limit))
+    return ids
 
+  def get_exact_match_ids(self, query):
+    """Suffix array version of get_exact_match_filter."""
+    lower_query = query.lower()
+    ids = self._suffix_array.get_ids_starting_with(lower_query + '.')
+    id = self._suffix_array.get_id_of(lower_query)
+    if id != None:
+      ids.append(id)
+      ids.sort()
+    return ids
 
   def get_exact_match_filter(self, query):
     query = re.escape(query.lower())
@@ -156,18 +548,40 @@ class DBIndexShard(object):
     flt = "\n.*%s.*\n" % '.*'.join(tmp)
     return (flt, False)
 
-  def add_all_matching(self, lower_hits, query, flt_tuple, max_hits_hint):
+  def add_all_ids(self, lower_hits, ids, max_hits_hint):
+    """
+    Adds the lower basenames for a sorted list of ids to lower_hits, stopping in
+    the same place add_all_matching would for the equivalent regex.
+    """
+    for id in ids:
+      if len(lower_hits) >= max_hits_hint:
+        break
+      lower_basename = self.lower_basenames[id]
+      if lower_basename in self._removed_lower_basename_set:
+        continue
+      lower_hits.add(lower_basename)
+
+  def add_all_matching(self, lower_hits, query, flt_tuple, max_hits_hint, candidates = None):
     """
     lower_hits is the dictionary to put results in
     query is the query string originally entered by user, used by ranking
     flt_tuple is [filter_regex, case_sensitive_bool]
     max_hits_hint is largest hits should grow before matching terminates.
+    candidates is an optional sorted list of lower basename ids to restrict the
+    search to. If None, the whole index is searched.
     """
     flt, case_sensitive = flt_tuple
+    if len(lower_hits) >= max_hits_hint:
+      return
 
     regex = re.compile(flt)
     base = 0
-    if not case_sensitive:
+    if candidates != None:
+      assert not case_sensitive
+      if len(candidates) == 0:
+        return
+      index = u"\n" + u"\n".join([self.lower_basenames[id] for id in candidates]) + u"\n"
+    elif not case_sensitive:
       index = self.lower_basenames_unsplit
     else:
       index = self.basenames_unsplit
@@ -179,8 +593,10 @@ class DBIndexShard(object):
           raise Exception("Somethign is messed up with flt=[%s] query=[%s] hit=[%s]" % (flt,query,hit))
         if case_sensitive:
           hit = hit.lower()
-        lower_hits.add(hit)
         base = m.end() - 1
+        if hit in self._removed_lower_basename_set:
+          continue
+        lower_hits.add(hit)
         if len(lower_hits) >= max_hits_hint:
           truncated = True
           break
@@ -12,9 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import db_index_shard
+import index_snapshot
+import json
+import os
+import tempfile
 import unittest
 import re
 
+from basename_ranker import BasenameRanker
+
 def _assertSetEquals(self, ref,src):
   src_set = set(src)
   ref_set = set(ref)
@@ -99,3 +105,167 @@ class DBIndexShardTest(unittest.TestCase):
 
     hits, truncated = m.search_basenames("rwh")
     self.assertTrue("render_widget_host.cpp" in hits)
+
+  def test_ngram_candidates_dont_change_hits(self):
+    files_by_basename = json.load(open('test_data/cr_files_by_basename_five_percent.json'))
+    m = db_index_shard.DBIndexShard(list(files_by_basename.keys()))
+    unlimited = len(m.lower_basenames) + 1
+    queries = ["a", "rw", "rwh", "render", "view.cc", "_unittest", "xyzzy", "q.txt", "ren_wid"]
+    for q in queries:
+      for (getflt, getcandidates) in [(m.get_substring_filter, m.get_substring_candidates),
+                                      (m.get_superfuzzy_filter, m.get_superfuzzy_candidates)]:
+        ref_hits = set()
+        m.add_all_matching(ref_hits, q, getflt(q), unlimited)
+        hits = set()
+        m.add_all_matching(hits, q, getflt(q), unlimited, getcandidates(q))
+        _assertSetEquals(self, ref_hits, hits)
+
+  def test_ngram_candidates_narrow_search(self):
+    m = db_index_shard.DBIndexShard(["foo.cc", "bar.cc", "baz.cc", "render_widget.cc", "a", "b", "c", "d"])
+    self.assertEquals([m.lower_basenames.index("render_widget.cc")], m.get_substring_candidates("widg"))
+    self.assertEquals([], m.get_substring_candidates("xyz"))
+    self.assertEquals([m.lower_basenames.index("render_widget.cc")], m.get_superfuzzy_candidates("rwg"))
+
+  def test_suffix_array_engine_matches_regex_engine(self):
+    files_by_basename = json.load(open('test_data/cr_files_by_basename_five_percent.json'))
+    basenames = list(files_by_basename.keys())
+    regex_shard = db_index_shard.DBIndexShard(list(basenames), db_index_shard.ENGINE_REGEX)
+    sa_shard = db_index_shard.DBIndexShard(list(basenames), db_index_shard.ENGINE_SUFFIX_ARRAY)
+    unlimited = len(regex_shard.lower_basenames) + 1
+    queries = ["a", "rw", "rwh", "render", "view", "view.cc", "_unittest", "xyzzy", "q.txt", "ren_wid", "makefile"]
+    for q in queries:
+      ref_hits = set()
+      regex_shard.add_all_matching(ref_hits, q, regex_shard.get_exact_match_filter(q), unlimited)
+      hits = set()
+      sa_shard.add_all_ids(hits, sa_shard.get_exact_match_ids(q), unlimited)
+      _assertSetEquals(self, ref_hits, hits)
+
+      ref_hits = set()
+      regex_shard.add_all_matching(ref_hits, q, regex_shard.get_substring_filter(q), unlimited)
+      hits = set()
+      sa_shard.add_all_ids(hits, sa_shard._suffix_array.get_ids_containing(q), unlimited)
+      _assertSetEquals(self, ref_hits, hits)
+
+      _assertSetEquals(self, regex_shard.search_basenames(q)[0], sa_shard.search_basenames(q)[0])
+
+  def test_bisect_stages_match_regex_filters(self):
+    files_by_basename = json.load(open('test_data/cr_files_by_basename_five_percent.json'))
+    m = db_index_shard.DBIndexShard(list(files_by_basename.keys()))
+    unlimited = len(m.lower_basenames) + 1
+    queries = ["a", "rw", "render_wid", "view", "view.cc", "_unittest", "xyzzy", "makefile", "Render"]
+    for q in queries:
+      ref_hits = set()
+      m.add_all_matching(ref_hits, q, m.get_exact_match_filter(q), unlimited)
+      hits = set()
+      m.add_all_ids(hits, m.get_sorted_exact_match_ids(q), unlimited)
+      _assertSetEquals(self, ref_hits, hits)
+
+      ref_hits = set()
+      m.add_all_matching(ref_hits, q, ("\n%s.*\n" % re.escape(q.lower()), False), unlimited)
+      hits = set()
+      m.add_all_ids(hits, m.get_prefix_ids(q), unlimited)
+      _assertSetEquals(self, ref_hits, hits)
+
+    self.assertEquals(3, len(m.get_prefix_ids("a", 3)))
+
+  def test_prefix_matches_come_before_other_substrings(self):
+    basenames = ["x_foo%i.txt" % i for i in range(30)] + ["foo_bar.txt"]
+    m = db_index_shard.DBIndexShard(basenames)
+    hits, truncated = m.search_basenames("foo_")
+    self.assertTrue("foo_bar.txt" in hits)
+
+  def test_unknown_engine_raises(self):
+    self.assertRaises(Exception, lambda: db_index_shard.DBIndexShard([], 'xxx'))
+
+  def test_superfuzzy_matches_agree_with_filter(self):
+    files_by_basename = json.load(open('test_data/cr_files_by_basename_five_percent.json'))
+    m = db_index_shard.DBIndexShard(list(files_by_basename.keys()))
+    unlimited = len(m.lower_basenames) + 1
+    for q in ["a", "rwh", "rwhvc", "render_w", "xyzzy", "w.cc"]:
+      ref_hits = set()
+      m.add_all_matching(ref_hits, q, m.get_superfuzzy_filter(q), unlimited)
+      ids, positions = m.get_superfuzzy_matches(q)
+      _assertSetEquals(self, ref_hits, [m.lower_basenames[id] for id in ids])
+
+  def test_refined_queries_match_unrefined_queries(self):
+    files_by_basename = json.load(open('test_data/cr_files_by_basename_five_percent.json'))
+    basenames = list(files_by_basename.keys())
+    refining_shard = db_index_shard.DBIndexShard(list(basenames))
+    for q in ["r", "rw", "rwh", "rwhv", "rwh", "rwhc", "w", "wi", "wid", "widg", "widget", "widget_", "wid"]:
+      fresh_shard_hits = db_index_shard.DBIndexShard(list(basenames)).search_basenames(q)
+      self.assertEquals(fresh_shard_hits, refining_shard.search_basenames(q))
+
+  def test_get_all_superfuzzy_ids_reuses_previous_query(self):
+    # Pad the shard so that rwh is narrow enough to be refinable.
+    padding = ["x%i.txt" % i for i in range(64)]
+    m = db_index_shard.DBIndexShard(["render_widget_host.cc", "rwh.h", "foo.cc", "bar.cc"] + padding)
+    rwh_ids = m.get_all_superfuzzy_ids("rwh")
+    self.assertEquals(set(["render_widget_host.cc", "rwh.h"]), set([m.lower_basenames[id] for id in rwh_ids]))
+
+    searched = []
+    orig_match = m._subsequence_matcher.match
+    def match(query, ids = None, limit = None):
+      searched.append(ids)
+      return orig_match(query, ids, limit)
+    m._subsequence_matcher.match = match
+    rwhc_ids = m.get_all_superfuzzy_ids("rwhc")
+    self.assertEquals([rwh_ids], searched)
+    self.assertEquals(["render_widget_host.cc"], [m.lower_basenames[id] for id in rwhc_ids])
+
+  def test_wordstart_index_order(self):
+    files_by_basename = json.load(open('test_data/cr_files_by_basename_five_percent.json'))
+    basenames = sorted(files_by_basename.keys())
+    m = db_index_shard.DBIndexShard(list(basenames))
+
+    # Reference: lists of lower basenames, ordered by how many start letters
+    # the wordstart leaves unmatched.
+    ranker = BasenameRanker()
+    ref = {}
+    for basename in basenames:
+      start_letters = ranker.get_start_letters(basename)
+      for i in range(len(start_letters) - 1):
+        ws = ''.join(start_letters[0:2+i])
+        ref.setdefault(ws, []).append((basename.lower(), len(start_letters) - (2 + i)))
+    for ws in ref:
+      ref[ws].sort(key=lambda x: x[1])
+
+    self.assertEquals(len(ref), len(m._wordstarts))
+    for ws in ref:
+      self.assertEquals([x[0] for x in ref[ws]], [m.lower_basenames[id] for id in m.get_wordstart_ids(ws)])
+    self.assertEquals([], list(m.get_wordstart_ids("xyzzyq")))
+
+    lower_hits = set()
+    m.add_all_wordstarts_matching(lower_hits, "rwh", 3)
+    self.assertEquals(set([x[0] for x in ref["rwh"][:3]]), lower_hits)
+
+  def test_removed_basenames_are_not_found(self):
+    for engine in db_index_shard.ENGINES:
+      shard = db_index_shard.DBIndexShard(["foo.cc", "foobar.cc", "xfoo.h"], engine)
+      shard.add_basenames(["foo_added.cc"])
+      shard.set_basenames_removed(["foobar.cc", "foo_added.cc", "not_in_shard.cc"], [])
+      self.assertEquals(set(["foo.cc", "xfoo.h"]), set(shard.search_basenames("foo")[0]))
+      self.assertEquals(set(["foo.cc"]), set(shard.search_basenames("fo.c")[0]))
+      self.assertEquals(set([]), set(shard.search_basenames("foobar")[0]))
+
+      shard.set_basenames_removed([], ["foobar.cc"])
+      self.assertEquals(set(["foo.cc", "foobar.cc", "xfoo.h"]), set(shard.search_basenames("foo")[0]))
+
+  def test_snapshot_roundtrip(self):
+    files_by_basename = json.load(open('test_data/cr_files_by_basename_five_percent.json'))
+    basenames = list(files_by_basename.keys())
+    queries = ["a", "rw", "rwh", "render", "view.cc", "_unittest", "xyzzy", "ren_wid"]
+    f = tempfile.NamedTemporaryFile()
+    for engine in db_index_shard.ENGINES:
+      shard = db_index_shard.DBIndexShard(list(basenames), engine)
+      shard.set_basenames_removed([basenames[0].lower()], [])
+      index_snapshot.write_snapshot(f.name, {}, shard.get_snapshot_sections("s."))
+      snapshot = index_snapshot.IndexSnapshot(f.name)
+      try:
+        loaded = db_index_shard.DBIndexShard.from_snapshot(snapshot, "s.", engine)
+      finally:
+        snapshot.close()
+      self.assertEquals(shard.lower_basenames, loaded.lower_basenames)
+      self.assertEquals(shard.basenames_unsplit, loaded.basenames_unsplit)
+      for q in queries:
+        self.assertEquals(shard.search_basenames(q), loaded.search_basenames(q))
+    f.close()
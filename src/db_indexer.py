@@ -16,16 +16,41 @@ import os
 import time
 import json
 
+from file_table import FileTable
+
 class DBIndexer(object):
+  """
+  Indexers add the files that they find to self.file_table as they go.
+  """
   def __init__(self, dirs):
     self.dirs = dirs
     self.complete = False
-    self.files_by_basename = dict()
+    self.file_table = FileTable()
+
+  @property
+  def files_by_basename(self):
+    return self.file_table.get_files_by_basename()
 
   def progress(self):
     raise NotImplementedException()
 
+  def close(self):
+    """Stops any work still going on for an indexer that is no longer wanted."""
+    pass
+
+  def prioritize_paths(self, paths):
+    """
+    Hints that the dirs holding paths, typically the files open in the
+    editor, should be indexed before the rest.
+    """
+    pass
+
 def Create(dirs, dir_cache):
+  import git_based_db_indexer
+  if git_based_db_indexer.Supported():
+    return git_based_db_indexer.GitBasedDBIndexer(
+      dirs, dir_cache.ignores)
+
   import find_based_db_indexer
   if find_based_db_indexer.Supported():
     return find_based_db_indexer.FindBasedDBIndexer(
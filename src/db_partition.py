@@ -0,0 +1,369 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import db_indexer
+import hashlib
+import index_snapshot
+import inotify_watcher
+import logging
+import mtime_rescanner
+import os
+import struct
+import time
+
+from background_indexer import BackgroundIndexer
+from db_shard_manager import DBShardManager
+from dir_cache import DirCache, fix_ignores
+from ignore_matcher import IgnoreMatcher
+from index_delta import IndexDelta
+from provisional_shard_manager import ProvisionalShardManager
+
+# Files moved into the provisional index per step, which bounds the time a
+# search can spend on it.
+MAX_PROVISIONAL_FILES_PER_STEP = 10000
+
+# Files the watcher may add or remove before the index is rebuilt: removals
+# and renames leave dead entries in the file table and the shards until then.
+MIN_WATCHER_CHURN_FOR_REINDEX = 1000
+WATCHER_CHURN_FRACTION_FOR_REINDEX = 0.25
+
+def get_partition_roots(dirs):
+  """
+  Returns the dirs that are not inside another one of dirs. Each of them gets
+  a partition, which indexes the nested dirs along with it.
+  """
+  real_dirs = [(d, os.path.realpath(d)) for d in dirs]
+  roots = []
+  for d, real_d in real_dirs:
+    nested = False
+    for other_d, real_other_d in real_dirs:
+      if other_d == d:
+        continue
+      if real_d.startswith(real_other_d + os.sep):
+        nested = True
+        break
+    if not nested and d not in roots:
+      roots.append(d)
+  return roots
+
+def get_partition_snapshot_filename(snapshot_filename, root):
+  return "%s.%s" % (snapshot_filename, hashlib.md5(root).hexdigest())
+
+class DBPartition(object):
+  """
+  The index of one root dir, along with everything that keeps it up to date:
+  the BackgroundIndexer that builds it, the provisional index that serves
+  searches during its first sync, and the watcher for its changes.
+
+  Changing the ignores only walks the root again if the index could be
+  missing files: when an ignore that the index was walked with is removed.
+  Otherwise the index is filtered with the new ignores, and the files that
+  filtering took out are kept, so that removing the ignore again puts them
+  back.
+
+  A partition starts out dirty. If snapshot_filename is given, a snapshot
+  of the same root, walked with no more than the current ignores, is served
+  until the first sync is done.
+
+  num_shards is passed on to the DBShardManagers that the partition builds.
+  """
+  def __init__(self, root, ignores, snapshot_filename = None, watch_for_changes = False,
+               num_shards = 0):
+    self.root = root
+    self._num_shards = num_shards
+    self._ignores = list(ignores)
+    self._ignore_matcher = IgnoreMatcher(fix_ignores(ignores))
+    self._index_ignores = None # the ignores that shard_manager was walked with
+    self._indexer_ignores = None # the ignores that _pending_indexer walks with
+    self._indexer_start_time = None # when _pending_indexer was created
+    self._filtered_out_files = set() # walked files that the ignores took out since
+    self._watcher_churn = 0 # files the watcher added to or removed from shard_manager
+    if snapshot_filename:
+      self._snapshot_filename = get_partition_snapshot_filename(snapshot_filename, root)
+    else:
+      self._snapshot_filename = None
+    self._watch_for_changes = watch_for_changes
+    self._watcher = None
+    self._watch_limit_reached = False # inotify ran out of watches for the root
+    self._pending_indexer = 1 # set to 1 as indication to step_indexer to create new indexer
+    self.shard_manager = None
+    self.provisional_shard_manager = None # files found so far, during first-time sync
+    self._dir_cache = DirCache() # thread only state
+
+    self._load_snapshot()
+
+  def close(self):
+    self._close_pending_indexer()
+    if self._watcher:
+      self._watcher.close()
+      self._watcher = None
+    if self.shard_manager:
+      self.shard_manager.close()
+      self.shard_manager = None
+
+  def _load_snapshot(self):
+    snapshot = index_snapshot.try_open(self._snapshot_filename)
+    if not snapshot:
+      return
+    try:
+      if (snapshot.header["dirs"] != [self.root] or
+          not self._can_filter_walk(snapshot.header["ignores"])):
+        logging.debug("Index snapshot is for a different root or ignores, not using it.")
+        return
+      self.shard_manager = DBShardManager(None, snapshot=snapshot)
+      self._index_ignores = snapshot.header["ignores"]
+      self._filter_index()
+      logging.debug("Loaded %s for %s from index snapshot", self.shard_manager.status, self.root)
+    except (index_snapshot.SnapshotException, struct.error, ValueError), ex:
+      logging.warning("Ignoring index snapshot: %s", ex)
+    finally:
+      snapshot.close()
+
+  ###########################################################################
+
+  @property
+  def has_index(self):
+    return self.shard_manager != None
+
+  @property
+  def is_up_to_date(self):
+    return self._pending_indexer == None
+
+  @property
+  def searchable_shard_manager(self):
+    """The index to search, if any: the current one, or else the provisional one."""
+    if self.shard_manager:
+      return self.shard_manager
+    return self.provisional_shard_manager
+
+  def _can_filter_walk(self, walked_ignores):
+    """True if a walk with walked_ignores found every file the ignores allow."""
+    return set(walked_ignores).issubset(set(self._ignores))
+
+  def set_ignores(self, ignores):
+    """
+    Applies new ignores to the index, and reindexes if that is not enough.
+    Returns True if the index changed or became dirty.
+    """
+    if ignores == self._ignores:
+      return False
+    self._ignores = list(ignores)
+    self._ignore_matcher = IgnoreMatcher(fix_ignores(ignores))
+
+    # A running reindex that walks too little is restarted. One that walks
+    # enough is filtered when it is done.
+    if (isinstance(self._pending_indexer, BackgroundIndexer) and
+        not self._can_filter_walk(self._indexer_ignores)):
+      self.set_dirty()
+    if not self.shard_manager:
+      return True
+    if self._can_filter_walk(self._index_ignores):
+      self._filter_index()
+    elif not self._pending_indexer:
+      self.set_dirty()
+    return True
+
+  def _filter_index(self):
+    """
+    Brings shard_manager in line with the ignores, without touching the
+    filesystem. Files are taken out or put back with an IndexDelta.
+    """
+    delta = IndexDelta()
+    for f in self.shard_manager.file_table.iterfilenames():
+      if self._ignore_matcher.match_filename_under(self.root, f):
+        delta.remove_file(f)
+    for f in self._filtered_out_files:
+      if not self._ignore_matcher.match_filename_under(self.root, f):
+        delta.add_file(f)
+    if delta.is_empty():
+      return
+    logging.debug("Filtering %s with the new ignores: %s", self.root, delta)
+    self._filtered_out_files.difference_update(delta.added_files)
+    self._filtered_out_files.update(delta.removed_files)
+    self.shard_manager.apply_delta(delta)
+
+  def _filter_delta(self, delta):
+    """Drops the files in delta, a watcher's IndexDelta, that the ignores take out."""
+    for d in delta.removed_dirs:
+      prefix = os.path.join(d, '')
+      self._filtered_out_files.difference_update(
+        [f for f in self._filtered_out_files if f.startswith(prefix)])
+    self._filtered_out_files.difference_update(delta.removed_files)
+    if self._ignores == self._index_ignores:
+      return
+    for f in list(delta.added_files):
+      if self._ignore_matcher.match_filename_under(self.root, f):
+        delta.added_files.remove(f)
+        self._filtered_out_files.add(f)
+
+  def set_dirty(self):
+    self._close_pending_indexer()
+    self._pending_indexer = 1
+    self.provisional_shard_manager = None
+
+  def set_num_shards(self, num_shards):
+    """Sets the num_shards of the DBShardManagers to come, rebuilding the index if it changed."""
+    if num_shards == self._num_shards:
+      return
+    self._num_shards = num_shards
+    self.set_dirty()
+
+  def _close_pending_indexer(self):
+    if self._pending_indexer and not isinstance(self._pending_indexer, int):
+      self._pending_indexer.close()
+    self._pending_indexer = None
+
+  @property
+  def status(self):
+    if self._pending_indexer:
+      # Is an integer briefly between set_dirty and first step_indexer
+      if not isinstance(self._pending_indexer, int):
+        if self.shard_manager:
+          return "syncing: %s, %s" % (self._pending_indexer.progress, self.shard_manager.status)
+        return "first-time sync: %s" % self._pending_indexer.progress
+      return "sync scheduled"
+    if self.shard_manager:
+      return "up-to-date: %s" % self.shard_manager.status
+    return "sync required"
+
+  def step_indexer(self, timeout = 0):
+    """
+    Advances a pending reindex without doing any of the indexing itself,
+    waiting up to timeout seconds for the BackgroundIndexer to finish. The
+    watcher that a reindex restarts walks the tree on its own thread too.
+    Returns True if a new index was swapped in.
+    """
+    if not self._pending_indexer:
+      return False
+
+    # _pending_indexer is an integer if recreation should be triggered.
+    if isinstance(self._pending_indexer, int):
+      self._dir_cache.set_ignores(self._ignores)
+      # Start watching before indexing so that no change goes unseen. Changes
+      # are held back until the index is done and then applied on top of it.
+      self._restart_watcher()
+      indexer = db_indexer.Create([self.root], self._dir_cache)
+      self._indexer_ignores = list(self._ignores)
+      self._indexer_start_time = time.time()
+      first_time = self.shard_manager == None
+      self._pending_indexer = BackgroundIndexer(indexer,
+                                                self._snapshot_filename,
+                                                {"ignores": self._ignores},
+                                                collect_found_files = first_time,
+                                                num_shards = self._num_shards)
+      if first_time:
+        self.provisional_shard_manager = ProvisionalShardManager([self.root])
+
+    if not self._pending_indexer.started:
+      # The watcher sets up its watches on a thread of its own, and indexing
+      # waits for them so that no change falls in between.
+      if self._watcher and not self._watcher.is_watching:
+        self._watcher.process_events()
+        return False
+      if self._watcher and self._watcher.watch_limit_reached:
+        logging.debug("Out of watches for %s, switching to rescans.", self.root)
+        self._watch_limit_reached = True
+        self._restart_watcher()
+      self._pending_indexer.start()
+
+    self.step_provisional_shard_manager()
+
+    if not self._pending_indexer.wait(timeout):
+      return False
+
+    pending_indexer = self._pending_indexer
+    self._pending_indexer = None
+    shard_manager = pending_indexer.take_shard_manager()
+    old_shard_manager = self.shard_manager
+    self.shard_manager = shard_manager
+    self._index_ignores = self._indexer_ignores
+    self._filtered_out_files = set()
+    self._watcher_churn = 0
+    self.provisional_shard_manager = None
+    if old_shard_manager:
+      old_shard_manager.close()
+    if self._ignores != self._index_ignores:
+      self._filter_index()
+    if self._watcher:
+      self._watcher.set_baseline(self.shard_manager.file_table, self._indexer_start_time)
+    return True
+
+  def step_provisional_shard_manager(self):
+    if not self.provisional_shard_manager:
+      return
+    files = self._pending_indexer.take_found_files(MAX_PROVISIONAL_FILES_PER_STEP)
+    if self._ignores != self._indexer_ignores:
+      files = [f for f in files
+               if not self._ignore_matcher.match_filename_under(self.root, f)]
+    self.provisional_shard_manager.add_files(files)
+
+  def prioritize_paths(self, paths):
+    """Asks a running reindex to look near those of paths that are in the root first."""
+    if not self._pending_indexer or isinstance(self._pending_indexer, int):
+      return
+    paths = [p for p in paths if p.startswith(self.root + os.sep)]
+    if len(paths):
+      self._pending_indexer.prioritize_paths(paths)
+
+  def _restart_watcher(self):
+    if self._watcher:
+      self._watcher.close()
+      self._watcher = None
+    if not self._watch_for_changes:
+      return
+    if inotify_watcher.Supported() and not self._watch_limit_reached:
+      try:
+        self._watcher = inotify_watcher.InotifyWatcher([self.root], self._dir_cache.is_ignored)
+      except OSError, ex:
+        logging.warning("Could not watch for changes with inotify: %s", ex)
+    if not self._watcher:
+      logging.debug("Watching %s for changes with mtime based rescans.", self.root)
+      # The rescanner compares listings to those of its previous sweep, so it
+      # can't share a DirCache with the indexer.
+      rescan_dir_cache = DirCache()
+      rescan_dir_cache.set_ignores(self._ignores)
+      self._watcher = mtime_rescanner.MtimeRescanner([self.root], rescan_dir_cache)
+
+  def step_watcher(self):
+    """
+    Applies the changes that the watcher has seen to the current index. Falls
+    back to a reindex of the root if the watcher lost track of changes.
+    Returns True if the index changed or became dirty.
+    """
+    if not self._watcher:
+      return False
+    if self._pending_indexer:
+      self._watcher.process_events()
+      return False
+    if self._watcher.watch_limit_reached:
+      # Part of the tree is not watched. Reindexing switches to rescans.
+      logging.debug("Out of watches, reindexing %s.", self.root)
+      self._watch_limit_reached = True
+      self.set_dirty()
+      return True
+
+    delta = self._watcher.get_delta()
+    if not delta:
+      return False
+    if delta.needs_reindex:
+      logging.debug("Watcher lost track of changes, reindexing %s.", self.root)
+      self.set_dirty()
+      return True
+    self._filter_delta(delta)
+    logging.debug("Applying %s", delta)
+    self._watcher_churn += self.shard_manager.apply_delta(delta)
+    if self._watcher_churn > max(MIN_WATCHER_CHURN_FOR_REINDEX,
+                                 WATCHER_CHURN_FRACTION_FOR_REINDEX * self.shard_manager.file_table.num_files):
+      logging.debug("%i files changed since %s was indexed, reindexing it.", self._watcher_churn, self.root)
+      self.set_dirty()
+    return True
@@ -0,0 +1,59 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import inotify_watcher
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from db_partition import DBPartition, get_partition_roots
+
+class DBPartitionTest(unittest.TestCase):
+  def test_partition_roots(self):
+    self.assertEquals([], get_partition_roots([]))
+    self.assertEquals(["/a", "/b"], get_partition_roots(["/a", "/b"]))
+    self.assertEquals(["/a"], get_partition_roots(["/a", "/a/b"]))
+    self.assertEquals(["/a"], get_partition_roots(["/a/b", "/a"]))
+    self.assertEquals(["/a", "/ab"], get_partition_roots(["/a", "/ab"]))
+
+  def test_step_indexer_returns_promptly(self):
+    if not inotify_watcher.Supported():
+      return
+    root = os.path.realpath(tempfile.mkdtemp())
+    os.mkdir(os.path.join(root, 'sub'))
+    open(os.path.join(root, 'sub', 'a.txt'), 'w').close()
+    # Watches that take long to set up must not hold up the caller.
+    watch_tree = inotify_watcher.InotifyWatcher._watch_tree
+    def slow_watch_tree(watcher, d, delta):
+      time.sleep(0.5)
+      watch_tree(watcher, d, delta)
+    inotify_watcher.InotifyWatcher._watch_tree = slow_watch_tree
+    partition = DBPartition(root, [], watch_for_changes=True)
+    try:
+      deadline = time.time() + 10
+      while time.time() < deadline:
+        start = time.time()
+        swapped = partition.step_indexer()
+        self.assertTrue(time.time() - start < 0.25)
+        if swapped:
+          break
+        time.sleep(0.01)
+      self.assertTrue(partition.is_up_to_date)
+      self.assertEquals([os.path.join(root, 'sub', 'a.txt')],
+                        list(partition.shard_manager.file_table.iterfilenames()))
+    finally:
+      inotify_watcher.InotifyWatcher._watch_tree = watch_tree
+      partition.close()
+      shutil.rmtree(root)
@@ -11,23 +11,128 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import array
+import bisect
 import db_index_shard
-import multiprocessing
+import index_snapshot
+import itertools
+import os
+import shard_planner
 
+from basename_ranker import merge_ranked_basenames, rank_basenames
+from file_table import FileTable
 from local_pool import *
+from shard_transport import ShardProcess
 from trace_event import *
 
-slave = None
+# The shards living in this process, by key. A shard process holds just one,
+# but the LocalPool shards of every DBShardManager live in the main process.
+slaves = {}
 slave_searchcount = 0
 
-def ShardInit(basenames):
-  global slave
-  slave = db_index_shard.DBIndexShard(basenames)
+_next_shard_manager_key = itertools.count()
 
-def ShardSearchBasenames(basename_query):
-  assert slave
+class ShardSlave(object):
+  """
+  A DBIndexShard along with the file table basename id of each of its lower
+  basenames, so that searches can answer with ranked ids rather than strings.
+  Each lower basename is ranked as the basename that its id stands for.
+  """
+  def __init__(self, shard, basenames, table_ids):
+    self.shard = shard
+    self._basenames = basenames # by lower basename id in shard
+    self._table_ids = table_ids # by lower basename id in shard
+    self._added = {} # (basename, table id) by lower basename, for add_basenames
+
+  @staticmethod
+  def create(all_basenames, basename_ids, engine):
+    basenames = []
+    table_id_by_lower_basename = {}
+    for basename_id in basename_ids:
+      basename = all_basenames[basename_id]
+      basenames.append(basename)
+      table_id_by_lower_basename.setdefault(basename.lower(), basename_id)
+    shard = db_index_shard.DBIndexShard(basenames, engine)
+    table_ids = array.array('i', [table_id_by_lower_basename[lower_basename]
+                                  for lower_basename in shard.lower_basenames])
+    return ShardSlave(shard, [all_basenames[id] for id in table_ids], table_ids)
+
+  @staticmethod
+  def from_snapshot(snapshot, prefix, engine):
+    # The shard and the slave both keep the basenames by lower basename id.
+    basenames = snapshot.get_strings(prefix + "basenames")
+    slave = ShardSlave(db_index_shard.DBIndexShard(basenames, engine, snapshot, prefix),
+                       basenames,
+                       snapshot.get_array(prefix + "table_ids"))
+    basenames = snapshot.get_strings(prefix + "added_basenames")
+    table_ids = snapshot.get_array(prefix + "added_table_ids")
+    for i in range(len(basenames)):
+      slave._added[basenames[i].lower()] = (basenames[i], table_ids[i])
+    return slave
+
+  def get_snapshot_sections(self, prefix):
+    sections = self.shard.get_snapshot_sections(prefix)
+    sections[prefix + "basenames"] = self._basenames
+    sections[prefix + "table_ids"] = self._table_ids
+    added = self._added.values()
+    sections[prefix + "added_basenames"] = [basename for basename, table_id in added]
+    sections[prefix + "added_table_ids"] = array.array('i', [table_id for basename, table_id in added])
+    return sections
+
+  def add_basenames(self, basenames, basename_ids):
+    for i in range(len(basenames)):
+      self._added.setdefault(basenames[i].lower(), (basenames[i], basename_ids[i]))
+    self.shard.add_basenames(basenames)
+
+  def search_ranked_ids(self, basename_query, max_hits = None):
+    """
+    Like DBIndexShard.search_basenames, but ranks the hits. Returns (ids,
+    ranks, truncated) where ids is an array of the basename ids of the best
+    max_hits hits, best first, and ranks is an array of their ranks.
+    """
+    lower_hits, truncated = self.shard.search_basenames(basename_query)
+    lower_basenames = self.shard.lower_basenames
+    table_id_by_basename = {}
+    for lower_hit in lower_hits:
+      i = bisect.bisect_left(lower_basenames, lower_hit)
+      if i < len(lower_basenames) and lower_basenames[i] == lower_hit:
+        table_id_by_basename[self._basenames[i]] = self._table_ids[i]
+      else:
+        basename, table_id = self._added[lower_hit]
+        table_id_by_basename[basename] = table_id
+    ranked_hits = rank_basenames(basename_query, table_id_by_basename.keys(), max_hits)
+    ids = array.array('i', [table_id_by_basename[basename] for basename, rank in ranked_hits])
+    ranks = array.array('d', [rank for basename, rank in ranked_hits])
+    return ids, ranks, truncated
+
+def ShardInit(key, all_basenames, basename_ids, engine):
+  slaves[key] = ShardSlave.create(all_basenames, basename_ids, engine)
+
+def ShardInitFromSnapshot(key, snapshot_filename, prefix, engine):
+  snapshot = index_snapshot.IndexSnapshot(snapshot_filename)
+  try:
+    slaves[key] = ShardSlave.from_snapshot(snapshot, prefix, engine)
+  finally:
+    snapshot.close()
+
+def ShardCheckInit(key):
+  assert key in slaves
+
+def ShardClose(key):
+  slaves.pop(key, None)
+
+def ShardGetSnapshotSections(key, prefix):
+  return slaves[key].get_snapshot_sections(prefix)
+
+def ShardAddBasenames(key, basenames, basename_ids):
+  slaves[key].add_basenames(basenames, basename_ids)
+
+def ShardSetBasenamesRemoved(key, removed_lower_basenames, restored_lower_basenames):
+  slaves[key].shard.set_basenames_removed(removed_lower_basenames, restored_lower_basenames)
+
+def ShardSearchRankedIds(key, basename_query, max_hits):
   global slave_searchcount
-  ret = slave.search_basenames(basename_query)
+  ret = slaves[key].search_ranked_ids(basename_query, max_hits)
   slave_searchcount += 1
   if trace_is_enabled() and slave_searchcount % 10 == 0:
     trace_flush()
@@ -36,31 +141,146 @@ def ShardSearchBasenames(basename_query):
 class DBShardManager(object):
   """
   The DBShardManager takes a complete list of basenames in the database and manages the sharding
-  of those basenames using the multiprocessing module.
+  of those basenames across shard_transport.ShardProcesses.
+
+  The files themselves are kept in self.file_table, a FileTable.
+
+  engine is the db_index_shard engine that every shard should use.
+
+  num_shards is how many shards to split the basenames across, or 0 to have
+  shard_planner pick it. With one shard, there are no shard processes.
+
+  If snapshot is given, it must be an IndexSnapshot written by write_snapshot.
+  The files and shards are then loaded from it and indexer is not used.
   """
-  def __init__(self, indexer):
+  def __init__(self, indexer, engine = db_index_shard.ENGINE_REGEX, snapshot = None, num_shards = 0):
+    if snapshot:
+      self._init_from_snapshot(snapshot)
+      return
+
+    self._key = _next_shard_manager_key.next()
     self.dirs = indexer.dirs
-    self.files = []
-    self.files_by_lower_basename = dict()
-    for basename,files_with_basename in indexer.files_by_basename.items():
+    self.file_table = indexer.file_table
+    self.engine = engine
+
+    # The shards pick their basenames out of the file table's by id.
+    basenames = self.file_table.basenames
+    if num_shards > 0:
+      self.shard_plan = "set"
+    else:
+      num_shards = shard_planner.plan_num_shards_for(basenames, engine)
+      self.shard_plan = "auto"
+    chunks = self._make_chunks(range(len(basenames)), num_shards)
+    self._create_shards([(ShardInit, (self._key, basenames, chunk, engine)) for chunk in chunks])
+    self._next_shard_for_added_basenames = 0
+
+  def _init_from_snapshot(self, snapshot):
+    self._key = _next_shard_manager_key.next()
+    self.dirs = snapshot.header["dirs"]
+    self.file_table = FileTable.from_snapshot(snapshot, "file_table.")
+    self.engine = snapshot.header["engine"]
+    self.shard_plan = snapshot.header["shard_plan"]
+
+    # Each shard reads its own sections out of the snapshot, so that nothing
+    # big has to be sent to the shard processes.
+    N = snapshot.header["num_shards"]
+    try:
+      self._create_shards([(ShardInitFromSnapshot, (self._key, snapshot.filename, "shard%i." % i, self.engine))
+                           for i in range(N)])
+    except Exception, ex:
+      # Shard processes report their errors as plain Exceptions.
+      raise index_snapshot.SnapshotException("Could not load the shards: %s" % ex)
+    self._next_shard_for_added_basenames = 0
+
+  def _create_shards(self, inits):
+    """
+    Creates a shard for each (ShardInit function, args) in inits. The first
+    one is local; the others are ShardProcesses that initialize themselves
+    while it is built, with args inherited through the fork rather than
+    pickled.
+    """
+    self.shards = [LocalPool(1)]
+    for init_fn, args in inits[1:]:
+      self.shards.append(ShardProcess(init_fn, args, ShardSearchRankedIds))
+    try:
+      init_fn, args = inits[0]
+      self.shards[0].apply(init_fn, args)
+      # Tasks run after the initializer, so this waits for every shard.
+      for shard in self.shards[1:]:
+        shard.apply(ShardCheckInit, (self._key,))
+    except:
+      self.close()
+      raise
+
+  def apply_delta(self, delta):
+    """
+    Updates the files and shards with the changes in delta, an IndexDelta.
+    Returns the number of files that were added or removed.
+
+    The shards keep the basenames of removed files, but stop searching for
+    the ones that no file has anymore, so that they don't crowd out hits that
+    do. Until the next reindex, each removal leaves the file table and the
+    shards a little bigger.
+    """
+    removed_file_ids = []
+    for d in delta.removed_dirs:
+      removed_file_ids.extend(self.file_table.remove_files_under(d))
+    for f in delta.removed_files:
+      file_id = self.file_table.remove_file(f)
+      if file_id != None:
+        removed_file_ids.append(file_id)
+
+    new_basenames = []
+    restored_lower_basenames = set()
+    num_added = 0
+    for f in delta.added_files:
+      if self.file_table.find_file(f) != None:
+        continue
+      basename = os.path.basename(f)
       lower_basename = basename.lower()
-      if lower_basename in self.files_by_lower_basename:
-        self.files_by_lower_basename[lower_basename].extend(files_with_basename)
+      if not self.file_table.has_lower_basename(lower_basename):
+        new_basenames.append(basename)
       else:
-        self.files_by_lower_basename[lower_basename] = files_with_basename
-      self.files.extend(files_with_basename)
+        restored_lower_basenames.add(lower_basename)
+      self.file_table.add_file(f)
+      num_added += 1
 
-    N = min(multiprocessing.cpu_count(), 4) # Arbitrary limit to 4-threads.
+    removed_lower_basenames = set()
+    for file_id in removed_file_ids:
+      lower_basename = self.file_table.get_basename(file_id).lower()
+      if lower_basename in removed_lower_basenames or lower_basename in restored_lower_basenames:
+        continue
+      if len(self.file_table.get_file_ids_with_lower_basename(lower_basename)) == 0:
+        removed_lower_basenames.add(lower_basename)
+    if len(removed_lower_basenames) or len(restored_lower_basenames):
+      # Any shard may have the basename, so they all hear about it.
+      args = (self._key, list(removed_lower_basenames), list(restored_lower_basenames))
+      for shard in self.shards:
+        shard.apply(ShardSetBasenamesRemoved, args)
 
-    chunks = self._make_chunks(list(indexer.files_by_basename.keys()), N)
+    if len(new_basenames):
+      new_basename_ids = [self.file_table.get_basename_id(b) for b in new_basenames]
+      shard = self.shards[self._next_shard_for_added_basenames]
+      shard.apply(ShardAddBasenames, (self._key, new_basenames, new_basename_ids))
+      self._next_shard_for_added_basenames = (self._next_shard_for_added_basenames + 1) % len(self.shards)
+    return len(removed_file_ids) + num_added
 
-    self.shards = [LocalPool(1)]
-    self.shards.extend([multiprocessing.Pool(1) for x in range(len(chunks)-1)])
+  def write_snapshot(self, filename, header):
+    """
+    Writes the files and the indices of every shard to filename, along with the
+    json-able dict header. The snapshot can be loaded with
+    DBShardManager(None, snapshot=IndexSnapshot(filename)).
+    """
+    full_header = dict(header)
+    full_header["dirs"] = self.dirs
+    full_header["engine"] = self.engine
+    full_header["num_shards"] = len(self.shards)
+    full_header["shard_plan"] = self.shard_plan
 
+    sections = self.file_table.get_snapshot_sections("file_table.")
     for i in range(len(self.shards)):
-      chunk = chunks[i]
-      shard = self.shards[i]
-      shard.apply(ShardInit, (chunk,))
+      sections.update(self.shards[i].apply(ShardGetSnapshotSections, (self._key, "shard%i." % i)))
+    index_snapshot.write_snapshot(filename, full_header, sections)
 
   def _make_chunks(self, items, N):
     base = 0
@@ -76,19 +296,28 @@ class DBShardManager(object):
     chunks[0].extend(items[base:])
     return chunks
 
+  @property
+  def file_tables(self):
+    return [self.file_table]
+
+  @property
+  def num_shards(self):
+    return len(self.shards)
+
   @property
   def status(self):
-    return "%i files indexed; %i-threaded searches" % (len(self.files), len(self.shards))
+    return "%i files indexed; %i-threaded searches (%s)" % (self.file_table.num_files, len(self.shards), self.shard_plan)
 
   def close(self):
     for p in self.shards:
+      p.apply(ShardClose, (self._key,))
       p.close()
       try:
         p.join()
       except:
         p.terminate()
-    # Actually "delete" the shards. Some multiprocessing.Pool implementations
-    # dont clean up their fd resources.
+    # Actually "delete" the shards. LocalPool keeps nothing to clean up, and
+    # ShardProcess.close already closed its pipes.
     del self.shards
 
   def search_basenames(self, basename_query):
@@ -96,25 +325,54 @@ class DBShardManager(object):
     Searches all controlled index shards for basenames matching the query.
 
     Returns (hits, truncated) where:
-       hits is an array of basenames that matched.
+       hits is an array of lower basenames that matched.
        truncated is a bool indicated whether not all possible matches were found.
     """
-    shard_result_handles = []
-    # Run the search in parallel across the shards.
+    hits, truncated = self.search_ranked_basenames(basename_query)
+    return [basename.lower() for basename, rank in hits], truncated
+
+  def search_ranked_basenames(self, basename_query, max_hits = None):
+    """
+    Like search_basenames, but the hits are (basename, rank) pairs ordered
+    best first, and only the best max_hits of them are returned if it is
+    given. Each shard ranks its own hits and sends back its best max_hits.
+    """
+    return self.begin_search_ranked_basenames(basename_query, max_hits).get()
+
+  def begin_search_ranked_basenames(self, basename_query, max_hits = None):
+    """
+    Starts search_ranked_basenames on all the shards without waiting for them.
+    Returns a RankedBasenameSearch whose get() returns what
+    search_ranked_basenames would.
+    """
+    # Run the search in parallel across the shards. The local shard searches
+    # when its result is asked for, after the others have been sent the query.
     trace_begin("issue_search")
-    for i in range(len(self.shards)):
-      shard = self.shards[i]
-      shard_result_handles.append(shard.apply_async(ShardSearchBasenames, (basename_query,)))
+    shard_result_handles = [self.shards[0].apply_async(ShardSearchRankedIds, (self._key, basename_query, max_hits))]
+    for shard in self.shards[1:]:
+      shard_result_handles.append(shard.begin_search(self._key, basename_query, max_hits))
     trace_end("issue_search")
+    return RankedBasenameSearch(self.file_table, shard_result_handles, max_hits)
+
+class RankedBasenameSearch(object):
+  """
+  Merges the ranked results of basename searches that are running on
+  shards, which answer with basename ids in file_table.
+  """
+  def __init__(self, file_table, handles, max_hits):
+    self._file_table = file_table
+    self._handles = handles
+    self._max_hits = max_hits
 
-    # union the results
+  def get(self):
     trace_begin("gather_results")
-    base_hits = set()
+    basenames = self._file_table.basenames
+    ranked_lists = []
     truncated = False
-    for shard_result_handle in shard_result_handles:
-      (shard_hits, shard_hits_truncated) = shard_result_handle.get()
+    for handle in self._handles:
+      (shard_ids, shard_ranks, shard_hits_truncated) = handle.get()
       truncated |= shard_hits_truncated
-      for hit in shard_hits:
-        base_hits.add(hit)
+      ranked_lists.append([(basenames[shard_ids[i]], shard_ranks[i]) for i in range(len(shard_ids))])
+    hits = merge_ranked_basenames(ranked_lists, self._max_hits)
     trace_end("gather_results")
-    return list(base_hits), truncated
+    return hits, truncated
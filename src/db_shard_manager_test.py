@@ -15,9 +15,12 @@ import sys
 import unittest
 import time
 
+from src import db_index_shard
 from src import db_shard_manager
 from src import mock_db_indexer
 
+from index_delta import IndexDelta
+
 from query import Query
 from query_cache import QueryCache
 
@@ -34,9 +37,11 @@ class DBShardManagerTest(unittest.TestCase):
     self.shard_manager = db_shard_manager.DBShardManager(mock_indexer)
 
   def test_props(self):
-    self.assertEquals(set(self.files),set(self.shard_manager.files))
+    file_table = self.shard_manager.file_table
+    self.assertEquals(set(self.files),set(file_table.iterfilenames()))
     self.assertEquals(set(["a/dsfsfd.txt", "k/dsfsfd.txt"]),
-                      set(self.shard_manager.files_by_lower_basename["dsfsfd.txt"]))
+                      set([file_table.get_filename(i) for i in
+                           file_table.get_file_ids_with_lower_basename("dsfsfd.txt")]))
 
   def test_smoketest_basename_search(self):
     """
@@ -46,6 +51,90 @@ class DBShardManagerTest(unittest.TestCase):
     self.assertEquals(set(["csdf.txt", "sdf.txt"]), set(res))
     self.assertFalse(truncated)
 
+  def test_suffix_array_engine(self):
+    mock_indexer = mock_db_indexer.MockDBIndexer(["a/", "k/"], self.files)
+    shard_manager = db_shard_manager.DBShardManager(mock_indexer, db_index_shard.ENGINE_SUFFIX_ARRAY)
+    try:
+      res, truncated = shard_manager.search_basenames("sdf")
+      self.assertEquals(set(["csdf.txt", "sdf.txt"]), set(res))
+      self.assertFalse(truncated)
+    finally:
+      shard_manager.close()
+
+  def test_apply_delta(self):
+    delta = IndexDelta()
+    delta.add_file("a/xyzzy.txt")
+    delta.add_file("k/CSDF.txt")
+    delta.remove_file("k/sdf.txt")
+    delta.remove_dir("a/b")
+    self.shard_manager.apply_delta(delta)
+
+    file_table = self.shard_manager.file_table
+    self.assertEquals(set(["a/dsfsfd.txt", "k/dsfsfd.txt", "a/xyzzy.txt", "k/CSDF.txt"]),
+                      set(file_table.iterfilenames()))
+    res, truncated = self.shard_manager.search_basenames("xyz")
+    self.assertEquals(["xyzzy.txt"], res)
+    res, truncated = self.shard_manager.search_basenames("xzy")
+    self.assertEquals(["xyzzy.txt"], res)
+
+  def test_removed_basenames_dont_crowd_out_hits(self):
+    files = ["r/a/foobar%02i.cc" % i for i in range(40)] + ["r/b/xfooby.cc"]
+    shard_manager = db_shard_manager.DBShardManager(mock_db_indexer.MockDBIndexer(["r/"], files), num_shards=1)
+    try:
+      delta = IndexDelta()
+      delta.remove_dir("r/a")
+      self.assertEquals(40, shard_manager.apply_delta(delta))
+      res, truncated = shard_manager.search_basenames("foo")
+      self.assertEquals(["xfooby.cc"], res)
+      self.assertFalse(truncated)
+
+      # A basename that a file gets again is found again.
+      delta = IndexDelta()
+      delta.add_file("r/c/FOOBAR07.cc")
+      self.assertEquals(1, shard_manager.apply_delta(delta))
+      res, truncated = shard_manager.search_basenames("foobar")
+      self.assertEquals(["foobar07.cc"], res)
+    finally:
+      shard_manager.close()
+
+  def test_removed_basenames_in_shard_processes(self):
+    shard_manager = db_shard_manager.DBShardManager(mock_db_indexer.MockDBIndexer(["a/", "k/"], self.files),
+                                                    num_shards=3)
+    try:
+      delta = IndexDelta()
+      delta.remove_file("k/sdf.txt")
+      delta.remove_file("a/dsfsfd.txt")
+      shard_manager.apply_delta(delta)
+      res, truncated = shard_manager.search_basenames("sdf")
+      self.assertEquals(["csdf.txt"], res)
+      # k/dsfsfd.txt still has the basename.
+      res, truncated = shard_manager.search_basenames("dsf")
+      self.assertEquals(["dsfsfd.txt"], res)
+    finally:
+      shard_manager.close()
+
+  def test_shard_processes(self):
+    mock_indexer = mock_db_indexer.MockDBIndexer(["a/", "k/"], self.files)
+    shard_manager = db_shard_manager.DBShardManager(mock_indexer, num_shards=3)
+    other_shard_manager = db_shard_manager.DBShardManager(mock_db_indexer.MockDBIndexer(["x/"], ["x/sdfx.txt"]),
+                                                          num_shards=3)
+    self.assertRaises(Exception, lambda: db_shard_manager.DBShardManager(mock_indexer, "no_such_engine", num_shards=3))
+    try:
+      self.assertEquals(3, shard_manager.num_shards)
+      res, truncated = shard_manager.search_basenames("sdf")
+      self.assertEquals(set(["csdf.txt", "sdf.txt"]), set(res))
+      res, truncated = other_shard_manager.search_basenames("sdf")
+      self.assertEquals(["sdfx.txt"], res)
+
+      res, truncated = shard_manager.search_ranked_basenames("sdf")
+      self.assertEquals(["sdf.txt", "csdf.txt"], [basename for basename, rank in res])
+      self.assertTrue(res[0][1] > res[1][1])
+      res, truncated = shard_manager.search_ranked_basenames("sdf", 1)
+      self.assertEquals(["sdf.txt"], [basename for basename, rank in res])
+    finally:
+      shard_manager.close()
+      other_shard_manager.close()
+
   def test_chunker(self):
     def validate(num_items,nchunks):
       start_list = [i for i in range(num_items)]
@@ -20,11 +20,13 @@ import urlparse
 from trace_event import *
 from query import Query
 
+# Seconds between checks for changes to the indexed dirs.
+WATCHER_POLL_INTERVAL = 0.5
 
 # TODO(nduca): is Stub the right word for this class? Mehh
 class DBStub(object):
-  def __init__(self, settings, server):
-    self.db = db.DB(settings)
+  def __init__(self, settings, server, snapshot_filename = None):
+    self.db = db.DB(settings, snapshot_filename, watch_for_changes=True)
     self.db.needs_indexing.add_listener(self.on_db_needs_indexing)
     self.server = server
 
@@ -43,6 +45,7 @@ class DBStub(object):
     server.add_json_route('/set_oauth', self.set_oauth, ['POST'])
     if not self.db.is_up_to_date:
       self.on_db_needs_indexing()
+    self.server.add_delayed_task(self._step_watcher, WATCHER_POLL_INTERVAL)
 
   def on_db_needs_indexing(self):
     self.server.add_delayed_task(self._index_a_bit_more, 0.05)
@@ -53,6 +56,10 @@ class DBStub(object):
       self.server.add_delayed_task(self._index_a_bit_more, 0.25)
       self.db.step_indexer()
 
+  def _step_watcher(self):
+    self.server.add_delayed_task(self._step_watcher, WATCHER_POLL_INTERVAL)
+    self.db.step_watcher()
+
   def add_dir(self, m, verb, data):
     d = self.db.add_dir(data["path"])
     return {"id": d.id,
@@ -12,13 +12,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import db
+import db_indexer
+import db_partition
+import inotify_watcher
+import mtime_rescanner
 import os
 import settings
 import tempfile
+import threading
+import time
 import unittest
 
 from db_test_base import DBTestBase
 
+class _HalfwayIndexer(db_indexer.DBIndexer):
+  """Finds files until it is halfway, then waits to be let go on."""
+  def __init__(self, dirs, first_files, other_files):
+    super(_HalfwayIndexer, self).__init__(dirs)
+    self.first_files = first_files
+    self.other_files = other_files
+    self.may_finish = threading.Event()
+    self.hints = []
+
+  @property
+  def progress(self):
+    return "halfway"
+
+  def prioritize_paths(self, paths):
+    self.hints.append(paths)
+
+  def index_a_bit_more(self):
+    if self.first_files:
+      for f in self.first_files:
+        self.file_table.add_file(f)
+      self.first_files = None
+    elif self.may_finish.wait(0.01):
+      for f in self.other_files:
+        self.file_table.add_file(f)
+      self.complete = True
+
 # Tests are actually in DBTestBase
 class DBTest(DBTestBase, unittest.TestCase):
   def setUp(self):
@@ -53,6 +85,267 @@ class DBTest(DBTestBase, unittest.TestCase):
     self.assertEquals(1, len(res.filenames))
     self.assertEquals(os.path.join(self.test_data_dir, 'something/something_file.txt'), res.filenames[0])
 
+  def test_old_index_serves_searches_during_reindex(self):
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    d2 = os.path.join(self.test_data_dir, 'something')
+    self.db.add_dir(d1)
+    self.db.sync()
+    self.db.add_dir(d2)
+    self.db.step_indexer()
+    self.assertFalse(self.db.is_up_to_date)
+    self.assertEquals([os.path.join(d1, 'MySubSystem.c')],
+                      self.db.search('MySubSystem.c').filenames)
+    self.db.sync()
+    self.assertEquals([os.path.join(d2, 'something_file.txt')],
+                      self.db.search('something_file.txt').filenames)
+
+  def test_add_dir_indexes_only_the_new_root(self):
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    d2 = os.path.join(self.test_data_dir, 'something')
+    self.db.add_dir(d1)
+    self.db.sync()
+    d1_shard_manager = self.db._partitions[d1].shard_manager
+    self.db.add_dir(d2)
+    self.assertFalse(self.db.is_up_to_date)
+    self.assertTrue(self.db._partitions[d1].is_up_to_date)
+    while not self.db.is_up_to_date:
+      self.db.step_indexer(timeout = 0.1)
+    self.assertTrue(self.db._partitions[d1].shard_manager is d1_shard_manager)
+    self.assertEquals([os.path.join(d2, 'something_file.txt')],
+                      self.db.search('something_file.txt').filenames)
+    self.assertEquals([os.path.join(d1, 'MySubSystem.c')],
+                      self.db.search('MySubSystem.c').filenames)
+
+  def test_delete_dir_needs_no_reindex(self):
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    d2 = os.path.join(self.test_data_dir, 'something')
+    self.db.add_dir(d1)
+    d2_ = self.db.add_dir(d2)
+    self.db.sync()
+    self.db.delete_dir(d2_)
+    self.assertTrue(self.db.is_up_to_date)
+    self.assertEquals([], self.db.search('something_file.txt').filenames)
+    self.assertEquals([os.path.join(d1, 'MySubSystem.c')],
+                      self.db.search('MySubSystem.c').filenames)
+
+  def test_deleting_outer_dir_indexes_nested_one(self):
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    outer_ = self.db.add_dir(self.test_data_dir)
+    self.db.add_dir(d1)
+    self.db.sync()
+    self.db.delete_dir(outer_)
+    self.assertFalse(self.db.is_up_to_date)
+    self.db.sync()
+    self.assertEquals([], self.db.search('something_file.txt').filenames)
+    self.assertEquals([os.path.join(d1, 'MySubSystem.c')],
+                      self.db.search('MySubSystem.c').filenames)
+
+  def test_ignore_changes_filter_the_index(self):
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    self.db.add_dir(d1)
+    self.db.sync()
+    shard_manager = self.db._partitions[d1].shard_manager
+
+    self.db.ignore('*.c')
+    self.db.ignore('module')
+    self.assertTrue(self.db.is_up_to_date)
+    self.assertEquals([], self.db.search('MySubSystem.c').filenames)
+    self.assertEquals([], self.db.search('test.cc').filenames)
+    self.assertEquals([os.path.join(d1, 'MySubSystem.h')],
+                      self.db.search('MySubSystem.h').filenames)
+
+    self.db.unignore('*.c')
+    self.db.unignore('module')
+    self.assertTrue(self.db.is_up_to_date)
+    self.assertEquals([os.path.join(d1, 'MySubSystem.c')],
+                      self.db.search('MySubSystem.c').filenames)
+    self.assertEquals([os.path.join(d1, 'module/test.cc')],
+                      self.db.search('test.cc').filenames)
+    self.assertTrue(self.db._partitions[d1].shard_manager is shard_manager)
+
+  def test_removing_walked_ignore_reindexes(self):
+    d1 = os.path.join(self.test_data_dir, 'something')
+    self.db.add_dir(d1)
+    self.db.sync()
+    self.assertEquals([], self.db.search('ignored.o').filenames)
+    self.db.unignore('*.o')
+    self.assertFalse(self.db.is_up_to_date)
+    self.db.sync()
+    self.assertEquals([os.path.join(d1, 'ignored.o')],
+                      self.db.search('ignored.o').filenames)
+
+  def test_shards_setting(self):
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    self.db.add_dir(d1)
+    self.db.sync()
+    self.assertTrue(self.db.status().status.endswith("-threaded searches (auto)"))
+
+    self.db.shards = 2
+    self.assertFalse(self.db.is_up_to_date)
+    self.db.sync()
+    self.assertEquals(2, self.db._partitions[d1].shard_manager.num_shards)
+    self.assertTrue(self.db.status().status.endswith("2-threaded searches (set)"))
+    self.assertEquals([os.path.join(d1, 'MySubSystem.c')],
+                      self.db.search('MySubSystem.c').filenames)
+
+    self.db.shards = 2
+    self.assertTrue(self.db.is_up_to_date)
+
+  def test_search_during_first_time_sync(self):
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    indexer = _HalfwayIndexer([d1],
+                              [os.path.join(d1, 'MySubSystem.c')],
+                              [os.path.join(d1, 'MyClass.c')])
+    orig_create = db_indexer.Create
+    db_indexer.Create = lambda dirs, dir_cache: indexer
+    try:
+      self.db.add_dir(d1)
+      self.db.step_indexer()
+      for i in range(100):
+        res = self.db.search('MySubSystem.c',
+                             current_filename=os.path.join(d1, 'foo.c'))
+        if len(res.filenames):
+          break
+        time.sleep(0.01)
+      self.assertEquals([os.path.join(d1, 'MySubSystem.c')], res.filenames)
+      self.assertTrue(res.truncated)
+      self.assertEquals([], self.db.search('MyClass.c').filenames)
+      # The indexer thread passes the hint on between steps.
+      for i in range(100):
+        if [os.path.join(d1, 'foo.c')] in indexer.hints:
+          break
+        time.sleep(0.01)
+      self.assertTrue([os.path.join(d1, 'foo.c')] in indexer.hints)
+
+      indexer.may_finish.set()
+      while not self.db.is_up_to_date:
+        self.db.step_indexer(timeout = 0.1)
+    finally:
+      db_indexer.Create = orig_create
+    res = self.db.search('MyClass.c')
+    self.assertEquals([os.path.join(d1, 'MyClass.c')], res.filenames)
+    self.assertFalse(res.truncated)
+
+  def test_snapshot_is_used_after_restart(self):
+    snapshot_filename = self.settings_file.name + '.snapshot'
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    settings1 = settings.Settings(self.settings_file.name)
+    db1 = db.DB(settings1, snapshot_filename)
+    try:
+      db1.add_dir(d1)
+      db1.sync()
+    finally:
+      db1.close()
+
+    settings2 = settings.Settings(self.settings_file.name)
+    db2 = db.DB(settings2, snapshot_filename)
+    try:
+      self.assertTrue(db2.has_index)
+      self.assertFalse(db2.is_up_to_date)
+      res = db2.search('MySubSystem.c')
+      self.assertEquals([os.path.join(d1, 'MySubSystem.c')], res.filenames)
+    finally:
+      db2.close()
+
+    # A corrupt snapshot is ignored, and the dir is indexed again.
+    partition_snapshot_filename = db_partition.get_partition_snapshot_filename(snapshot_filename, d1)
+    data = open(partition_snapshot_filename, 'rb').read()
+    open(partition_snapshot_filename, 'wb').write(data[:-1] + '\xff')
+    settings4 = settings.Settings(self.settings_file.name)
+    db4 = db.DB(settings4, snapshot_filename)
+    try:
+      self.assertFalse(db4.has_index)
+      db4.sync()
+      res = db4.search('MySubSystem.c')
+      self.assertEquals([os.path.join(d1, 'MySubSystem.c')], res.filenames)
+    finally:
+      db4.close()
+
+    # A snapshot of different dirs must not be served.
+    settings3 = settings.Settings(self.settings_file.name)
+    settings3.register('dirs', list, [])
+    settings3.dirs = [os.path.join(self.test_data_dir, 'something')]
+    db3 = db.DB(settings3, snapshot_filename)
+    try:
+      self.assertFalse(db3.has_index)
+    finally:
+      db3.close()
+    os.unlink(db_partition.get_partition_snapshot_filename(snapshot_filename, d1))
+
+  def test_watcher_updates_index(self):
+    if not inotify_watcher.Supported():
+      return
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    settings1 = settings.Settings(self.settings_file.name)
+    db1 = db.DB(settings1, watch_for_changes=True)
+    try:
+      db1.add_dir(d1)
+      db1.sync()
+      self.assertEquals(0, len(db1.search('MySubSystem_NEW.c').filenames))
+
+      self.test_data.write1('project1/MySubSystem_NEW.c')
+      os.unlink(os.path.join(d1, 'MySubSystem.c'))
+      db1.step_watcher() # what DBStub does periodically
+      time.sleep(0.3) # let the watcher consider the changes settled
+      db1.step_watcher()
+      self.assertEquals([os.path.join(d1, 'MySubSystem_NEW.c')],
+                        db1.search('MySubSystem_NEW.c').filenames)
+      self.assertEquals([], db1.search('MySubSystem.c', exact_match=True).filenames)
+      self.assertTrue(db1.is_up_to_date)
+    finally:
+      db1.close()
+
+  def test_rescanner_updates_index(self):
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    settings1 = settings.Settings(self.settings_file.name)
+    old_supported = inotify_watcher.Supported
+    old_sweep_interval = mtime_rescanner.DEFAULT_SWEEP_INTERVAL
+    inotify_watcher.Supported = lambda: False
+    mtime_rescanner.DEFAULT_SWEEP_INTERVAL = 0.1
+    db1 = db.DB(settings1, watch_for_changes=True)
+    try:
+      db1.add_dir(d1)
+      db1.sync()
+      self.test_data.write1('project1/MySubSystem_NEW.c')
+      os.unlink(os.path.join(d1, 'MySubSystem.c'))
+      deadline = time.time() + 5
+      while (len(db1.search('MySubSystem_NEW.c').filenames) == 0 and
+             time.time() < deadline):
+        time.sleep(0.05)
+        db1.step_watcher()
+      self.assertEquals([os.path.join(d1, 'MySubSystem_NEW.c')],
+                        db1.search('MySubSystem_NEW.c').filenames)
+      self.assertEquals([], db1.search('MySubSystem.c', exact_match=True).filenames)
+    finally:
+      inotify_watcher.Supported = old_supported
+      mtime_rescanner.DEFAULT_SWEEP_INTERVAL = old_sweep_interval
+      db1.close()
+
+  def test_watcher_churn_reindexes(self):
+    if not inotify_watcher.Supported():
+      return
+    d1 = os.path.join(self.test_data_dir, 'project1')
+    settings1 = settings.Settings(self.settings_file.name)
+    db1 = db.DB(settings1, watch_for_changes=True)
+    old_churn = (db_partition.MIN_WATCHER_CHURN_FOR_REINDEX, db_partition.WATCHER_CHURN_FRACTION_FOR_REINDEX)
+    db_partition.MIN_WATCHER_CHURN_FOR_REINDEX = 0
+    db_partition.WATCHER_CHURN_FRACTION_FOR_REINDEX = 0
+    try:
+      db1.add_dir(d1)
+      db1.sync()
+
+      self.test_data.write1('project1/MySubSystem_NEW.c')
+      db1.step_watcher()
+      time.sleep(0.3)
+      db1.step_watcher()
+      self.assertFalse(db1.is_up_to_date)
+      db1.sync()
+      self.assertEquals([os.path.join(d1, 'MySubSystem_NEW.c')],
+                        db1.search('MySubSystem_NEW.c').filenames)
+    finally:
+      (db_partition.MIN_WATCHER_CHURN_FOR_REINDEX, db_partition.WATCHER_CHURN_FRACTION_FOR_REINDEX) = old_churn
+      db1.close()
+
   def tearDown(self):
     DBTestBase.tearDown(self)
     self.db.close()
@@ -205,9 +205,12 @@ class DBTestBase(object):
     res = self.db.search('svn_should_not_show_up.txt')
     self.assertEquals(1, len(res.filenames))
 
+    # Adding ignores back filters the index instead of walking it again.
     for i in orig:
       self.db.ignore(i)
-    self.assertFalse(self.db.is_up_to_date)
+    self.assertTrue(self.db.is_up_to_date)
+    res = self.db.search('svn_should_not_show_up.txt')
+    self.assertEquals(0, len(res.filenames))
     self.db.sync()
     self.assertTrue(self.db.has_index and self.db.is_up_to_date)
 
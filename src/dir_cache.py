@@ -12,7 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
-import fnmatch
+
+from ignore_matcher import IgnoreMatcher
+
+def _encode_path(d):
+  # Entries are handed out as unicode, but paths built from them can't be
+  # passed to os functions as-is when the filesystem encoding is ascii.
+  if isinstance(d, unicode):
+    return d.encode('utf8')
+  return d
+
+def fix_ignores(ignores):
+  """Returns ignores with the path globs made absolute and real."""
+  def fixpath(p):
+    if p.find(os.path.sep) != -1:
+      tmp = os.path.expanduser(p)
+      return os.path.realpath(tmp)
+    else:
+      return p
+  return [fixpath(i) for i in ignores]
 
 class DirEnt(object):
   def __init__(self, st_mtime, ents):
@@ -24,17 +42,13 @@ class DirCache(object):
     self.dirs = dict()
     self.rel_to_real = dict()
     self.ignores = []
+    self._ignore_matcher = IgnoreMatcher([])
 
   def set_ignores(self, ignores):
     if self.ignores != ignores:
       self.dirs = dict()
-      def fixpath(p):
-        if p.find(os.path.sep) != -1:
-          tmp = os.path.expanduser(p)
-          return os.path.realpath(tmp)
-        else:
-          return p
-      self.ignores = [fixpath(i) for i in ignores]
+      self.ignores = fix_ignores(ignores)
+      self._ignore_matcher = IgnoreMatcher(self.ignores)
 
   def reset_realpath_cache(self):
     self.rel_to_real = dict()
@@ -48,14 +62,11 @@ class DirCache(object):
       return r
 
   def is_ignored(self, basename, fullname):
-    for i in self.ignores:
-      if i.find(os.path.sep) != -1:
-        if fnmatch.fnmatch(fullname, i):
-          return True
-      else:
-        if fnmatch.fnmatch(basename, i):
-          return True
-    return False
+    return self._ignore_matcher.is_ignored(basename, fullname)
+
+  def is_dir_ignored(self, basename, fullname):
+    """True if the dir should not be walked at all."""
+    return self._ignore_matcher.is_dir_ignored(basename, fullname)
 
   def iterdirnames(self):
     return self.dirs.iterkeys()
@@ -71,7 +82,7 @@ class DirCache(object):
     if d in self.dirs:
       de = self.dirs[d]
       try:
-        st_mtime = os.stat(d).st_mtime
+        st_mtime = os.stat(_encode_path(d)).st_mtime
       except OSError:
         st_mtime = 0
         del self.dirs[d]
@@ -88,9 +99,9 @@ class DirCache(object):
     else:
       # directory is not in cache...
       try:
-        st = os.stat(d)
+        st = os.stat(_encode_path(d))
         st_mtime = st.st_mtime
-        ents = [e.decode('utf8') for e in os.listdir(d)]
+        ents = [e.decode('utf8') for e in os.listdir(_encode_path(d))]
       except OSError:
         return ([], False)
 
@@ -99,6 +110,31 @@ class DirCache(object):
       self.dirs[d] = de
       return (de.ents, True)
 
+  def listdir_with_changes(self, d):
+    """
+    Lists contents of a dir, but only using its realpath, and compares them to
+    the last listing of the dir.
+
+    Returns tuple ([array of entries], [added entries], [removed entries])
+
+    A dir that was not listed before has all its entries added, and one that
+    went away has all its previous entries removed. As with
+    listdir_with_changed_status, the dir is only relisted if its st_mtime
+    changed.
+    """
+    if d in self.dirs:
+      old_ents = self.dirs[d].ents
+    else:
+      old_ents = []
+    ents, changed = self.listdir_with_changed_status(d)
+    if ents is old_ents:
+      return (ents, [], [])
+    old_ents_set = set(old_ents)
+    ents_set = set(ents)
+    added = [e for e in ents if e not in old_ents_set]
+    removed = [e for e in old_ents if e not in ents_set]
+    return (ents, added, removed)
+
   def listdir(self, d):
     """Lists contents of a dir, but only using its realpath."""
     return self.listdir_with_changed_status(d)[0]
@@ -76,4 +76,16 @@ class DirCacheTest(unittest.TestCase):
     self.test_data.write2('READMEx')
     self.assertFalse(c.listdir_with_changed_status(base)[1])
 
-
+  def test_listdir_with_changes(self):
+    c = DirCache()
+    base = self.test_data.path_to('');
+    ents, added, removed = c.listdir_with_changes(base)
+    self.assertEquals(set(ents), set(added))
+    self.assertEquals([], removed)
+    self.assertEquals((ents, [], []), c.listdir_with_changes(base))
+    time.sleep(1.2)
+    self.test_data.write1('READMEx')
+    self.test_data.rm_rf(self.test_data.path_to('something'))
+    ents, added, removed = c.listdir_with_changes(base)
+    self.assertEquals(['READMEx'], added)
+    self.assertEquals(['something'], removed)
@@ -0,0 +1,124 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import array
+import os
+
+ROOT_ID = 0
+
+class DirTrie(object):
+  """
+  Stores a set of directory paths as a trie of path components. Every node
+  holds a single component and the id of its parent node, so a deep tree of
+  directories stores each shared prefix once.
+
+  Node ROOT_ID is the empty path. Absolute paths hang off a node whose
+  component is os.sep. Paths are normalized by dropping empty components,
+  e.g. trailing and doubled separators.
+  """
+  def __init__(self):
+    self._names = ['']
+    self._parents = array.array('i', [-1])
+    self._depths = array.array('i', [0])
+    self._children = {}
+
+    # Indexers emit files directory by directory, so remember the most
+    # recently added path to skip splitting it again.
+    self._last_added_path = ''
+    self._last_added_id = ROOT_ID
+
+  @staticmethod
+  def from_snapshot(snapshot, prefix):
+    trie = DirTrie()
+    trie._names = snapshot.get_strings(prefix + "names")
+    # Dirs get added to the trie, so it copies the arrays out of the snapshot.
+    trie._parents = snapshot.get_array(prefix + "parents")[:]
+    trie._depths = snapshot.get_array(prefix + "depths")[:]
+    for node_id in xrange(1, len(trie._names)):
+      trie._children[(trie._parents[node_id], trie._names[node_id])] = node_id
+    return trie
+
+  def copy(self):
+    trie = DirTrie()
+    trie._names = list(self._names)
+    trie._parents = self._parents[:]
+    trie._depths = self._depths[:]
+    trie._children = dict(self._children)
+    return trie
+
+  def get_snapshot_sections(self, prefix):
+    return {prefix + "names": self._names,
+            prefix + "parents": self._parents,
+            prefix + "depths": self._depths}
+
+  def __len__(self):
+    return len(self._names)
+
+  def _split(self, path):
+    components = [c for c in path.split(os.sep) if c]
+    if path.startswith(os.sep):
+      components.insert(0, os.sep)
+    return components
+
+  def add_dir(self, path):
+    """Adds path to the trie if needed and returns its node id."""
+    if path == self._last_added_path:
+      return self._last_added_id
+
+    node_id = ROOT_ID
+    for name in self._split(path):
+      key = (node_id, name)
+      child_id = self._children.get(key)
+      if child_id == None:
+        child_id = len(self._names)
+        self._names.append(name)
+        self._parents.append(node_id)
+        self._depths.append(self._depths[node_id] + 1)
+        self._children[key] = child_id
+      node_id = child_id
+
+    self._last_added_path = path
+    self._last_added_id = node_id
+    return node_id
+
+  def find_dir(self, path):
+    """Returns the node id for path, or None if it is not in the trie."""
+    node_id = ROOT_ID
+    for name in self._split(path):
+      node_id = self._children.get((node_id, name))
+      if node_id == None:
+        return None
+    return node_id
+
+  def get_name(self, node_id):
+    return self._names[node_id]
+
+  def get_parent(self, node_id):
+    return self._parents[node_id]
+
+  def get_path(self, node_id):
+    names = []
+    while node_id != ROOT_ID:
+      names.append(self._names[node_id])
+      node_id = self._parents[node_id]
+    names.reverse()
+    if len(names) and names[0] == os.sep:
+      return os.sep + os.sep.join(names[1:])
+    return os.sep.join(names)
+
+  def is_ancestor(self, ancestor_id, node_id):
+    """True if ancestor_id is node_id or one of its parents."""
+    ancestor_depth = self._depths[ancestor_id]
+    while self._depths[node_id] > ancestor_depth:
+      node_id = self._parents[node_id]
+    return node_id == ancestor_id
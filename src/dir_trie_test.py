@@ -0,0 +1,53 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import unittest
+
+from dir_trie import DirTrie, ROOT_ID
+
+class DirTrieTest(unittest.TestCase):
+  def test_roundtrip(self):
+    trie = DirTrie()
+    paths = ["/a/b/c", "/a/b", "/a/d", "/", "x/y", ""]
+    ids = [trie.add_dir(p) for p in paths]
+    self.assertEquals(paths, [trie.get_path(i) for i in ids])
+    self.assertEquals(ROOT_ID, trie.add_dir(""))
+    self.assertEquals(ids[0], trie.add_dir("/a/b/c/"))
+
+  def test_prefixes_are_shared(self):
+    trie = DirTrie()
+    trie.add_dir("/a/b/c")
+    n = len(trie)
+    trie.add_dir("/a/b/d")
+    self.assertEquals(n + 1, len(trie))
+    self.assertEquals("b", trie.get_name(trie.get_parent(trie.find_dir("/a/b/d"))))
+
+  def test_find_dir(self):
+    trie = DirTrie()
+    i = trie.add_dir("/a/b")
+    self.assertEquals(i, trie.find_dir("/a/b"))
+    self.assertEquals(trie.get_parent(i), trie.find_dir("/a"))
+    self.assertEquals(None, trie.find_dir("/a/c"))
+    self.assertEquals(None, trie.find_dir("a/b"))
+
+  def test_is_ancestor(self):
+    trie = DirTrie()
+    c = trie.add_dir("/a/b/c")
+    a = trie.find_dir("/a")
+    d = trie.add_dir("/a/d")
+    self.assertTrue(trie.is_ancestor(a, c))
+    self.assertTrue(trie.is_ancestor(c, c))
+    self.assertTrue(trie.is_ancestor(ROOT_ID, c))
+    self.assertFalse(trie.is_ancestor(c, a))
+    self.assertFalse(trie.is_ancestor(d, c))
@@ -0,0 +1,282 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import array
+import os
+
+from dir_trie import DirTrie
+
+def _add_to_lower_stem_index(index, lower_basename):
+  # Every part before a dot is a stem, e.g. foo and foo.tar for foo.tar.gz. A
+  # leading dot, as in .bashrc, doesn't start an extension.
+  i = lower_basename.find('.', 1)
+  while i != -1:
+    lower_stem = lower_basename[:i]
+    lower_basenames = index.get(lower_stem)
+    if lower_basenames == None:
+      index[lower_stem] = [lower_basename]
+    elif lower_basename not in lower_basenames:
+      lower_basenames.append(lower_basename)
+    i = lower_basename.find('.', i + 1)
+
+class FileTable(object):
+  """
+  Stores a set of filenames compactly. Directories live in a DirTrie and
+  basenames are interned into a table, and a file is just a (dirname id,
+  basename id) pair kept in two typed arrays, where the dirname id is the
+  node id in self.dir_trie. Full filenames are only built on request.
+
+  Files are identified by their position in the table, their file id. Removing
+  a file only marks its id as removed, so ids stay stable.
+  """
+  def __init__(self):
+    self.dir_trie = DirTrie()
+    self.basenames = []
+    self._basename_ids = {}
+    self._file_dirname_ids = array.array('i')
+    self._file_basename_ids = array.array('i')
+    self._removed_file_ids = set()
+
+    # Built on demand by _build_lower_basename_index. Files added after it is
+    # built go into _added_file_ids_by_lower_basename instead of rebuilding it.
+    self._lower_basename_slots = None
+    self._lower_basename_offsets = None
+    self._lower_basename_file_ids = None
+    self._added_file_ids_by_lower_basename = {}
+
+    # Built on demand by get_file_ids_with_lower_stem, and kept up to date
+    # as basenames are added.
+    self._lower_basenames_by_lower_stem = None
+
+  @staticmethod
+  def from_files_by_basename(files_by_basename):
+    table = FileTable()
+    for basename,files_with_basename in files_by_basename.iteritems():
+      for f in files_with_basename:
+        table.add_file(f)
+    return table
+
+  @staticmethod
+  def from_snapshot(snapshot, prefix):
+    table = FileTable()
+    table.dir_trie = DirTrie.from_snapshot(snapshot, prefix + "dir_trie.")
+    table.basenames = snapshot.get_strings(prefix + "basenames")
+    for basename_id in xrange(len(table.basenames)):
+      table._basename_ids[table.basenames[basename_id]] = basename_id
+    # Files get added to the table, so it needs arrays of its own rather than
+    # views on the snapshot.
+    table._file_dirname_ids = snapshot.get_array(prefix + "dirname_ids")[:]
+    table._file_basename_ids = snapshot.get_array(prefix + "basename_ids")[:]
+    table._removed_file_ids = set(snapshot.get_array(prefix + "removed_ids"))
+    return table
+
+  def copy(self):
+    """
+    Returns a copy of the table that changes to either one leave alone. Only
+    the containers are copied, so this is quick even for big tables.
+    """
+    table = FileTable()
+    table.dir_trie = self.dir_trie.copy()
+    table.basenames = list(self.basenames)
+    table._basename_ids = dict(self._basename_ids)
+    table._file_dirname_ids = self._file_dirname_ids[:]
+    table._file_basename_ids = self._file_basename_ids[:]
+    table._removed_file_ids = set(self._removed_file_ids)
+    return table
+
+  def get_snapshot_sections(self, prefix):
+    sections = self.dir_trie.get_snapshot_sections(prefix + "dir_trie.")
+    sections[prefix + "basenames"] = self.basenames
+    sections[prefix + "dirname_ids"] = self._file_dirname_ids
+    sections[prefix + "basename_ids"] = self._file_basename_ids
+    sections[prefix + "removed_ids"] = array.array('i', sorted(self._removed_file_ids))
+    return sections
+
+  def __len__(self):
+    """The number of file ids handed out, including those of removed files."""
+    return len(self._file_dirname_ids)
+
+  @property
+  def num_files(self):
+    return len(self._file_dirname_ids) - len(self._removed_file_ids)
+
+  def add_file(self, filename):
+    dirname, basename = os.path.split(filename)
+    return self.add(dirname, basename)
+
+  def add(self, dirname, basename):
+    """Adds dirname/basename to the table, returning its file id."""
+    dirname_id = self.dir_trie.add_dir(dirname)
+
+    basename_id = self._basename_ids.get(basename)
+    if basename_id == None:
+      basename_id = len(self.basenames)
+      self._basename_ids[basename] = basename_id
+      self.basenames.append(basename)
+      if self._lower_basenames_by_lower_stem != None:
+        _add_to_lower_stem_index(self._lower_basenames_by_lower_stem, basename.lower())
+
+    self._file_dirname_ids.append(dirname_id)
+    self._file_basename_ids.append(basename_id)
+    file_id = len(self._file_dirname_ids) - 1
+    if self._lower_basename_slots != None:
+      lower_basename = basename.lower()
+      if lower_basename not in self._added_file_ids_by_lower_basename:
+        self._added_file_ids_by_lower_basename[lower_basename] = []
+      self._added_file_ids_by_lower_basename[lower_basename].append(file_id)
+    return file_id
+
+  def find_file(self, filename):
+    """Returns the id of filename, or None if it is not in the table."""
+    dirname, basename = os.path.split(filename)
+    dirname_id = self.dir_trie.find_dir(dirname)
+    basename_id = self._basename_ids.get(basename)
+    if dirname_id == None or basename_id == None:
+      return None
+    for file_id in self.get_file_ids_with_lower_basename(basename.lower()):
+      if (self._file_dirname_ids[file_id] == dirname_id and
+          self._file_basename_ids[file_id] == basename_id):
+        return file_id
+    return None
+
+  def remove_file(self, filename):
+    """Removes filename, returning its id or None if it was not in the table."""
+    file_id = self.find_file(filename)
+    if file_id != None:
+      self._removed_file_ids.add(file_id)
+    return file_id
+
+  def remove_files_under(self, dirname):
+    """
+    Removes every file in dirname or its subdirectories, returning the ids of
+    the files that this removed.
+    """
+    dir_id = self.dir_trie.find_dir(dirname)
+    if dir_id == None:
+      return []
+    removed_file_ids = []
+    is_under = {}
+    for file_id in xrange(len(self)):
+      if file_id in self._removed_file_ids:
+        continue
+      dirname_id = self._file_dirname_ids[file_id]
+      res = is_under.get(dirname_id)
+      if res == None:
+        res = self.dir_trie.is_ancestor(dir_id, dirname_id)
+        is_under[dirname_id] = res
+      if res:
+        self._removed_file_ids.add(file_id)
+        removed_file_ids.append(file_id)
+    return removed_file_ids
+
+  def is_removed(self, file_id):
+    return file_id in self._removed_file_ids
+
+  def has_lower_basename(self, lower_basename):
+    """
+    True if any file, including removed ones, ever had lower_basename as its
+    lowercased basename.
+    """
+    if self._lower_basename_slots == None:
+      self._build_lower_basename_index()
+    return (lower_basename in self._lower_basename_slots or
+            lower_basename in self._added_file_ids_by_lower_basename)
+
+  def get_basename_id(self, basename):
+    """Returns the id of basename in self.basenames, or None if no file has it."""
+    return self._basename_ids.get(basename)
+
+  def get_dirname_id(self, file_id):
+    return self._file_dirname_ids[file_id]
+
+  def get_dirname(self, file_id):
+    return self.dir_trie.get_path(self._file_dirname_ids[file_id])
+
+  def get_basename(self, file_id):
+    return self.basenames[self._file_basename_ids[file_id]]
+
+  def get_filename(self, file_id):
+    return os.path.join(self.get_dirname(file_id), self.get_basename(file_id))
+
+  def get_files_by_basename(self):
+    """Returns a dict mapping each basename to a list of its filenames."""
+    files_by_basename = {}
+    for file_id in xrange(len(self)):
+      if file_id in self._removed_file_ids:
+        continue
+      basename = self.get_basename(file_id)
+      if basename not in files_by_basename:
+        files_by_basename[basename] = []
+      files_by_basename[basename].append(self.get_filename(file_id))
+    return files_by_basename
+
+  def iterfilenames(self):
+    for file_id in xrange(len(self)):
+      if file_id in self._removed_file_ids:
+        continue
+      yield self.get_filename(file_id)
+
+  def _build_lower_basename_index(self):
+    file_ids_by_lower_basename = {}
+    lower_basenames = [basename.lower() for basename in self.basenames]
+    for file_id in xrange(len(self)):
+      lower_basename = lower_basenames[self._file_basename_ids[file_id]]
+      if lower_basename not in file_ids_by_lower_basename:
+        file_ids_by_lower_basename[lower_basename] = []
+      file_ids_by_lower_basename[lower_basename].append(file_id)
+
+    # Store the file ids for all lower basenames back to back in one array.
+    slots = {}
+    offsets = array.array('i')
+    file_ids = array.array('i')
+    for lower_basename,ids in file_ids_by_lower_basename.iteritems():
+      slots[lower_basename] = len(offsets)
+      offsets.append(len(file_ids))
+      file_ids.extend(ids)
+    offsets.append(len(file_ids))
+
+    self._lower_basename_slots = slots
+    self._lower_basename_offsets = offsets
+    self._lower_basename_file_ids = file_ids
+    self._added_file_ids_by_lower_basename = {}
+
+  def get_file_ids_with_lower_basename(self, lower_basename):
+    """Returns the ids of the files whose lowercased basename is lower_basename."""
+    if self._lower_basename_slots == None:
+      self._build_lower_basename_index()
+    slot = self._lower_basename_slots.get(lower_basename)
+    if slot == None:
+      file_ids = []
+    else:
+      begin = self._lower_basename_offsets[slot]
+      end = self._lower_basename_offsets[slot + 1]
+      file_ids = list(self._lower_basename_file_ids[begin:end])
+    file_ids.extend(self._added_file_ids_by_lower_basename.get(lower_basename, []))
+    if len(self._removed_file_ids):
+      file_ids = [i for i in file_ids if i not in self._removed_file_ids]
+    return file_ids
+
+  def get_file_ids_with_lower_stem(self, lower_stem):
+    """
+    Returns the ids of the files whose lowercased basename is lower_stem
+    plus one or more extensions, e.g. foo.cc and foo.tar.gz for foo.
+    """
+    if self._lower_basenames_by_lower_stem == None:
+      index = {}
+      for basename in self.basenames:
+        _add_to_lower_stem_index(index, basename.lower())
+      self._lower_basenames_by_lower_stem = index
+    file_ids = []
+    for lower_basename in self._lower_basenames_by_lower_stem.get(lower_stem, []):
+      file_ids.extend(self.get_file_ids_with_lower_basename(lower_basename))
+    return file_ids
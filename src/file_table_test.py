@@ -0,0 +1,103 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+from file_table import FileTable
+
+class FileTableTest(unittest.TestCase):
+  def setUp(self):
+    self.files = [
+      "/a/b/Foo.txt",
+      "/a/b/bar.txt",
+      "/a/foo.txt",
+      "/a/b/foo.txt",
+      "/c/bar.txt",
+      ]
+    self.table = FileTable()
+    for f in self.files:
+      self.table.add_file(f)
+
+  def test_roundtrip(self):
+    self.assertEquals(len(self.files), len(self.table))
+    self.assertEquals(self.files, list(self.table.iterfilenames()))
+    for i in range(len(self.files)):
+      self.assertEquals(self.files[i], self.table.get_filename(i))
+
+  def test_interning(self):
+    self.assertEquals(self.table.dir_trie.find_dir("/a/b"), self.table.get_dirname_id(0))
+    self.assertEquals(["Foo.txt", "bar.txt", "foo.txt"], self.table.basenames)
+    self.assertEquals(self.table.get_dirname_id(0), self.table.get_dirname_id(3))
+    self.assertEquals("/a/b", self.table.get_dirname(1))
+    self.assertEquals("bar.txt", self.table.get_basename(4))
+
+  def test_lower_basename_lookup(self):
+    self.assertEquals([0, 2, 3], list(self.table.get_file_ids_with_lower_basename("foo.txt")))
+    self.assertEquals([1, 4], list(self.table.get_file_ids_with_lower_basename("bar.txt")))
+    self.assertEquals([], list(self.table.get_file_ids_with_lower_basename("Foo.txt")))
+    self.table.add_file("/d/FOO.TXT")
+    self.assertEquals([0, 2, 3, 5], list(self.table.get_file_ids_with_lower_basename("foo.txt")))
+
+  def test_lower_stem_lookup(self):
+    self.assertEquals([0, 2, 3], sorted(self.table.get_file_ids_with_lower_stem("foo")))
+    self.assertEquals([], self.table.get_file_ids_with_lower_stem("foo.txt"))
+    self.table.add_file("/d/Foo.h")
+    self.table.add_file("/d/foo")
+    self.assertEquals([0, 2, 3, 5], sorted(self.table.get_file_ids_with_lower_stem("foo")))
+    self.table.remove_file("/a/foo.txt")
+    self.assertEquals([0, 3, 5], sorted(self.table.get_file_ids_with_lower_stem("foo")))
+
+  def test_lower_stem_lookup_with_several_extensions(self):
+    self.table.add_file("/d/foo.tar.gz")
+    self.table.add_file("/d/.bashrc")
+    self.assertEquals([0, 2, 3, 5], sorted(self.table.get_file_ids_with_lower_stem("foo")))
+    self.assertEquals([5], self.table.get_file_ids_with_lower_stem("foo.tar"))
+    self.assertEquals([], self.table.get_file_ids_with_lower_stem("foo.tar.gz"))
+    self.assertEquals([], self.table.get_file_ids_with_lower_stem(""))
+    self.table.add_file("/d/bar.tar.gz")
+    self.assertEquals([7], self.table.get_file_ids_with_lower_stem("bar.tar"))
+
+  def test_remove(self):
+    self.assertEquals(3, self.table.find_file("/a/b/foo.txt"))
+    self.assertEquals(None, self.table.find_file("/a/b/baz.txt"))
+    self.assertEquals(3, self.table.remove_file("/a/b/foo.txt"))
+    self.assertEquals(None, self.table.remove_file("/a/b/foo.txt"))
+    self.assertTrue(self.table.is_removed(3))
+    self.assertEquals(4, self.table.num_files)
+    self.assertEquals(5, len(self.table))
+    self.assertEquals([0, 2], list(self.table.get_file_ids_with_lower_basename("foo.txt")))
+    self.assertTrue(self.table.has_lower_basename("foo.txt"))
+
+    self.table.remove_files_under("/a/b")
+    self.assertEquals(["/a/foo.txt", "/c/bar.txt"], list(self.table.iterfilenames()))
+
+    self.table.add_file("/a/b/foo.txt")
+    self.assertEquals(5, self.table.find_file("/a/b/foo.txt"))
+
+  def test_copy(self):
+    files = list(self.table.iterfilenames())
+    copy = self.table.copy()
+    self.table.add_file("/a/b/c/new.txt")
+    self.table.remove_file("/c/bar.txt")
+    copy.remove_file("/a/foo.txt")
+    self.assertEquals([f for f in files if f != "/a/foo.txt"], list(copy.iterfilenames()))
+    self.assertEquals(None, copy.find_file("/a/b/c/new.txt"))
+    self.assertEquals(None, copy.dir_trie.find_dir("/a/b/c"))
+
+  def test_from_files_by_basename(self):
+    table = FileTable.from_files_by_basename({"a.txt": ["/x/a.txt", "/y/a.txt"],
+                                              "b.txt": ["/x/b.txt"]})
+    self.assertEquals(set(["/x/a.txt", "/y/a.txt", "/x/b.txt"]), set(table.iterfilenames()))
+    files_by_basename = table.get_files_by_basename()
+    self.assertEquals(set(["/x/a.txt", "/y/a.txt"]), set(files_by_basename["a.txt"]))
+    self.assertEquals(["/x/b.txt"], files_by_basename["b.txt"])
@@ -11,95 +11,30 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import codecs
-import fnmatch
 import logging
-import math
 import os
-import re
 import select
+import stat
 import subprocess
-import tempfile
 import time
 
 from src import db_indexer
+from ignore_matcher import IgnoreMatcher
 from trace_event import *
 
-LINES_TO_READ_PER_SELECT = 1000
+# find output is consumed in bounded reads so memory use stays flat no
+# matter how large the tree is.
+READ_CHUNK_SIZE = 64 * 1024
+SECONDS_PER_STEP = 0.20
 
-def _MakeIgnorePredicate(ignores):
-  def is_ignored(filename):
-    for i in ignores:
-      if fnmatch.fnmatch(filename, i):
-        return True
-    return False
-  return is_ignored
-
-"""
-_BasenameLevelFilter takes a fully qualified filename and splitting it on
-separators. E.g.:
-   foo/bar/baz.txt -> [foo, bar, baz.txt]
-
-It then tests whether a given predicate matches any of those basenames,
-memoizing the results to minimize calls to the predicate.
-"""
-class _BasenameLevelFilter(object):
-  def __init__(self, basename_predicate):
-    self._basename_predicate = basename_predicate
-    self._cached_predicate_results = dict()
-
-  def match_filename(self, filename):
-    basenames = filename.split(os.sep)
-    for basename in basenames:
-      x = self._cached_predicate_results.get(basename)
-      if x == None:
-        x = self._basename_predicate(basename)
-        self._cached_predicate_results[basename] = x
-
-      if x:
-        return True
-    return False
-
-
-"""
-a/b/c/x.txt -> filter("a/b/c/x.txt"), filter("a/b/c"), filter("a/b"), filter("a") -> False
-   set prefix to a/b/c since thats the last one that caused it to True
-
-a/b/c/d -> False
-a/b/d -> filter("a/b/d") -> True
-"""
-class _DirectoryLevelFilter(object):
-  def __init__(self, filename_predicate):
-    self._filename_predicate = filename_predicate
-    self._current_matched_prefix = None
+# Listing is bound by disk latency, so a few finds are run at once even on a
+# single core. Big roots are split into at most MAX_JOBS_PER_ROOT finds.
+MAX_RUNNING_JOBS = 4
+MAX_JOBS_PER_ROOT = 16
 
-  def match_filename(self, filename):
-    # Slow path.
-    if False:
-      return self._filename_predicate(filename)
-
-    if (self._current_matched_prefix and
-        filename.startswith(self._current_matched_prefix)):
-      return True
-
-    if not self._filename_predicate(filename):
-      return False
-
-    # Now, figure out the part that matched
-    last_matching_pefix = filename
-    remaining_parts = filename.split(os.sep)
-    while len(remaining_parts) > 1:
-      possibly_matching_prefix = os.sep.join(remaining_parts)
-      if self._filename_predicate(possibly_matching_prefix):
-        last_matching_pefix = possibly_matching_prefix
-        remaining_parts = remaining_parts[1:]
-        continue
-      break
-
-    # Store this, and quick-reject any filenames that
-    # start with this prefix.
-    self._current_matched_prefix = last_matching_pefix
-    return True
+# Jobs that wait for the jobs before them to be committed stop being read once
+# they hold this many filenames, and their finds block on the full pipe.
+MAX_READY_FILENAMES_PER_WAITING_JOB = 10000
 
 def _get_filename_relative_to_find_dir(current_find_dir, filename):
   i = filename.find(current_find_dir)
@@ -108,6 +43,28 @@ def _get_filename_relative_to_find_dir(current_find_dir, filename):
   subdir_with_slash = filename[len(current_find_dir):]
   return subdir_with_slash[1:]
 
+def _decode_filename(raw):
+  try:
+    return raw.decode('utf8')
+  except UnicodeDecodeError:
+    return raw
+
+def _encode_filename(filename):
+  if isinstance(filename, unicode):
+    return filename.encode('utf8')
+  return filename
+
+def _roots_overlap(real_dirs):
+  """True if one of real_dirs is another one or inside it."""
+  for i in range(len(real_dirs)):
+    for j in range(len(real_dirs)):
+      if i == j:
+        continue
+      if (real_dirs[i] == real_dirs[j] or
+          real_dirs[j].startswith(os.path.join(real_dirs[i], ''))):
+        return True
+  return False
+
 def _IsProcessRunnable(name):
   try:
     with open(os.devnull, 'w') as devnull:
@@ -120,83 +77,232 @@ def _IsProcessRunnable(name):
 def Supported():
   return _IsProcessRunnable('/usr/bin/find')
 
+class ListingJob(object):
+  """
+  One process printing NUL-separated filenames under root, or, if args is
+  None, a list of filenames that is already known. If output_prefix is
+  given, the names printed are relative to it.
+
+  dirnames are the dirs whose files the job lists, including those of their
+  subdirs unless recursive is False.
+  """
+  def __init__(self, root, args=None, cwd=None, output_prefix=None, filenames=None,
+               dirnames=None, recursive=True):
+    self.root = root
+    self.args = args
+    self.cwd = cwd
+    self.output_prefix = _encode_filename(output_prefix)
+    if dirnames == None:
+      dirnames = [root]
+    self.dirnames = dirnames
+    self.recursive = recursive
+    self.process = None
+    self.num_bytes_read = 0
+    self.done = args == None
+    self._devnull = None
+    self._pending_output = ''
+    if filenames:
+      self._ready_filenames = list(filenames)
+    else:
+      self._ready_filenames = []
+
+  @property
+  def running(self):
+    return self.process != None
+
+  def covers(self, dirname):
+    for d in self.dirnames:
+      if dirname == d:
+        return True
+      if self.recursive and dirname.startswith(os.path.join(d, '')):
+        return True
+    return False
+
+  def start(self):
+    self._devnull = open(os.devnull, 'w')
+    logging.debug('Running %s' % ' '.join(self.args))
+    self.process = subprocess.Popen(
+      self.args,
+      cwd=self.cwd,
+      stdout=subprocess.PIPE,
+      stderr=self._devnull)
+
+  def fileno(self):
+    return self.process.stdout.fileno()
+
+  def read_some_output(self):
+    data = os.read(self.fileno(), READ_CHUNK_SIZE)
+    if not data:
+      if self._pending_output:
+        self._ready_filenames.extend(self._decode_output([self._pending_output]))
+      self.close()
+      self.done = True
+      return
+
+    self.num_bytes_read += len(data)
+    # Each read is bounded, so only one chunk of filenames plus a partial
+    # trailing name is held in memory for a job that is being processed.
+    parts = (self._pending_output + data).split('\0')
+    self._pending_output = parts.pop()
+    self._ready_filenames.extend(self._decode_output(parts))
+
+  def _decode_output(self, parts):
+    prefix = self.output_prefix
+    if prefix:
+      return [_decode_filename(os.path.join(prefix, p)) for p in parts]
+    return [_decode_filename(p) for p in parts]
+
+  @property
+  def num_ready_filenames(self):
+    return len(self._ready_filenames)
+
+  def take_ready_filenames(self):
+    res = self._ready_filenames
+    self._ready_filenames = []
+    return res
+
+  def close(self, kill=False):
+    if not self.process:
+      return
+    if kill:
+      try:
+        self.process.kill()
+      except OSError:
+        pass
+    self.process.stdout.close()
+    self.process.wait()
+    self.process = None
+    self._devnull.close()
+    self._devnull = None
+    self._pending_output = ''
+
 class FindBasedDBIndexer(db_indexer.DBIndexer):
-  def __init__(self, dirs, ignores):
+  """
+  Lists dirs with find. Roots are listed at the same time, and each one is
+  split into jobs for its first level subdirs, which are run by a bounded
+  pool of find processes.
+
+  Jobs are committed to the file table in the order they were created, so
+  file ids don't depend on which find finishes first. Output of the oldest
+  job is processed as it streams in; output of later jobs is held until the
+  jobs before them are done, up to MAX_READY_FILENAMES_PER_WAITING_JOB
+  filenames per job, after which they are not read until they are the
+  oldest. prioritize_paths moves the jobs covering the paths to the front.
+  """
+  def __init__(self, dirs, ignores, max_running_jobs=MAX_RUNNING_JOBS):
     super(FindBasedDBIndexer, self).__init__(dirs)
     assert Supported()
 
-    self._init_ignores(ignores)
+    self._ignore_matcher = IgnoreMatcher(ignores)
+    self._max_running_jobs = max_running_jobs
 
-    self._found_files = set()
     self._remaining_dirs = [
       os.path.realpath(d)
       for d in dirs]
+    # Jobs only list the same file twice when one root is inside another, so
+    # only then are the files found kept to leave out the repeats.
+    if _roots_overlap(self._remaining_dirs):
+      self._found_files = set()
+    else:
+      self._found_files = None
     self._remaining_dirs.reverse()
+    self._num_jobs_by_root = dict()
+    self._jobs = []
     self._num_files_found = 0
 
-    self._current_devnull = None
-    self._current_find_dir = None
-    self._current_find_subprocess = None
-    self._lines_needing_processing = None
-    self._find_results_tempfile = None
-
-  def _init_ignores(self, ignores):
-    self._dirname_ignores = []
-    self._basename_ignores = []
-    for i in ignores:
-      if i.find(os.path.sep) != -1:
-        self._dirname_ignores.append(i)
-        continue
-      self._basename_ignores.append(i)
-
   @property
   def progress(self):
     notes = ['%i files found' % self._num_files_found]
-    if self._find_results_tempfile:
-      st = os.stat(self._find_results_tempfile.name)
-      size_in_kb = st.st_size / 1000.0
-      rounded_size_in_kb = math.floor(size_in_kb * 100) / 100.0
-      notes.append("%i kb of directories pending" % rounded_size_in_kb)
+    running = [j for j in self._jobs if j.running]
+    if len(running):
+      num_bytes_read = sum([j.num_bytes_read for j in running])
+      notes.append("%i finds running, %i kb of output read" % (
+          len(running), num_bytes_read / 1000))
     notes.append(
-      '%i toplevel dirs still to be indexed' % len(self._remaining_dirs))
+      '%i toplevel dirs still to be indexed' % (
+        len(self._remaining_dirs) + len(self._num_jobs_by_root)))
     return '; '.join(notes)
 
   def index_a_bit_more(self):
-    if self._lines_needing_processing:
-      self._process_a_few_more_lines()
-      return
+    deadline = time.time() + SECONDS_PER_STEP
+    while True:
+      self._schedule_jobs()
+      self._commit_finished_jobs()
+      if len(self._jobs) == 0 and len(self._remaining_dirs) == 0:
+        logging.debug('Done.')
+        self.complete = True
+        return
 
-    if not self._current_find_subprocess:
-      logging.debug('Finding another dir to search.')
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        return
+      readable = [j for j in self._jobs if j.running and
+                  (j is self._jobs[0] or
+                   j.num_ready_filenames < MAX_READY_FILENAMES_PER_WAITING_JOB)]
+      if len(readable) == 0:
+        continue
+      r, _, _ = select.select(readable, [], [], remaining)
+      for job in r:
+        job.read_some_output()
+
+  def close(self):
+    for job in self._jobs:
+      job.close(kill=True)
+    self._jobs = []
+
+  def _plan_remaining_dirs(self):
+    # Planning a root only lists its first level, so all of them are planned
+    # right away.
+    while len(self._remaining_dirs):
       self._begin_searching_next_dir()
 
-    if self._current_find_subprocess:
-      start = time.time()
-      done = False
-      while not done:
-        time.sleep(0.1)
-        if time.time() - start >= 0.20:
+  def _schedule_jobs(self):
+    self._plan_remaining_dirs()
+
+    # The oldest job runs even if that is one too many, since the others may
+    # be waiting for it to be committed before they are read again.
+    if len(self._jobs) and not self._jobs[0].running and not self._jobs[0].done:
+      self._jobs[0].start()
+
+    # Hand free slots out round robin over the roots, so that roots on
+    # different disks are walked at the same time.
+    num_running_by_root = dict()
+    next_job_by_root = dict()
+    roots = []
+    for job in self._jobs:
+      if job.root not in num_running_by_root:
+        num_running_by_root[job.root] = 0
+        roots.append(job.root)
+      if job.running:
+        num_running_by_root[job.root] += 1
+      elif not job.done and job.root not in next_job_by_root:
+        next_job_by_root[job.root] = job
+    num_running = sum(num_running_by_root.values())
+    while num_running < self._max_running_jobs and len(next_job_by_root):
+      root = min([r for r in roots if r in next_job_by_root],
+                 key=lambda r: num_running_by_root[r])
+      next_job_by_root[root].start()
+      num_running_by_root[root] += 1
+      num_running += 1
+      del next_job_by_root[root]
+      for job in self._jobs:
+        if (job.root == root and not job.done and not job.running):
+          next_job_by_root[root] = job
           break
-        done = self._current_find_subprocess.poll() != None
-      if not done:
-        return
 
-      logging.debug('Find finished.')
-      trace_begin("read")
-      with codecs.open(
-              self._find_results_tempfile.name, 'r', encoding='utf8') as f:
-        lines = f.readlines()
-      trace_end("read")
-      self._did_finish_searching_dir()
-      if len(lines) > 0:
-        logging.debug('Beginning to process lines.')
-        self._lines_needing_processing = lines
-
-    if (not self._current_find_subprocess and
-        self._lines_needing_processing == None and
-        len(self._remaining_dirs) == 0):
-      logging.debug('Done.')
-      self.complete = True
+  def _commit_finished_jobs(self):
+    while len(self._jobs):
+      job = self._jobs[0]
+      filenames = job.take_ready_filenames()
+      if len(filenames):
+        self._process_job_filenames(job, filenames)
+      if not job.done:
+        return
+      self._jobs = self._jobs[1:]
+      self._num_jobs_by_root[job.root] -= 1
+      if self._num_jobs_by_root[job.root] == 0:
+        del self._num_jobs_by_root[job.root]
+        self._did_finish_searching_dir()
 
   @traced
   def _begin_searching_next_dir(self):
@@ -205,65 +311,95 @@ class FindBasedDBIndexer(db_indexer.DBIndexer):
 
     dirname = self._remaining_dirs[0]
     self._remaining_dirs = self._remaining_dirs[1:]
+    num_jobs = len(self._jobs)
+    self._begin_find(dirname)
+    if len(self._jobs) == num_jobs:
+      self._add_job(ListingJob(dirname))
+
+  def _add_job(self, job):
+    self._jobs.append(job)
+    self._num_jobs_by_root[job.root] = self._num_jobs_by_root.get(job.root, 0) + 1
+
+  def prioritize_paths(self, paths):
+    self._plan_remaining_dirs()
+    dirnames = [os.path.dirname(_encode_filename(os.path.realpath(p))) for p in paths]
+    preferred = []
+    rest = []
+    for job in self._jobs:
+      if any([job.covers(d) for d in dirnames]):
+        preferred.append(job)
+      else:
+        rest.append(job)
+    self._jobs = preferred + rest
+
+  def _begin_find(self, dirname):
+    """
+    Adds the jobs that list dirname: one for the files directly in it and
+    finds for its subdirs, in groups so that a root with many subdirs doesn't
+    need a process for each.
+    """
+    try:
+      names = sorted(os.listdir(dirname))
+    except OSError:
+      names = None
+    if names == None or len(names) == 0:
+      self._add_job(ListingJob(dirname, self._get_find_args([dirname])))
+      return
 
-    full_args = ['/usr/bin/find',
-                 '-H', # Make find report the destination of symlinks.
-                 dirname,
-                 '-type', 'f']
-    self._find_results_tempfile = tempfile.NamedTemporaryFile()
-    self._current_devnull = open(os.devnull, 'w')
-    logging.debug('Running %s' % ' '.join(full_args))
-    self._current_find_dir = dirname
-    self._current_find_subprocess = subprocess.Popen(
-      full_args,
-      stdout=self._find_results_tempfile,
-      stderr=self._current_devnull)
+    files = []
+    subdirs = []
+    for name in names:
+      path = os.path.join(dirname, name)
+      try:
+        mode = os.lstat(path).st_mode
+      except OSError:
+        continue
+      # Like find -type f, this skips symlinks below the root.
+      if stat.S_ISREG(mode):
+        files.append(_decode_filename(path))
+      elif stat.S_ISDIR(mode):
+        if not self._ignore_matcher.is_dir_ignored(_decode_filename(name),
+                                                   _decode_filename(path)):
+          subdirs.append(path)
+    self._add_job(ListingJob(dirname, filenames=files, recursive=False))
+
+    num_groups = min(len(subdirs), MAX_JOBS_PER_ROOT)
+    for i in range(num_groups):
+      group = subdirs[i * len(subdirs) / num_groups:
+                      (i + 1) * len(subdirs) / num_groups]
+      self._add_job(ListingJob(dirname, self._get_find_args(group),
+                               dirnames=group))
+
+  def _get_find_args(self, dirnames):
+    # Ignored dirs are pruned so that find never descends into them.
+    return (['/usr/bin/find',
+             '-H'] + # Make find report the destination of symlinks.
+            dirnames +
+            ['-mindepth', '1'] +
+            self._ignore_matcher.get_find_prune_args() +
+            ['-type', 'f',
+             '-print0'])
 
   def _did_finish_searching_dir(self):
-    self._find_results_tempfile.close()
-    self._find_results_tempfile = None
-
-    self._current_find_subprocess.wait()
-    self._current_find_subprocess = None
-
-    self._current_devnull.close()
-    self._current_devnull = None
+    logging.debug('Finished a dir, %i left.' % (
+        len(self._remaining_dirs) + len(self._num_jobs_by_root)))
 
-  def _process_a_few_more_lines(self):
-    assert self._current_find_dir != None
-    NUM_LINES_PER_STEP = 5000
-
-    lines = self._lines_needing_processing[:NUM_LINES_PER_STEP]
-    self._lines_needing_processing = self._lines_needing_processing[NUM_LINES_PER_STEP:]
-
-    self._process_lines(self._current_find_dir, lines)
-
-    if len(self._lines_needing_processing) == 0:
-      logging.debug('Done processing lines.')
-      self._current_find_dir = None
-      self._lines_needing_processing = None
+  def _process_job_filenames(self, job, filenames):
+    self._process_filenames(job.root, filenames)
 
   @traced
-  def _process_lines(self, current_find_dir, lines):
-    dlf = _DirectoryLevelFilter(_MakeIgnorePredicate(self._dirname_ignores))
-    blf = _BasenameLevelFilter(_MakeIgnorePredicate(self._basename_ignores))
-    for line in lines:
-      filename = line.strip()
-
-      if filename in self._found_files:
+  def _process_filenames(self, current_find_dir, filenames):
+    for filename in filenames:
+      if self._found_files != None:
+        if filename in self._found_files:
+          continue
+        self._found_files.add(filename)
+
+      if self._ignore_matcher.match_filename_under(current_find_dir, filename):
         continue
-      self._found_files.add(filename)
 
       dirname, basename = os.path.split(filename)
-      _, ext = os.path.splitext(basename)
-      relative_filename = _get_filename_relative_to_find_dir(current_find_dir, filename)
-      if dlf.match_filename(filename):
-        continue
-      if blf.match_filename(relative_filename):
-        continue
 
-      if basename not in self.files_by_basename:
-        self.files_by_basename[basename] = []
-      self.files_by_basename[basename].append(filename)
+      self.file_table.add(dirname, basename)
 
       self._num_files_found += 1
@@ -12,21 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
+import shutil
+import tempfile
 import unittest
 
 from src import find_based_db_indexer
+from file_table import FileTable
 
 class IndexerForTest(find_based_db_indexer.FindBasedDBIndexer):
   def is_ignored(self, filename):
     assert len(self.dirs) == 1
-    self.files_by_basename = dict()
-    self._process_lines(self.dirs[0], [filename + '\n'])
-    basename = os.path.basename(filename)
-    if basename not in self.files_by_basename:
-      return True
-    if filename not in self.files_by_basename[basename]:
-      return True
-    return False
+    self.file_table = FileTable()
+    self._process_filenames(self.dirs[0], [filename])
+    return filename not in self.file_table.iterfilenames()
 
 class FindBasedDBIndexerUnitTests(unittest.TestCase):
   def test_relpath_basic(self):
@@ -85,36 +83,125 @@ class FindBasedDBIndexerUnitTests(unittest.TestCase):
       indexer.index_a_bit_more()
     self.assertEquals(n[0], 2)
 
+  def test_overlapping_roots(self):
+    self.assertFalse(find_based_db_indexer._roots_overlap(['/a/b', '/a/bc', '/c']))
+    self.assertTrue(find_based_db_indexer._roots_overlap(['/a/b/c', '/a/b']))
+    self.assertTrue(find_based_db_indexer._roots_overlap(['/a', '/a']))
 
-class BasenameLevelFilterTest(unittest.TestCase):
-  def test_1(self):
-    pred = find_based_db_indexer._MakeIgnorePredicate(["*.o"])
-    filter = find_based_db_indexer._BasenameLevelFilter(pred)
-    assert filter.match_filename("src/out/foo.o") == True
-    assert filter.match_filename("src/out/foo.o.d") == False
-
-  def test_2(self):
-    pred = find_based_db_indexer._MakeIgnorePredicate(["out"])
-    filter = find_based_db_indexer._BasenameLevelFilter(pred)
-    assert filter.match_filename("src/out/foo.txt") == True
-    assert filter.match_filename("src/out/bar.txt") == True
-    assert filter.match_filename("src/xyz/wxy/z.txt") == False
-
-class DirectoryLevelFilterTest(unittest.TestCase):
-  def test_1(self):
-    pred = find_based_db_indexer._MakeIgnorePredicate(["a/b/c/*"])
-    filter = find_based_db_indexer._DirectoryLevelFilter(pred)
-    assert filter.match_filename("a/b/x.txt") == False
-    assert filter.match_filename("a/b/c/x.txt") == True
-    assert filter.match_filename("a/b/c/y.txt") == True
-    assert filter.match_filename("a/b/d.txt") == False
-    assert filter.match_filename("a/b/c/y.txt") == True
-    assert filter.match_filename("a/b/x/y/z.txt") == False
-
-  def test_2(self):
-    pred = find_based_db_indexer._MakeIgnorePredicate(["*out/*"])
-    filter = find_based_db_indexer._DirectoryLevelFilter(pred)
-    assert filter.match_filename("a/b/x.txt") == False
-    assert filter.match_filename("a/out/x.txt") == True
-    assert filter.match_filename("a/out/foo/y.txt") == True
-    assert filter.match_filename("out/b/d.txt") == True
+    root = os.path.realpath(tempfile.mkdtemp())
+    try:
+      os.makedirs(os.path.join(root, 'sub'))
+      open(os.path.join(root, 'a.txt'), 'w').close()
+      open(os.path.join(root, 'sub', 'b.txt'), 'w').close()
+      indexer = find_based_db_indexer.FindBasedDBIndexer([os.path.join(root, 'sub'), root], [])
+      while not indexer.complete:
+        indexer.index_a_bit_more()
+      self.assertEquals(sorted([os.path.join(root, 'a.txt'), os.path.join(root, 'sub', 'b.txt')]),
+                        sorted(indexer.file_table.iterfilenames()))
+    finally:
+      shutil.rmtree(root)
+
+  def test_streams_find_output(self):
+    root = tempfile.mkdtemp()
+    try:
+      os.makedirs(os.path.join(root, 'sub'))
+      names = ['a.txt', 'with space.txt', 'with\nnewline.txt',
+               os.path.join('sub', 'b.txt'),
+               os.path.join('sub', 'x.o')]
+      names.extend(os.path.join('sub', 'f%i' % i) for i in range(5000))
+      for n in names:
+        open(os.path.join(root, n), 'w').close()
+
+      indexer = find_based_db_indexer.FindBasedDBIndexer([root], ['*.o'])
+      while not indexer.complete:
+        indexer.index_a_bit_more()
+      real_root = os.path.realpath(root)
+      expected = set(os.path.join(real_root, n) for n in names
+                     if not n.endswith('.o'))
+      self.assertEquals(expected, set(indexer.file_table.iterfilenames()))
+    finally:
+      shutil.rmtree(root)
+
+  def test_pool_size_does_not_change_order(self):
+    root = tempfile.mkdtemp()
+    try:
+      roots = [os.path.join(root, 'r1'), os.path.join(root, 'r2')]
+      for r in roots:
+        for i in range(40):
+          d = os.path.join(r, 'd%i' % i, 'sub')
+          os.makedirs(d)
+          for j in range(5):
+            open(os.path.join(d, 'f%i' % j), 'w').close()
+        open(os.path.join(r, 'top.txt'), 'w').close()
+      os.makedirs(os.path.join(roots[0], 'out', 'deep'))
+      open(os.path.join(roots[0], 'out', 'deep', 'x.txt'), 'w').close()
+
+      def index(max_running_jobs):
+        indexer = find_based_db_indexer.FindBasedDBIndexer(
+          roots, ['out'], max_running_jobs)
+        while not indexer.complete:
+          indexer.index_a_bit_more()
+        return list(indexer.file_table.iterfilenames())
+      serial = index(1)
+      self.assertEquals(2 * (40 * 5 + 1), len(serial))
+      self.assertEquals(serial, index(4))
+      self.assertEquals(serial, index(16))
+    finally:
+      shutil.rmtree(root)
+
+  def test_waiting_jobs_are_not_read_ahead(self):
+    root = tempfile.mkdtemp()
+    old_limit = find_based_db_indexer.MAX_READY_FILENAMES_PER_WAITING_JOB
+    old_chunk_size = find_based_db_indexer.READ_CHUNK_SIZE
+    try:
+      for i in range(8):
+        d = os.path.join(root, 'd%i' % i)
+        os.makedirs(d)
+        for j in range(200):
+          open(os.path.join(d, 'f%03i' % j), 'w').close()
+
+      def index():
+        indexer = find_based_db_indexer.FindBasedDBIndexer([root], [], 4)
+        max_waiting = [0]
+        commit_finished_jobs = indexer._commit_finished_jobs
+        def checked_commit_finished_jobs():
+          for job in indexer._jobs[1:]:
+            max_waiting[0] = max(max_waiting[0], job.num_ready_filenames)
+          commit_finished_jobs()
+        indexer._commit_finished_jobs = checked_commit_finished_jobs
+        while not indexer.complete:
+          indexer.index_a_bit_more()
+        return list(indexer.file_table.iterfilenames()), max_waiting[0]
+      unlimited, max_waiting = index()
+      self.assertTrue(max_waiting > 10)
+
+      find_based_db_indexer.MAX_READY_FILENAMES_PER_WAITING_JOB = 10
+      find_based_db_indexer.READ_CHUNK_SIZE = 256
+      files, max_waiting = index()
+      self.assertEquals(unlimited, files)
+      self.assertEquals(8 * 200, len(files))
+      # One read past the limit at most.
+      self.assertTrue(max_waiting < 10 + 256 / len(root))
+    finally:
+      find_based_db_indexer.MAX_READY_FILENAMES_PER_WAITING_JOB = old_limit
+      find_based_db_indexer.READ_CHUNK_SIZE = old_chunk_size
+      shutil.rmtree(root)
+
+  def test_prioritize_paths(self):
+    root = os.path.realpath(tempfile.mkdtemp())
+    try:
+      for i in range(10):
+        d = os.path.join(root, 'd%02i' % i)
+        os.makedirs(d)
+        for j in range(5):
+          open(os.path.join(d, 'f%i' % j), 'w').close()
+
+      indexer = find_based_db_indexer.FindBasedDBIndexer([root], [], 1)
+      indexer.prioritize_paths([os.path.join(root, 'd09', 'f0')])
+      while not indexer.complete:
+        indexer.index_a_bit_more()
+      files = list(indexer.file_table.iterfilenames())
+      self.assertEquals(10 * 5, len(files))
+      self.assertEquals(os.path.join(root, 'd09'), os.path.dirname(files[0]))
+    finally:
+      shutil.rmtree(root)
@@ -0,0 +1,153 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import os
+import subprocess
+
+import find_based_db_indexer
+
+def _encode_path(path):
+  if isinstance(path, unicode):
+    return path.encode('utf8')
+  return path
+
+def _run_git(args, cwd):
+  """Returns git's stdout, or None if it failed."""
+  try:
+    with open(os.devnull, 'w') as devnull:
+      p = subprocess.Popen(['git'] + args, cwd=cwd,
+                           stdout=subprocess.PIPE, stderr=devnull)
+      out = p.communicate()[0]
+  except OSError:
+    return None
+  if p.returncode != 0:
+    return None
+  return out
+
+def Supported():
+  return (find_based_db_indexer.Supported() and
+          _run_git(['--version'], None) != None)
+
+def _get_work_tree_toplevel(dirname):
+  """Returns the toplevel of the git work tree containing dirname, if any."""
+  out = _run_git(['rev-parse', '--show-toplevel'], dirname)
+  if not out:
+    return None
+  return out.rstrip('\n')
+
+def _get_submodule_paths(toplevel):
+  if not os.path.exists(os.path.join(toplevel, '.gitmodules')):
+    return set()
+  out = _run_git(['config', '-z', '--file', '.gitmodules',
+                  '--get-regexp', r'^submodule\..*\.path$'], toplevel)
+  if not out:
+    return set()
+  res = set()
+  for entry in out.split('\0'):
+    if entry.find('\n') == -1:
+      continue
+    path = entry.split('\n', 1)[1]
+    res.add(os.path.join(toplevel, path).decode('utf8'))
+  return res
+
+class _GitListingJob(find_based_db_indexer.ListingJob):
+  def __init__(self, root, args, cwd, output_prefix, submodule_paths):
+    super(_GitListingJob, self).__init__(root, args, cwd, output_prefix)
+    self.submodule_paths = submodule_paths
+    # The last path listed, which is held back until it is clear that the
+    # next entry does not mark it as deleted.
+    self._held_path = None
+
+  def read_some_output(self):
+    super(_GitListingJob, self).read_some_output()
+    if self.done and self._held_path != None:
+      self._ready_filenames.extend(
+        super(_GitListingJob, self)._decode_output([self._held_path]))
+      self._held_path = None
+
+  def _decode_output(self, parts):
+    # Each path is tagged by -t. A tracked file that was deleted from the work
+    # tree is listed once more right after its cached entry, tagged R by
+    # --deleted. Files marked skip-worktree, such as those outside of a sparse
+    # checkout, are only there if they were checked out.
+    paths = []
+    for p in parts:
+      tag, path = p[:2], p[2:]
+      if tag == 'R ':
+        if path == self._held_path:
+          self._held_path = None
+        continue
+      if tag == 'S ' and not os.path.lexists(os.path.join(self.output_prefix, path)):
+        continue
+      if self._held_path != None:
+        paths.append(self._held_path)
+      self._held_path = path
+    return super(_GitListingJob, self)._decode_output(paths)
+
+class GitBasedDBIndexer(find_based_db_indexer.FindBasedDBIndexer):
+  """
+  Lists dirs that are in git work trees with git ls-files, which reads the
+  tracked files out of the git index instead of walking the tree and skips
+  untracked files that .gitignore covers. Tracked files that were deleted or
+  never checked out are left out. Submodules and untracked nested
+  repositories are listed the same way. Dirs outside of any work tree are
+  walked with find.
+  """
+  def __init__(self, dirs, ignores):
+    super(GitBasedDBIndexer, self).__init__(dirs, ignores)
+    self._listed_toplevels = set()
+    self._nested_repo_dirs = set()
+
+  def _begin_find(self, dirname):
+    toplevel = _get_work_tree_toplevel(dirname)
+    if dirname in self._nested_repo_dirs and toplevel != dirname:
+      # A submodule that isn't checked out is part of the outer work tree,
+      # which is already being listed.
+      toplevel = None
+    if toplevel == None:
+      super(GitBasedDBIndexer, self)._begin_find(dirname)
+      return
+    if toplevel in self._listed_toplevels:
+      return
+    if toplevel == dirname:
+      self._listed_toplevels.add(toplevel)
+
+    # --full-name prints paths relative to the toplevel, but still only lists
+    # files under dirname.
+    args = ['git', 'ls-files', '-z', '-t', '--full-name',
+            '--cached', '--deleted', '--others', '--exclude-standard']
+    self._add_job(_GitListingJob(dirname, args,
+                                 cwd=dirname,
+                                 output_prefix=toplevel,
+                                 submodule_paths=_get_submodule_paths(toplevel)))
+
+  def _begin_nested_repo(self, dirname):
+    dirname = _encode_path(os.path.realpath(dirname))
+    self._nested_repo_dirs.add(dirname)
+    self._remaining_dirs.append(dirname)
+
+  def _process_job_filenames(self, job, filenames):
+    if isinstance(job, _GitListingJob):
+      files = []
+      for f in filenames:
+        if f.endswith(os.path.sep):
+          # An untracked directory that git did not descend into, which is
+          # what git does with repositories nested in the work tree.
+          self._begin_nested_repo(f[:-1])
+        elif f in job.submodule_paths:
+          self._begin_nested_repo(f)
+        else:
+          files.append(f)
+      filenames = files
+    super(GitBasedDBIndexer, self)._process_job_filenames(job, filenames)
@@ -0,0 +1,111 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import unittest
+
+from src import find_based_db_indexer
+from src import git_based_db_indexer
+from test_data import TestData
+
+class GitBasedDBIndexerTest(unittest.TestCase):
+  def setUp(self):
+    self.test_data = TestData()
+
+  def tearDown(self):
+    self.test_data.close()
+
+  def index(self, dirs, ignores = []):
+    indexer = git_based_db_indexer.GitBasedDBIndexer(dirs, ignores)
+    while not indexer.complete:
+      indexer.index_a_bit_more()
+    return list(indexer.file_table.iterfilenames())
+
+  def git(self, subdir, cmd):
+    oldcwd = os.getcwd()
+    os.chdir(self.test_data.path_to(subdir))
+    try:
+      assert self.test_data.system(cmd) == 0
+    finally:
+      os.chdir(oldcwd)
+
+  def test_lists_work_tree(self):
+    f = open(self.test_data.path_to('gitproj/.gitignore'), 'w')
+    f.write('*.tmp\n')
+    f.close()
+    self.test_data.write1('gitproj/untracked.txt')
+    self.test_data.write1('gitproj/scratch.tmp')
+
+    files = self.index([self.test_data.path_to('gitproj')], ['.*'])
+    self.assertEquals(set([self.test_data.path_to('gitproj/MyMainFile.js'),
+                           self.test_data.path_to('gitproj/index.html'),
+                           self.test_data.path_to('gitproj/untracked.txt')]),
+                      set(files))
+
+  def test_skips_files_missing_from_work_tree(self):
+    self.test_data.write1('gitproj/sparse.txt')
+    self.test_data.write1('gitproj/kept.txt')
+    self.git('gitproj', 'git add sparse.txt kept.txt')
+    self.git('gitproj', 'git update-index --skip-worktree sparse.txt kept.txt')
+    os.unlink(self.test_data.path_to('gitproj/sparse.txt'))
+    os.unlink(self.test_data.path_to('gitproj/index.html'))
+
+    files = self.index([self.test_data.path_to('gitproj')], ['.*'])
+    self.assertEquals(set([self.test_data.path_to('gitproj/MyMainFile.js'),
+                           self.test_data.path_to('gitproj/kept.txt')]),
+                      set(files))
+
+  def test_deleted_files_split_across_reads(self):
+    os.unlink(self.test_data.path_to('gitproj/index.html'))
+    old_read_chunk_size = find_based_db_indexer.READ_CHUNK_SIZE
+    find_based_db_indexer.READ_CHUNK_SIZE = 3
+    try:
+      files = self.index([self.test_data.path_to('gitproj')], ['.*'])
+    finally:
+      find_based_db_indexer.READ_CHUNK_SIZE = old_read_chunk_size
+    self.assertEquals([self.test_data.path_to('gitproj/MyMainFile.js')], files)
+
+  def test_subdir_of_work_tree(self):
+    os.mkdir(self.test_data.path_to('gitproj/sub'))
+    self.test_data.write1('gitproj/sub/a.txt')
+    files = self.index([self.test_data.path_to('gitproj/sub')])
+    self.assertEquals([self.test_data.path_to('gitproj/sub/a.txt')], files)
+
+  def test_nested_repo(self):
+    os.mkdir(self.test_data.path_to('gitproj/nested'))
+    self.git('gitproj/nested', 'git init')
+    self.test_data.write1('gitproj/nested/b.txt')
+    files = self.index([self.test_data.path_to('gitproj')])
+    self.assertTrue(self.test_data.path_to('gitproj/nested/b.txt') in files)
+    self.assertTrue(self.test_data.path_to('gitproj/index.html') in files)
+    self.assertFalse(self.test_data.path_to('gitproj/.git/HEAD') in files)
+
+  def test_submodule(self):
+    os.mkdir(self.test_data.path_to('subrepo'))
+    self.git('subrepo', 'git init')
+    self.test_data.write1('subrepo/c.txt')
+    self.git('subrepo', 'git add c.txt')
+    self.git('subrepo', 'git commit -m .')
+    self.git('gitproj', 'git -c protocol.file.allow=always submodule add %s sub' %
+             self.test_data.path_to('subrepo'))
+    files = self.index([self.test_data.path_to('gitproj')], ['.*'])
+    self.assertTrue(self.test_data.path_to('gitproj/sub/c.txt') in files)
+    self.assertFalse(self.test_data.path_to('gitproj/sub') in files)
+
+  def test_falls_back_to_find(self):
+    files = self.index([self.test_data.test_data_dir], ['*.o', '.*'])
+    self.assertEquals(len(files), len(set(files)))
+    self.assertTrue(self.test_data.path_to('project1/MySubSystem.c') in files)
+    self.assertTrue(self.test_data.path_to('gitproj/index.html') in files)
+    self.assertFalse(self.test_data.path_to('something/ignored.o') in files)
+    self.assertFalse(self.test_data.path_to('gitproj/.git/HEAD') in files)
@@ -0,0 +1,116 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import fnmatch
+import os
+import re
+
+def _translate(glob):
+  t = fnmatch.translate(glob)
+  # Python 2 puts the flags at the end, which can't be nested in a group.
+  if t.endswith('(?ms)'):
+    t = t[:-len('(?ms)')]
+  return t
+
+def _compile(globs):
+  if len(globs) == 0:
+    return None
+  return re.compile('(?ms)' + '|'.join(['(?:%s)' % _translate(g) for g in globs]))
+
+class IgnoreMatcher(object):
+  """
+  Matches filenames against a list of ignore globs with one compiled regex per
+  kind of glob, instead of calling fnmatch once per glob.
+
+  Globs without a separator are matched against basenames: a file is ignored
+  if its own basename or that of any directory it is under matches. Globs
+  with a separator are matched against full paths.
+  """
+  def __init__(self, ignores):
+    self.ignores = list(ignores)
+    basename_globs = [i for i in ignores if i.find(os.path.sep) == -1]
+    path_globs = [i for i in ignores if i.find(os.path.sep) != -1]
+    self._basename_globs = basename_globs
+    self._path_globs = path_globs
+    self._basename_re = _compile(basename_globs)
+    self._path_re = _compile(path_globs)
+    # A path glob ending in * that matches "dir/" matches everything under
+    # dir too, so the whole dir can be skipped.
+    self._dir_prune_re = _compile([g for g in path_globs if g.endswith('*')])
+    self._ignored_dirnames = dict()
+
+  def match_basename(self, basename):
+    return bool(self._basename_re and self._basename_re.match(basename))
+
+  def match_path(self, path):
+    return bool(self._path_re and self._path_re.match(path))
+
+  def is_ignored(self, basename, path):
+    return self.match_basename(basename) or self.match_path(path)
+
+  def is_dir_ignored(self, basename, path):
+    """True if nothing under the dir at path can be wanted."""
+    if self.is_ignored(basename, path):
+      return True
+    return bool(self._dir_prune_re and
+                self._dir_prune_re.match(path + os.path.sep))
+
+  def match_filename_under(self, root, filename):
+    """
+    True if filename, found by walking root, is ignored. Basename globs are
+    tested against every component of filename below root.
+    """
+    if self.match_path(filename):
+      return True
+    dirname, basename = os.path.split(filename)
+    if self.match_basename(basename):
+      return True
+    return self._is_dirname_ignored_under(root, dirname)
+
+  def _is_dirname_ignored_under(self, root, dirname):
+    key = (root, dirname)
+    x = self._ignored_dirnames.get(key)
+    if x != None:
+      return x
+    if (not dirname or dirname == root or dirname == os.path.sep):
+      x = False
+    else:
+      parent, basename = os.path.split(dirname)
+      if parent == dirname:
+        x = False
+      else:
+        x = (self.match_basename(basename) or
+             self._is_dirname_ignored_under(root, parent))
+    self._ignored_dirnames[key] = x
+    return x
+
+  def get_find_prune_args(self):
+    """
+    Returns find arguments that prune ignored files and dirs, to go before the
+    expression that prints what is left. Must be used with -mindepth 1 so
+    that the root itself is never pruned.
+    """
+    tests = []
+    for g in self._basename_globs:
+      tests.append(['-name', g])
+    for g in self._path_globs:
+      tests.append(['-path', g])
+    if len(tests) == 0:
+      return []
+    args = ['(']
+    for i in range(len(tests)):
+      if i != 0:
+        args.append('-o')
+      args.extend(tests[i])
+    args.extend([')', '-prune', '-o'])
+    return args
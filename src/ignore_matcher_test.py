@@ -0,0 +1,97 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from ignore_matcher import IgnoreMatcher
+
+class BasenameIgnoreTest(unittest.TestCase):
+  def test_1(self):
+    m = IgnoreMatcher(["*.o"])
+    assert m.match_filename_under("", "src/out/foo.o") == True
+    assert m.match_filename_under("", "src/out/foo.o.d") == False
+
+  def test_2(self):
+    m = IgnoreMatcher(["out"])
+    assert m.match_filename_under("", "src/out/foo.txt") == True
+    assert m.match_filename_under("", "src/out/bar.txt") == True
+    assert m.match_filename_under("", "src/xyz/wxy/z.txt") == False
+
+  def test_only_components_under_root_count(self):
+    m = IgnoreMatcher(["out"])
+    assert m.match_filename_under("/out/src", "/out/src/foo.txt") == False
+    assert m.match_filename_under("/out/src", "/out/src/out/foo.txt") == True
+
+  def test_multiple_globs(self):
+    m = IgnoreMatcher(["*.o", ".*", "#*"])
+    self.assertTrue(m.match_basename("foo.o"))
+    self.assertTrue(m.match_basename(".svn"))
+    self.assertTrue(m.match_basename("#foo#"))
+    self.assertFalse(m.match_basename("foo.c"))
+
+  def test_no_globs(self):
+    m = IgnoreMatcher([])
+    self.assertFalse(m.is_ignored("foo", "/a/foo"))
+    self.assertFalse(m.match_filename_under("/a", "/a/b/foo"))
+    self.assertEquals([], m.get_find_prune_args())
+
+class PathIgnoreTest(unittest.TestCase):
+  def test_1(self):
+    m = IgnoreMatcher(["a/b/c/*"])
+    assert m.match_filename_under("", "a/b/x.txt") == False
+    assert m.match_filename_under("", "a/b/c/x.txt") == True
+    assert m.match_filename_under("", "a/b/c/y.txt") == True
+    assert m.match_filename_under("", "a/b/d.txt") == False
+    assert m.match_filename_under("", "a/b/c/y.txt") == True
+    assert m.match_filename_under("", "a/b/x/y/z.txt") == False
+
+  def test_2(self):
+    m = IgnoreMatcher(["*out/*"])
+    assert m.match_filename_under("", "a/b/x.txt") == False
+    assert m.match_filename_under("", "a/out/x.txt") == True
+    assert m.match_filename_under("", "a/out/foo/y.txt") == True
+    assert m.match_filename_under("", "out/b/d.txt") == True
+
+  def test_dir_ignored(self):
+    m = IgnoreMatcher(["/a/b/c/*", "/x/y", ".git"])
+    self.assertTrue(m.is_dir_ignored("c", "/a/b/c"))
+    self.assertFalse(m.is_dir_ignored("b", "/a/b"))
+    self.assertTrue(m.is_dir_ignored("y", "/x/y"))
+    self.assertTrue(m.is_dir_ignored(".git", "/q/.git"))
+    self.assertFalse(m.is_dir_ignored("git", "/q/git"))
+
+class FindPruneTest(unittest.TestCase):
+  def setUp(self):
+    self.root = os.path.realpath(tempfile.mkdtemp())
+    for d in ['out/deep', 'src/.svn', 'src/gen']:
+      os.makedirs(os.path.join(self.root, d))
+    for f in ['a.c', 'a.o', 'out/deep/x.c', 'src/b.c', 'src/.svn/entries',
+              'src/gen/y.c']:
+      open(os.path.join(self.root, f), 'w').close()
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def test_prune(self):
+    m = IgnoreMatcher(["*.o", ".*", "out", os.path.join(self.root, "src/gen/*")])
+    args = (['/usr/bin/find', self.root, '-mindepth', '1'] +
+            m.get_find_prune_args() + ['-type', 'f', '-print0'])
+    out = subprocess.Popen(args, stdout=subprocess.PIPE).communicate()[0]
+    found = set(out.split('\0')[:-1])
+    self.assertEquals(set([os.path.join(self.root, 'a.c'),
+                           os.path.join(self.root, 'src/b.c')]),
+                      found)
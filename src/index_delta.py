@@ -0,0 +1,69 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+
+class IndexDelta(object):
+  """
+  A batch of changes to apply to an index: files that appeared, files that went
+  away and directories that went away along with everything under them.
+
+  Changes are coalesced as they are recorded, so only the final state of each
+  path is kept, e.g. a file that is created and deleted again within a batch
+  ends up as a removal, which is harmless if it was never indexed.
+
+  needs_reindex is set when the changes could not be tracked, in which case the
+  only safe thing to do with the delta is a full reindex.
+  """
+  def __init__(self):
+    self.added_files = set()
+    self.removed_files = set()
+    self.removed_dirs = set()
+    self.needs_reindex = False
+
+  def __repr__(self):
+    return "IndexDelta(+%i, -%i files, -%i dirs%s)" % (
+      len(self.added_files), len(self.removed_files), len(self.removed_dirs),
+      ", needs reindex" if self.needs_reindex else "")
+
+  def is_empty(self):
+    return (len(self.added_files) == 0 and
+            len(self.removed_files) == 0 and
+            len(self.removed_dirs) == 0 and
+            not self.needs_reindex)
+
+  def add_file(self, filename):
+    self.removed_files.discard(filename)
+    self.added_files.add(filename)
+
+  def remove_file(self, filename):
+    self.added_files.discard(filename)
+    self.removed_files.add(filename)
+
+  def remove_dir(self, dirname):
+    prefix = os.path.join(dirname, '')
+    for f in [f for f in self.added_files if f.startswith(prefix)]:
+      self.added_files.remove(f)
+    for f in [f for f in self.removed_files if f.startswith(prefix)]:
+      self.removed_files.remove(f)
+    self.removed_dirs.add(dirname)
+
+  def merge(self, other):
+    """Records the changes in other as having happened after those in self."""
+    for d in other.removed_dirs:
+      self.remove_dir(d)
+    for f in other.removed_files:
+      self.remove_file(f)
+    for f in other.added_files:
+      self.add_file(f)
+    self.needs_reindex |= other.needs_reindex
@@ -0,0 +1,52 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+from index_delta import IndexDelta
+
+class IndexDeltaTest(unittest.TestCase):
+  def test_last_change_wins(self):
+    d = IndexDelta()
+    self.assertTrue(d.is_empty())
+    d.add_file("/a/x.txt")
+    d.remove_file("/a/x.txt")
+    d.remove_file("/a/y.txt")
+    d.add_file("/a/y.txt")
+    self.assertEquals(set(["/a/y.txt"]), d.added_files)
+    self.assertEquals(set(["/a/x.txt"]), d.removed_files)
+    self.assertFalse(d.is_empty())
+
+  def test_remove_dir_drops_added_files(self):
+    d = IndexDelta()
+    d.add_file("/a/b/x.txt")
+    d.add_file("/a/bc/y.txt")
+    d.remove_file("/a/b/z.txt")
+    d.remove_dir("/a/b")
+    self.assertEquals(set(["/a/bc/y.txt"]), d.added_files)
+    self.assertEquals(set(), d.removed_files)
+    self.assertEquals(set(["/a/b"]), d.removed_dirs)
+
+  def test_merge(self):
+    d1 = IndexDelta()
+    d1.add_file("/a/x.txt")
+    d1.add_file("/b/y.txt")
+    d2 = IndexDelta()
+    d2.remove_file("/a/x.txt")
+    d2.remove_dir("/b")
+    d2.needs_reindex = True
+    d1.merge(d2)
+    self.assertEquals(set(), d1.added_files)
+    self.assertEquals(set(["/a/x.txt"]), d1.removed_files)
+    self.assertEquals(set(["/b"]), d1.removed_dirs)
+    self.assertTrue(d1.needs_reindex)
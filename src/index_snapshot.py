@@ -0,0 +1,214 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import array
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = 'quickopen-snapshot'
+
+# Bump this whenever the layout of the file or of any section changes. Snapshots
+# with a different version are ignored.
+FORMAT_VERSION = 5
+
+ARRAY_SECTION = 'array'
+STRINGS_SECTION = 'strings'
+
+class SnapshotException(Exception):
+  def __init__(self, msg):
+    Exception.__init__(self, msg)
+
+def _encode_strings(strings):
+  encoded = [s.encode('utf8') if isinstance(s, unicode) else s for s in strings]
+  return '\0'.join(encoded)
+
+def _decode_strings(data, count):
+  if count == 0:
+    return []
+  try:
+    res = data.decode('utf8').split(u'\0')
+  except UnicodeDecodeError:
+    raise SnapshotException("Corrupt strings section")
+  if len(res) != count:
+    raise SnapshotException("Strings section has %i strings, expected %i" % (len(res), count))
+  return res
+
+class ArrayView(object):
+  """
+  A read-only array.array('i') over an array section of a mapped snapshot.
+  Items are unpacked from the mapping as they are indexed, and slices are
+  copied out into array.arrays, so loading a section copies nothing.
+  """
+  typecode = 'i'
+  _item = struct.Struct('i')
+
+  def __init__(self, buf, begin, count):
+    self._buf = buf
+    self._begin = begin
+    self._count = count
+
+  def __len__(self):
+    return self._count
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      start, stop, step = i.indices(self._count)
+      if step != 1:
+        return array.array('i', [self[j] for j in xrange(start, stop, step)])
+      res = array.array('i')
+      if start < stop:
+        res.fromstring(self._buf[self._begin + start * self._item.size:
+                                 self._begin + stop * self._item.size])
+      return res
+    if i < 0:
+      i += self._count
+    if i < 0 or i >= self._count:
+      raise IndexError("array index out of range")
+    return self._item.unpack_from(self._buf, self._begin + i * self._item.size)[0]
+
+  def __iter__(self):
+    for start in xrange(0, self._count, 4096):
+      for x in self[start:start + 4096]:
+        yield x
+
+  def tostring(self):
+    return self._buf[self._begin:self._begin + self._count * self._item.size]
+
+  def __reduce__(self):
+    # Views are sent to other processes as the arrays they stand for.
+    return (array.array, ('i', self.tostring()))
+
+def write_snapshot(filename, header, sections):
+  """
+  Writes a snapshot to filename. header is a json-able dict describing the
+  snapshot, and sections maps section names to either an array.array('i') or an
+  ArrayView, or to a list of strings.
+
+  The file holds a magic line, a version line and a json header line, followed
+  by the raw bytes of every section. The snapshot is written to a temporary
+  file and then renamed into place so that readers never see a partial file.
+  """
+  section_table = {}
+  section_data = []
+  offset = 0
+  for name in sorted(sections.keys()):
+    section = sections[name]
+    if isinstance(section, (array.array, ArrayView)):
+      assert section.typecode == 'i'
+      data = section.tostring()
+      section_table[name] = [ARRAY_SECTION, offset, len(data), len(section)]
+    else:
+      data = _encode_strings(section)
+      section_table[name] = [STRINGS_SECTION, offset, len(data), len(section)]
+    section_data.append(data)
+    offset += len(data)
+
+  full_header = dict(header)
+  full_header["byteorder"] = sys.byteorder
+  full_header["itemsize"] = array.array('i').itemsize
+  full_header["sections"] = section_table
+
+  tmp_filename = filename + '.tmp'
+  with open(tmp_filename, 'wb') as f:
+    f.write("%s\n%i\n" % (MAGIC, FORMAT_VERSION))
+    f.write(json.dumps(full_header))
+    f.write("\n")
+    for data in section_data:
+      f.write(data)
+  os.rename(tmp_filename, filename)
+
+class IndexSnapshot(object):
+  """
+  A snapshot file opened with mmap. Sections are only read out of the mapping
+  when they are asked for, and array sections are not read out at all: they
+  are served as ArrayViews on the mapping.
+  """
+  def __init__(self, filename):
+    self.filename = filename
+    self._file = open(filename, 'rb')
+    try:
+      self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (mmap.error, ValueError), ex:
+      self._file.close()
+      raise SnapshotException("Could not map %s: %s" % (filename, ex))
+
+    try:
+      self._read_header()
+    except:
+      self.close()
+      raise
+
+  def _read_header(self):
+    if self._mmap.readline() != MAGIC + '\n':
+      raise SnapshotException("%s is not a snapshot" % self.filename)
+    try:
+      version = int(self._mmap.readline())
+    except ValueError:
+      raise SnapshotException("%s has a corrupt version" % self.filename)
+    if version != FORMAT_VERSION:
+      raise SnapshotException("%s has version %i, expected %i" % (self.filename, version, FORMAT_VERSION))
+    try:
+      self.header = json.loads(self._mmap.readline())
+    except ValueError:
+      raise SnapshotException("%s has a corrupt header" % self.filename)
+    if (self.header["byteorder"] != sys.byteorder or
+        self.header["itemsize"] != array.array('i').itemsize):
+      raise SnapshotException("%s was written on an incompatible machine" % self.filename)
+    self._data_start = self._mmap.tell()
+    for kind,offset,length,count in self.header["sections"].itervalues():
+      if self._data_start + offset + length > len(self._mmap):
+        raise SnapshotException("%s is truncated" % self.filename)
+      if kind == ARRAY_SECTION and length != count * ArrayView._item.size:
+        raise SnapshotException("%s has a corrupt section table" % self.filename)
+
+  def close(self):
+    """
+    Closes the file. The mapping itself is only unmapped once the ArrayViews
+    served from it are gone.
+    """
+    self._mmap = None
+    self._file.close()
+
+  def has_section(self, name):
+    return name in self.header["sections"]
+
+  def _get_section(self, name, expected_kind):
+    if name not in self.header["sections"]:
+      raise SnapshotException("%s has no section %s" % (self.filename, name))
+    kind,offset,length,count = self.header["sections"][name]
+    if kind != expected_kind:
+      raise SnapshotException("Section %s is not of type %s" % (name, expected_kind))
+    return self._data_start + offset, length, count
+
+  def get_array(self, name):
+    """Returns the array section name as an ArrayView."""
+    begin, length, count = self._get_section(name, ARRAY_SECTION)
+    return ArrayView(self._mmap, begin, count)
+
+  def get_strings(self, name):
+    begin, length, count = self._get_section(name, STRINGS_SECTION)
+    return _decode_strings(self._mmap[begin:begin + length], count)
+
+def try_open(filename):
+  """Opens the snapshot at filename, returning None if it is missing or unusable."""
+  if not filename or not os.path.exists(filename):
+    return None
+  try:
+    return IndexSnapshot(filename)
+  except (IOError, SnapshotException, struct.error, ValueError), ex:
+    logging.warning("Ignoring index snapshot: %s", ex)
+    return None
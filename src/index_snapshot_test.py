@@ -0,0 +1,117 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import array
+import json
+import os
+import pickle
+import tempfile
+import unittest
+
+import index_snapshot
+
+from file_table import FileTable
+from index_snapshot import IndexSnapshot, SnapshotException
+
+class IndexSnapshotTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.dir, 'snapshot')
+
+  def tearDown(self):
+    for f in os.listdir(self.dir):
+      os.unlink(os.path.join(self.dir, f))
+    os.rmdir(self.dir)
+
+  def test_roundtrip(self):
+    index_snapshot.write_snapshot(self.filename, {"dirs": ["/a"]}, {
+        "ids": array.array('i', [3, 1, 2]),
+        "empty_ids": array.array('i'),
+        "names": [u"foo", "bar", u"b\xe4z"],
+        "no_names": []})
+    snapshot = IndexSnapshot(self.filename)
+    try:
+      self.assertEquals(["/a"], snapshot.header["dirs"])
+      ids = snapshot.get_array("ids")
+      self.assertEquals(3, len(ids))
+      self.assertEquals([3, 1, 2], list(ids))
+      self.assertEquals(2, ids[-1])
+      self.assertEquals(array.array('i', [1, 2]), ids[1:])
+      self.assertEquals(array.array('i', [3, 1, 2]), pickle.loads(pickle.dumps(ids)))
+      self.assertRaises(IndexError, lambda: ids[3])
+      self.assertEquals([], list(snapshot.get_array("empty_ids")))
+      self.assertEquals([u"foo", u"bar", u"b\xe4z"], snapshot.get_strings("names"))
+      self.assertEquals([], snapshot.get_strings("no_names"))
+      self.assertTrue(snapshot.has_section("ids"))
+      self.assertFalse(snapshot.has_section("xxx"))
+      self.assertRaises(SnapshotException, lambda: snapshot.get_strings("ids"))
+    finally:
+      snapshot.close()
+    # Views outlive the snapshot they came from.
+    self.assertEquals(array.array('i', [3, 1]), ids[:2])
+    self.assertEquals(['snapshot'], os.listdir(self.dir))
+
+  def test_file_table_roundtrip(self):
+    table = FileTable()
+    files = ["/a/b/c.txt", "/a/d.txt", "/a/b/e.txt", "x/f.txt"]
+    for f in files:
+      table.add_file(f)
+    index_snapshot.write_snapshot(self.filename, {}, table.get_snapshot_sections("t."))
+    snapshot = IndexSnapshot(self.filename)
+    try:
+      loaded = FileTable.from_snapshot(snapshot, "t.")
+    finally:
+      snapshot.close()
+    self.assertEquals(files, list(loaded.iterfilenames()))
+    self.assertEquals(table.dir_trie.find_dir("/a/b"), loaded.dir_trie.find_dir("/a/b"))
+    loaded.add_file("/a/b/g.txt")
+    self.assertEquals(len(table.dir_trie), len(loaded.dir_trie))
+
+  def test_rejects_bad_files(self):
+    index_snapshot.write_snapshot(self.filename, {}, {"ids": array.array('i', range(100))})
+    data = open(self.filename, 'rb').read()
+
+    open(self.filename, 'wb').write(data[:-4])
+    self.assertRaises(SnapshotException, lambda: IndexSnapshot(self.filename))
+
+    open(self.filename, 'wb').write(data.replace("\n%i\n" % index_snapshot.FORMAT_VERSION, "\n0\n", 1))
+    self.assertRaises(SnapshotException, lambda: IndexSnapshot(self.filename))
+
+    open(self.filename, 'wb').write("something else\n")
+    self.assertRaises(SnapshotException, lambda: IndexSnapshot(self.filename))
+    self.assertEquals(None, index_snapshot.try_open(self.filename))
+    self.assertEquals(None, index_snapshot.try_open(os.path.join(self.dir, 'missing')))
+
+  def test_try_open_ignores_corrupt_files(self):
+    index_snapshot.write_snapshot(self.filename, {}, {"ids": array.array('i', range(100))})
+    magic, version, header, data = open(self.filename, 'rb').read().split("\n", 3)
+    def write_with_sections(sections):
+      header_dict = json.loads(header)
+      header_dict["sections"] = sections
+      open(self.filename, 'wb').write("\n".join([magic, version, json.dumps(header_dict), data]))
+
+    write_with_sections({"ids": ["array", 0, 400]})
+    self.assertEquals(None, index_snapshot.try_open(self.filename))
+    write_with_sections({"ids": ["array", 0, 399, 100]})
+    self.assertEquals(None, index_snapshot.try_open(self.filename))
+    write_with_sections({"ids": ["array", 0, 400, 100]})
+    snapshot = index_snapshot.try_open(self.filename)
+    self.assertNotEquals(None, snapshot)
+    snapshot.close()
+
+    write_with_sections({"names": ["strings", 0, 400, 3]})
+    snapshot = index_snapshot.try_open(self.filename)
+    try:
+      self.assertRaises(SnapshotException, lambda: snapshot.get_strings("names"))
+    finally:
+      snapshot.close()
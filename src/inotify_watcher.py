@@ -0,0 +1,301 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import stat
+import struct
+import sys
+import threading
+import time
+
+from index_delta import IndexDelta
+
+# From <sys/inotify.h>.
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+_EVENT_HEADER = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+def _load_libc():
+  if not sys.platform.startswith('linux'):
+    return None
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.inotify_init1
+    libc.inotify_add_watch
+    libc.inotify_rm_watch
+  except (OSError, AttributeError):
+    return None
+  return libc
+
+_libc = _load_libc()
+
+def Supported():
+  return _libc != None
+
+def _decode(name):
+  # Match the find based indexer, which hands out unicode filenames.
+  if isinstance(name, unicode):
+    return name
+  try:
+    return name.decode('utf8')
+  except UnicodeDecodeError:
+    return name
+
+def _encode(path):
+  # The filesystem encoding may be ascii, so don't leave encoding unicode paths
+  # to the os functions.
+  if isinstance(path, unicode):
+    return path.encode('utf8')
+  return path
+
+class InotifyWatcher(object):
+  """
+  Watches directory trees with inotify and turns what happens in them into
+  IndexDeltas.
+
+  Events come in bursts, e.g. during a git checkout or a build, so they are
+  coalesced into one delta that is only handed out by get_delta once the trees
+  have been quiet for quiet_period seconds, or max_delay seconds after the first
+  event of the burst.
+
+  is_ignored(basename, fullname) decides which files and directories to skip,
+  like DirCache.is_ignored. If the kernel runs out of watches, watch_limit_reached
+  is set and changes below the unwatched directories go unnoticed.
+
+  Setting up the watches takes a walk over the trees, which runs on a thread of
+  its own. Changes are only all seen once is_watching is set.
+  """
+  def __init__(self, dirs, is_ignored = None, quiet_period = 0.2, max_delay = 2.0):
+    assert Supported()
+    self._fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self._fd < 0:
+      e = ctypes.get_errno()
+      raise OSError(e, os.strerror(e))
+
+    if is_ignored:
+      self._is_ignored = is_ignored
+    else:
+      self._is_ignored = lambda basename, fullname: False
+    self._quiet_period = quiet_period
+    self._max_delay = max_delay
+
+    # Guards everything below, which the thread that sets up the watches
+    # shares with the callers.
+    self._lock = threading.RLock()
+    self._closed = False
+    self._paths_by_wd = {}
+    self._wds_by_path = {}
+    self.watch_limit_reached = False
+    self.is_watching = False
+
+    self._delta = IndexDelta()
+    self._first_event_time = None
+    self._last_event_time = None
+
+    self._roots = set([_decode(os.path.realpath(d)) for d in dirs])
+    self._thread = threading.Thread(target=self._watch_roots, name="InotifyWatcher")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def close(self):
+    with self._lock:
+      self._closed = True
+    self._thread.join()
+    if self._fd != None:
+      os.close(self._fd)
+      self._fd = None
+
+  def _watch_roots(self):
+    for root in self._roots:
+      self._watch_tree(root, None)
+    self.is_watching = True
+
+  def set_baseline(self, file_table, walk_start_time):
+    """
+    Indexing waits for is_watching, so events already cover everything since
+    before the index walk started.
+    """
+    pass
+
+  def fileno(self):
+    return self._fd
+
+  @property
+  def num_watches(self):
+    return len(self._paths_by_wd)
+
+  def _add_watch(self, path):
+    wd = _libc.inotify_add_watch(self._fd, _encode(path), WATCH_MASK)
+    if wd < 0:
+      e = ctypes.get_errno()
+      if e == errno.ENOSPC:
+        if not self.watch_limit_reached:
+          logging.warning("Out of inotify watches, see /proc/sys/fs/inotify/max_user_watches")
+        self.watch_limit_reached = True
+      return False
+    self._paths_by_wd[wd] = path
+    self._wds_by_path[path] = wd
+    return True
+
+  def _watch_tree(self, root, delta):
+    """
+    Watches root and every directory below it. If delta is given, the files found
+    are recorded in it as added. This is used for directories that appear while
+    watching, whose files may have been created before the watch was in place.
+    """
+    pending = [root]
+    while len(pending):
+      d = pending.pop()
+      with self._lock:
+        if self._closed or not self._add_watch(d):
+          continue
+      try:
+        basenames = os.listdir(_encode(d))
+      except OSError:
+        continue
+      for basename in basenames:
+        basename = _decode(basename)
+        path = os.path.join(d, basename)
+        if self._is_ignored(basename, path):
+          continue
+        try:
+          st = os.lstat(_encode(path))
+        except OSError:
+          continue
+        if stat.S_ISDIR(st.st_mode):
+          pending.append(path)
+        elif delta and stat.S_ISREG(st.st_mode):
+          delta.add_file(path)
+
+  def _unwatch_tree(self, root):
+    prefix = os.path.join(root, '')
+    for path in [p for p in self._wds_by_path if p == root or p.startswith(prefix)]:
+      wd = self._wds_by_path.pop(path)
+      del self._paths_by_wd[wd]
+      _libc.inotify_rm_watch(self._fd, wd)
+
+  def _read(self):
+    chunks = []
+    while True:
+      try:
+        chunk = os.read(self._fd, _READ_SIZE)
+      except OSError, ex:
+        if ex.errno in (errno.EAGAIN, errno.EINTR):
+          break
+        raise
+      if not chunk:
+        break
+      chunks.append(chunk)
+    return ''.join(chunks)
+
+  def process_events(self):
+    """Reads the events that are waiting into the current delta."""
+    with self._lock:
+      data = self._read()
+      if not data:
+        return
+      now = time.time()
+      if self._first_event_time == None:
+        self._first_event_time = now
+      self._last_event_time = now
+
+      i = 0
+      while i + _EVENT_HEADER.size <= len(data):
+        wd, mask, cookie, name_length = _EVENT_HEADER.unpack_from(data, i)
+        i += _EVENT_HEADER.size
+        name = data[i:i + name_length].rstrip('\0')
+        i += name_length
+        self._handle_event(wd, mask, _decode(name))
+
+  def _handle_event(self, wd, mask, name):
+    if mask & IN_Q_OVERFLOW:
+      self._delta.needs_reindex = True
+      return
+
+    path = self._paths_by_wd.get(wd)
+    if mask & IN_IGNORED:
+      if path != None:
+        del self._paths_by_wd[wd]
+        if self._wds_by_path.get(path) == wd:
+          del self._wds_by_path[path]
+      return
+    if path == None:
+      return
+
+    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+      # Other directories are dealt with when their parent reports them gone.
+      if path in self._roots:
+        self._delta.needs_reindex = True
+      return
+
+    fullname = os.path.join(path, name)
+    if self._is_ignored(name, fullname):
+      return
+
+    if mask & IN_ISDIR:
+      if mask & (IN_CREATE | IN_MOVED_TO):
+        self._watch_tree(fullname, self._delta)
+      elif mask & (IN_DELETE | IN_MOVED_FROM):
+        self._unwatch_tree(fullname)
+        self._delta.remove_dir(fullname)
+    else:
+      if mask & (IN_CREATE | IN_MOVED_TO):
+        try:
+          is_file = stat.S_ISREG(os.lstat(_encode(fullname)).st_mode)
+        except OSError:
+          is_file = False
+        if is_file:
+          self._delta.add_file(fullname)
+      elif mask & (IN_DELETE | IN_MOVED_FROM):
+        self._delta.remove_file(fullname)
+
+  def get_delta(self, now = None):
+    """
+    Returns the IndexDelta for the latest burst of changes once it has settled,
+    or None if there is nothing to hand out yet.
+    """
+    self.process_events()
+    with self._lock:
+      if self._delta.is_empty():
+        return None
+      if now == None:
+        now = time.time()
+      if (not self._delta.needs_reindex and
+          now - self._last_event_time < self._quiet_period and
+          now - self._first_event_time < self._max_delay):
+        return None
+      delta = self._delta
+      self._delta = IndexDelta()
+      self._first_event_time = None
+      self._last_event_time = None
+      return delta
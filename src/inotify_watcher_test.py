@@ -0,0 +1,102 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import inotify_watcher
+
+class InotifyWatcherTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = os.path.realpath(tempfile.mkdtemp())
+    os.mkdir(os.path.join(self.dir, 'sub'))
+    os.mkdir(os.path.join(self.dir, '.svn'))
+    def is_ignored(basename, fullname):
+      return basename.startswith('.')
+    self.watcher = inotify_watcher.InotifyWatcher([self.dir], is_ignored)
+    while not self.watcher.is_watching:
+      time.sleep(0.01)
+
+  def tearDown(self):
+    self.watcher.close()
+    shutil.rmtree(self.dir)
+
+  def path(self, subpath):
+    return os.path.join(self.dir, subpath)
+
+  def touch(self, subpath):
+    open(self.path(subpath), 'w').close()
+
+  def get_settled_delta(self):
+    return self.watcher.get_delta(time.time() + 10)
+
+  def test_watches_are_set_up_in_the_background(self):
+    watcher = inotify_watcher.InotifyWatcher([self.dir])
+    try:
+      for i in range(100):
+        if watcher.is_watching:
+          break
+        time.sleep(0.01)
+      self.assertTrue(watcher.is_watching)
+      self.assertEquals(3, watcher.num_watches)
+    finally:
+      watcher.close()
+
+  def test_watches_tree(self):
+    self.assertEquals(2, self.watcher.num_watches)
+    self.assertFalse(self.watcher.watch_limit_reached)
+
+  def test_file_changes(self):
+    self.touch('a.txt')
+    self.touch('sub/b.txt')
+    self.touch('.svn/c.txt')
+    self.touch('.hidden')
+    delta = self.get_settled_delta()
+    self.assertEquals(set([self.path('a.txt'), self.path('sub/b.txt')]), delta.added_files)
+    self.assertEquals(None, self.get_settled_delta())
+
+    os.rename(self.path('a.txt'), self.path('sub/a2.txt'))
+    os.unlink(self.path('sub/b.txt'))
+    delta = self.get_settled_delta()
+    self.assertEquals(set([self.path('sub/a2.txt')]), delta.added_files)
+    self.assertEquals(set([self.path('a.txt'), self.path('sub/b.txt')]), delta.removed_files)
+
+  def test_dir_changes(self):
+    os.makedirs(self.path('new/deeper'))
+    self.touch('new/deeper/x.txt')
+    delta = self.get_settled_delta()
+    self.assertEquals(set([self.path('new/deeper/x.txt')]), delta.added_files)
+    self.assertEquals(4, self.watcher.num_watches)
+
+    shutil.rmtree(self.path('new'))
+    delta = self.get_settled_delta()
+    self.assertTrue(self.path('new') in delta.removed_dirs)
+    self.assertEquals(set(), delta.added_files)
+    self.assertEquals(2, self.watcher.num_watches)
+
+  def test_waits_for_burst_to_settle(self):
+    self.touch('a.txt')
+    self.watcher.process_events()
+    self.assertEquals(None, self.watcher.get_delta(time.time()))
+    self.assertEquals(1, len(self.get_settled_delta().added_files))
+
+  def test_losing_root_needs_reindex(self):
+    shutil.rmtree(self.dir)
+    os.mkdir(self.dir)
+    self.assertTrue(self.get_settled_delta().needs_reindex)
+
+if not inotify_watcher.Supported():
+  del InotifyWatcherTest
@@ -11,73 +11,235 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import collections
+import Queue
+import itertools
+import logging
 import os
+import stat
+import threading
 import time
-import json
 
 from src import db_indexer
 
+try:
+  from os import scandir as _scandir
+except ImportError:
+  try:
+    from scandir import scandir as _scandir
+  except ImportError:
+    _scandir = None
+
+# Walking is bound by filesystem latency rather than cpu, so use more threads
+# than there are cores to keep several directory reads in flight.
+NUM_WALKER_THREADS = 8
+
+# Pending dirs are walked in order of priority, lowest first.
+_PRIORITY_STOP = -1
+_PRIORITY_HINTED = 0
+_PRIORITY_NORMAL = 1
+
+_logged_scandir_fallback = False
+
+def _encode_path(path):
+  if isinstance(path, unicode):
+    return path.encode('utf8')
+  return path
+
+def _decode_name(name):
+  try:
+    return name.decode('utf8')
+  except UnicodeDecodeError:
+    return name
+
+def _list_dir(d):
+  """
+  Returns (dirs, files, symlinks), the basenames of the entries in d split by
+  type. Entries that are neither, like fifos, sockets and devices, are left
+  out. The types come from scandir's d_type where available, so only
+  filesystems that don't report d_type need a stat per entry.
+  """
+  dirs = []
+  files = []
+  symlinks = []
+  if _scandir:
+    for entry in _scandir(d):
+      if entry.is_symlink():
+        symlinks.append(entry.name)
+      elif entry.is_dir():
+        dirs.append(entry.name)
+      elif entry.is_file():
+        files.append(entry.name)
+  else:
+    for name in os.listdir(d):
+      try:
+        mode = os.lstat(os.path.join(d, name)).st_mode
+      except OSError:
+        continue
+      if stat.S_ISLNK(mode):
+        symlinks.append(name)
+      elif stat.S_ISDIR(mode):
+        dirs.append(name)
+      elif stat.S_ISREG(mode):
+        files.append(name)
+  return dirs, files, symlinks
+
 class ListdirBasedDBIndexer(db_indexer.DBIndexer):
-  def __init__(self, dirs, dir_cache):
+  """
+  Walks the dirs with a pool of threads that share one queue of directories
+  to list. The threads hand back the files of each directory, which
+  index_a_bit_more adds to the file table.
+
+  Only symlinks get resolved with realpath. Symlinked directories are walked
+  once, however many times they are linked to, and symlinked files are only
+  indexed under their target.
+  """
+  def __init__(self, dirs, dir_cache, num_threads = NUM_WALKER_THREADS):
     super(ListdirBasedDBIndexer, self).__init__(dirs)
 
+    global _logged_scandir_fallback
+    if not _scandir and not _logged_scandir_fallback:
+      logging.info("scandir is not available, walking with listdir and a stat per entry.")
+      _logged_scandir_fallback = True
+
     self._dir_cache = dir_cache
     self._dir_cache.reset_realpath_cache()
 
-    self._basename_slots = dict()
-
-    # variablse used both during indexing and once indexed
-    self.files_by_basename = dict() # maps basename to list
-
-    # variables used during indexing
-    self.pending = collections.deque()
+    # variables shared with the walker threads
+    self._lock = threading.Lock()
+    self._pending_dirs = Queue.PriorityQueue()
+    self._pending_dirs_seq = itertools.count() # keeps each priority FIFO
+    self._walked_dirs = Queue.Queue()
+    self._num_unfinished_dirs = 0 # dirs enqueued but not yet walked
     self.visited = set()
+    self._closed = False
+
     self.complete = False
     self._num_files_found = 0 # stats only
 
-    # enqueue start points in reverse because the whole search is DFS
-    reverse_dirs = list(dirs)
-    reverse_dirs.reverse()
-    for d in reverse_dirs:
-      self._enqueue_dir(d)
+    self._root_prefixes = []
+    for d in dirs:
+      real_d = _encode_path(self._dir_cache.realpath(d))
+      self._root_prefixes.append(os.path.join(real_d, ''))
+      self._enqueue_dir(real_d)
+
+    self._threads = []
+    for i in range(num_threads):
+      t = threading.Thread(target=self._walker_main)
+      t.daemon = True
+      t.start()
+      self._threads.append(t)
 
   @property
   def progress(self):
-    return "%i files found, %i dirs pending" % (self._num_files_found, len(self.pending))
+    return "%i files found, %i dirs pending" % (self._num_files_found, self._num_unfinished_dirs)
+
+  def close(self):
+    with self._lock:
+      if self._closed:
+        return
+      self._closed = True
+    for t in self._threads:
+      self._pending_dirs.put((_PRIORITY_STOP, self._pending_dirs_seq.next(), None))
+
+  def prioritize_paths(self, paths):
+    for p in paths:
+      d = _encode_path(self._dir_cache.realpath(os.path.dirname(p)))
+      if self._is_walkable(d):
+        self._enqueue_dir(d, _PRIORITY_HINTED)
+
+  def _is_walkable(self, d):
+    """True if d is under the roots and the walk would not skip it."""
+    for prefix in self._root_prefixes:
+      if not d.startswith(prefix):
+        continue
+      path = prefix[:-1]
+      for name in d[len(prefix):].split(os.sep):
+        path = os.path.join(path, name)
+        if self._dir_cache.is_dir_ignored(_decode_name(name), _decode_name(path)):
+          return False
+      return os.path.isdir(d)
+    return False
+
+  def _enqueue_dir(self, d, priority = _PRIORITY_NORMAL):
+    with self._lock:
+      if d in self.visited:
+        return
+      self.visited.add(d)
+      self._num_unfinished_dirs += 1
+    self._pending_dirs.put((priority, self._pending_dirs_seq.next(), d))
+
+  def _walker_main(self):
+    while True:
+      priority, _, d = self._pending_dirs.get()
+      if d == None or self._closed:
+        return
+      files = []
+      try:
+        files = self._walk_one(d, priority)
+      except OSError:
+        pass
+      finally:
+        # Post the files before counting the dir as done, so that nothing is
+        # left in flight once the count drops to zero.
+        self._walked_dirs.put(files)
+        with self._lock:
+          self._num_unfinished_dirs -= 1
+
+  def _is_under_roots(self, path):
+    for prefix in self._root_prefixes:
+      if path.startswith(prefix):
+        return True
+    return False
 
-  def _enqueue_dir(self, d):
-    dr = self._dir_cache.realpath(d)
-    if dr in self.visited:
-      return
-    self.visited.add(dr)
-    self.pending.appendleft(dr)
+  def _walk_one(self, d, priority = _PRIORITY_NORMAL):
+    """
+    Lists d, enqueueing its subdirectories with the same priority and
+    returning its files.
+    """
+    dirs, files, symlinks = _list_dir(d)
+    unicode_d = _decode_name(d)
+    res = []
+    for name in dirs:
+      path = os.path.join(d, name)
+      if not self._dir_cache.is_dir_ignored(_decode_name(name), _decode_name(path)):
+        self._enqueue_dir(path, priority)
+    for name in files:
+      unicode_name = _decode_name(name)
+      if not self._dir_cache.is_ignored(unicode_name, os.path.join(unicode_d, unicode_name)):
+        res.append(os.path.join(unicode_d, unicode_name))
+    for name in symlinks:
+      path = os.path.join(d, name)
+      if self._dir_cache.is_ignored(_decode_name(name), _decode_name(path)):
+        continue
+      real_path = os.path.realpath(path)
+      if os.path.isdir(real_path):
+        unicode_real_path = _decode_name(real_path)
+        if not self._dir_cache.is_dir_ignored(os.path.basename(unicode_real_path),
+                                              unicode_real_path):
+          self._enqueue_dir(real_path)
+      elif os.path.isfile(real_path) and not self._is_under_roots(real_path):
+        # Targets inside the dirs get found by the walk itself.
+        res.append(_decode_name(real_path))
+    return res
 
   def index_a_bit_more(self):
     start = time.time()
-    n = 0
-    try:
-      while time.time() - start < 0.25:
-        i = 0
-        while i < 10:
-          self._step_one()
-          i += 1
-          n += 1
-    except IndexError:
-      pass
-
-  def _step_one(self):
-    d = self.pending.popleft()
-    for basename in self._dir_cache.listdir(d):
-      path = self._dir_cache.realpath(os.path.join(d, basename))
-      if os.path.isdir(path):
-        self._enqueue_dir(path)
-      else:
-        if basename not in self.files_by_basename:
-          self.files_by_basename[basename] = []
-        self.files_by_basename[basename].append(path)
-        self._num_files_found += 1
-
-    if not len(self.pending):
-      self.complete = True
+    while True:
+      timeout = 0.25 - (time.time() - start)
+      if timeout <= 0:
+        break
+      try:
+        files = self._walked_dirs.get(True, timeout)
+      except Queue.Empty:
+        files = None
+      if files != None:
+        for f in files:
+          self.file_table.add_file(f)
+        self._num_files_found += len(files)
 
+      with self._lock:
+        done = self._num_unfinished_dirs == 0
+      if done and self._walked_dirs.empty():
+        self.complete = True
+        self.close()
+        return
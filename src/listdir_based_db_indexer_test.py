@@ -0,0 +1,105 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import tempfile
+import unittest
+
+from dir_cache import DirCache
+from src import listdir_based_db_indexer
+from test_data import TestData
+
+class ListdirBasedDBIndexerTest(unittest.TestCase):
+  def setUp(self):
+    self.test_data = TestData()
+
+  def tearDown(self):
+    self.test_data.close()
+
+  def index(self, dirs, ignores = [], hints = []):
+    dir_cache = DirCache()
+    dir_cache.set_ignores(ignores)
+    indexer = listdir_based_db_indexer.ListdirBasedDBIndexer(dirs, dir_cache)
+    indexer.prioritize_paths(hints)
+    while not indexer.complete:
+      indexer.index_a_bit_more()
+    return list(indexer.file_table.iterfilenames())
+
+  def test_walk(self):
+    files = self.index([self.test_data.test_data_dir], ['*.o', '.*'])
+    self.assertEquals(len(files), len(set(files)))
+    self.assertTrue(self.test_data.path_to('project1/MySubSystem.c') in files)
+    self.assertTrue(self.test_data.path_to('something/ignored.pyc') in files)
+    self.assertFalse(self.test_data.path_to('something/ignored.o') in files)
+    self.assertFalse(self.test_data.path_to('.dotfile') in files)
+    self.assertFalse(self.test_data.path_to('gitproj/.git/HEAD') in files)
+    # Symlinked dirs are only walked once and symlinked files resolve to
+    # their target.
+    self.assertFalse(self.test_data.path_to('project1_symlink/MySubSystem.c') in files)
+    self.assertFalse(self.test_data.path_to('something/foo.txt') in files)
+    self.assertTrue(self.test_data.path_to('project1/foo.txt') in files)
+
+  def test_matches_serial_walk(self):
+    ref = set()
+    for d, dirnames, filenames in os.walk(self.test_data.path_to('project1')):
+      for f in filenames:
+        ref.add(os.path.join(d, f).decode('utf8'))
+    self.assertEquals(ref, set(self.index([self.test_data.path_to('project1')])))
+
+  def test_only_regular_files_are_indexed(self):
+    d = os.path.realpath(tempfile.mkdtemp())
+    other_d = os.path.realpath(tempfile.mkdtemp())
+    try:
+      open(os.path.join(d, 'file.txt'), 'w').close()
+      os.mkfifo(os.path.join(d, 'fifo'))
+      os.mkfifo(os.path.join(other_d, 'fifo'))
+      os.symlink(os.path.join(other_d, 'fifo'), os.path.join(d, 'fifo_symlink'))
+      self.assertEquals([os.path.join(d, 'file.txt')], self.index([d]))
+
+      real_scandir = listdir_based_db_indexer._scandir
+      listdir_based_db_indexer._scandir = None
+      try:
+        self.assertEquals([os.path.join(d, 'file.txt')], self.index([d]))
+      finally:
+        listdir_based_db_indexer._scandir = real_scandir
+    finally:
+      shutil.rmtree(d)
+      shutil.rmtree(other_d)
+
+  def test_nonexistant_dir(self):
+    self.assertEquals([], self.index([self.test_data.path_to('xxx')]))
+
+  def test_ignored_dir_is_pruned(self):
+    listed = []
+    real_list_dir = listdir_based_db_indexer._list_dir
+    def list_dir(d):
+      listed.append(d)
+      return real_list_dir(d)
+    listdir_based_db_indexer._list_dir = list_dir
+    try:
+      files = self.index([self.test_data.test_data_dir],
+                         [self.test_data.path_to('project1') + '/*'])
+    finally:
+      listdir_based_db_indexer._list_dir = real_list_dir
+    self.assertFalse(self.test_data.path_to('project1/MySubSystem.c') in files)
+    self.assertFalse(self.test_data.path_to('project1') in listed)
+
+  def test_prioritize_paths(self):
+    ref = self.index([self.test_data.test_data_dir], ['*.o', '.*'])
+    files = self.index([self.test_data.test_data_dir], ['*.o', '.*'],
+                       [self.test_data.path_to('project1/module/x.txt'),
+                        self.test_data.path_to('svnproj/.svn/x.txt'),
+                        '/elsewhere/x.txt'])
+    self.assertEquals(set(ref), set(files))
+    self.assertEquals(len(files), len(set(files)))
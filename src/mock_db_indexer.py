@@ -12,13 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
-class MockDBIndexer(object):
-  def __init__(self, dirs, files = [], files_by_basename = {}):
-    self.dirs = dirs
-    self.files_by_basename = files_by_basename
-    for f in files:
-      bn = os.path.basename(f)
-      if bn not in self.files_by_basename:
-        self.files_by_basename[bn] = []
-      self.files_by_basename[bn].append(f)
 
+from src import db_indexer
+
+class MockDBIndexer(db_indexer.DBIndexer):
+  def __init__(self, dirs = [], files = [], files_by_basename = {}):
+    super(MockDBIndexer, self).__init__(dirs)
+    for basename,files_with_basename in files_by_basename.iteritems():
+      for f in files_with_basename:
+        self.file_table.add_file(f)
+    for f in files:
+      self.file_table.add_file(f)
+    self.complete = True
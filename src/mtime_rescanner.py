@@ -0,0 +1,287 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import collections
+import os
+import stat
+import threading
+import time
+
+from index_delta import IndexDelta
+
+# Seconds between the end of one sweep over the dirs and the start of the next.
+DEFAULT_SWEEP_INTERVAL = 5.0
+
+# How much earlier than the start of the index walk a dir may have last
+# changed and still be compared to the index, to allow for filesystems that
+# store st_mtime coarsely.
+INDEX_WALK_MTIME_SLACK = 2.0
+
+def _decode(name):
+  # DirCache hands out unicode entries.
+  if isinstance(name, unicode):
+    return name
+  try:
+    return name.decode('utf8')
+  except UnicodeDecodeError:
+    return name
+
+class MtimeRescanner(object):
+  """
+  Finds changes to directory trees by periodically sweeping over them with a
+  DirCache. Only directories whose st_mtime changed get listed again, so a sweep
+  costs a stat per directory rather than a full walk. This works everywhere,
+  including on network mounts and when inotify watches have run out.
+
+  Sweeps run on a thread of their own, so neither indexing nor searches wait
+  for them. Nothing is swept until set_baseline hands over the index that the
+  deltas are meant for. The first sweep then compares the dirs that changed
+  since the index walk started to what the index has for them, and takes the
+  types of the entries of the other dirs from the index rather than stat'ing
+  them again right after the walk did. Later
+  sweeps compare listings to those of the previous sweep, so no change falls
+  in between. Deltas may repeat changes that the index already has, which
+  applying them copes with.
+
+  It has the same interface as InotifyWatcher.
+  """
+  def __init__(self, dirs, dir_cache, sweep_interval = None):
+    self._dir_cache = dir_cache
+    self._roots = [(d, dir_cache.realpath(d)) for d in dirs]
+    if sweep_interval == None:
+      sweep_interval = DEFAULT_SWEEP_INTERVAL
+    self._sweep_interval = sweep_interval
+
+    # Sweep thread only: maps each known dir to the set of its subdirectories,
+    # and until the first sweep is done, maps the dirs of the index to their
+    # entries there.
+    self._subdirs_by_dir = {}
+    self._pending = collections.deque()
+    self._index_listings = None
+    self._walk_start_time = None
+
+    self._cond = threading.Condition()
+    self._baseline = None # (file table, walk start time) until the first sweep
+    self._delta = IndexDelta() # changes of the sweeps done so far
+    self._sweep_count = 0
+    self._closed = False
+    self.watch_limit_reached = False
+    self.is_watching = True
+
+    self._thread = threading.Thread(target=self._run, name="MtimeRescanner")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def close(self):
+    with self._cond:
+      self._closed = True
+      self._cond.notify()
+    self._thread.join()
+
+  def set_baseline(self, file_table, walk_start_time):
+    """
+    Makes file_table, a FileTable of the index whose walk started at
+    walk_start_time, what the first sweep is compared to. The table is copied,
+    so the caller may go on changing it.
+    """
+    with self._cond:
+      self._baseline = (file_table.copy(), walk_start_time)
+      self._cond.notify()
+
+  def _real_path(self, path):
+    for d, real_d in self._roots:
+      if path == d:
+        return real_d
+      if path.startswith(os.path.join(d, '')):
+        return os.path.join(real_d, path[len(d) + 1:])
+    return path
+
+  def _add_index_dir(self, listings, d):
+    """Adds d and the dirs between it and its root to listings."""
+    if d in listings:
+      return
+    listings[d] = {}
+    real_roots = [real_d for unused_d, real_d in self._roots]
+    while d not in real_roots:
+      parent, name = os.path.split(d)
+      if parent == d:
+        return
+      parent_listing = listings.get(parent)
+      if parent_listing != None:
+        parent_listing[_decode(name)] = True
+        return
+      listings[parent] = {_decode(name): True}
+      d = parent
+
+  def _get_index_listings(self, file_table):
+    """
+    Returns the entries that file_table has for each of its dirs, as a dict
+    that maps each dir to a dict that maps its entries to whether they are dirs.
+    """
+    listings = {}
+    dirs_by_dirname_id = {}
+    for file_id in xrange(len(file_table)):
+      if file_table.is_removed(file_id):
+        continue
+      dirname_id = file_table.get_dirname_id(file_id)
+      d = dirs_by_dirname_id.get(dirname_id)
+      if d == None:
+        d = _decode(self._real_path(file_table.get_dirname(file_id)))
+        dirs_by_dirname_id[dirname_id] = d
+        self._add_index_dir(listings, d)
+      listings[d][_decode(file_table.get_basename(file_id))] = False
+    return listings
+
+  def _get_mode(self, path):
+    # DirCache hands out unicode entries, which os.lstat would encode with
+    # the possibly ascii filesystem encoding.
+    if isinstance(path, unicode):
+      path = path.encode('utf8')
+    try:
+      return os.lstat(path).st_mode
+    except OSError:
+      return 0
+
+  def _is_dir(self, path):
+    return stat.S_ISDIR(self._get_mode(path))
+
+  def _is_file(self, path):
+    return stat.S_ISREG(self._get_mode(path))
+
+  def _forget_dir(self, d):
+    subdirs = self._subdirs_by_dir.pop(d, None)
+    if subdirs:
+      for subdir in subdirs:
+        self._forget_dir(subdir)
+
+  def _sweep_one(self, d, delta):
+    ents, added, removed = self._dir_cache.listdir_with_changes(d)
+    subdirs = self._subdirs_by_dir.get(d)
+    if subdirs == None:
+      # A dir that is new to us: everything in it is new.
+      subdirs = set()
+      self._subdirs_by_dir[d] = subdirs
+      added = ents
+      removed = []
+      if self._index_listings != None:
+        # The index saw the dir as it is unless the dir changed after the
+        # index walk started.
+        index_ents = self._index_listings.get(d, {})
+        de = self._dir_cache.dirs.get(d)
+        unchanged = de and de.st_mtime < self._walk_start_time - INDEX_WALK_MTIME_SLACK
+        self._compare_to_index(d, ents, index_ents, unchanged, subdirs, delta)
+        self._pending.extend(subdirs)
+        return
+
+    for e in removed:
+      path = os.path.join(d, e)
+      if path in subdirs:
+        subdirs.remove(path)
+        self._forget_dir(path)
+        delta.remove_dir(path)
+      else:
+        delta.remove_file(path)
+
+    for e in added:
+      path = os.path.join(d, e)
+      if self._is_dir(path):
+        subdirs.add(path)
+      elif self._is_file(path):
+        delta.add_file(path)
+
+    self._pending.extend(subdirs)
+
+  def _compare_to_index(self, d, ents, index_ents, unchanged, subdirs, delta):
+    """
+    Records the subdirs of d, and the changes to d since the index listed it
+    as index_ents. If d is unchanged since, there are none, and only the
+    entries that the index doesn't have need a stat to tell dirs from files.
+    """
+    for e in ents:
+      path = os.path.join(d, e)
+      was_dir = index_ents.get(e)
+      if unchanged and was_dir != None:
+        if was_dir:
+          subdirs.add(path)
+        continue
+      is_dir = self._is_dir(path)
+      if is_dir:
+        subdirs.add(path)
+      if unchanged:
+        continue
+      if is_dir and was_dir == False:
+        delta.remove_file(path)
+      elif not is_dir and was_dir != False and self._is_file(path):
+        if was_dir:
+          delta.remove_dir(path)
+        delta.add_file(path)
+    if unchanged:
+      return
+    ents_set = set(ents)
+    for e, was_dir in index_ents.iteritems():
+      if e in ents_set:
+        continue
+      if was_dir:
+        delta.remove_dir(os.path.join(d, e))
+      else:
+        delta.remove_file(os.path.join(d, e))
+
+  def _sweep(self):
+    """Sweeps over the dirs, returning an IndexDelta of the changes found."""
+    delta = IndexDelta()
+    self._pending.extend([real_d for d, real_d in self._roots])
+    while len(self._pending) and not self._closed:
+      self._sweep_one(self._pending.popleft(), delta)
+    return delta
+
+  def _run(self):
+    with self._cond:
+      while self._baseline == None and not self._closed:
+        self._cond.wait()
+      if self._closed:
+        return
+      file_table, self._walk_start_time = self._baseline
+      self._baseline = None
+    self._index_listings = self._get_index_listings(file_table)
+    del file_table
+
+    while True:
+      delta = self._sweep()
+      self._index_listings = None
+      with self._cond:
+        if self._closed:
+          return
+        self._delta.merge(delta)
+        self._sweep_count += 1
+        self._cond.notify_all()
+        deadline = time.time() + self._sweep_interval
+        while not self._closed and time.time() < deadline:
+          self._cond.wait(deadline - time.time())
+        if self._closed:
+          return
+
+  def process_events(self):
+    """Sweeps run on their own thread, so there is nothing to do here."""
+    pass
+
+  def get_delta(self, now = None):
+    """
+    Returns the IndexDelta of the sweeps completed since the last call, or None
+    if nothing changed.
+    """
+    with self._cond:
+      if self._delta.is_empty():
+        return None
+      delta = self._delta
+      self._delta = IndexDelta()
+      return delta
@@ -0,0 +1,110 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from dir_cache import DirCache
+from file_table import FileTable
+from mtime_rescanner import MtimeRescanner
+
+class MtimeRescannerTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = os.path.realpath(tempfile.mkdtemp())
+    os.makedirs(self.path('sub/deeper'))
+    os.mkdir(self.path('.svn'))
+    self.touch('a.txt')
+    self.touch('sub/deeper/b.txt')
+    dir_cache = DirCache()
+    dir_cache.set_ignores(['.*'])
+    self.rescanner = MtimeRescanner([self.dir], dir_cache, 0)
+
+  def tearDown(self):
+    self.rescanner.close()
+    shutil.rmtree(self.dir)
+
+  def path(self, subpath):
+    return os.path.join(self.dir, subpath)
+
+  def touch(self, subpath):
+    open(self.path(subpath), 'w').close()
+
+  def set_baseline(self, subpaths, walk_start_time):
+    file_table = FileTable()
+    for subpath in subpaths:
+      file_table.add_file(self.path(subpath))
+    self.rescanner.set_baseline(file_table, walk_start_time)
+
+  def finish_sweep(self):
+    """Waits for a sweep that started after the call and returns the delta."""
+    with self.rescanner._cond:
+      sweep_count = self.rescanner._sweep_count
+      while self.rescanner._sweep_count < sweep_count + 2:
+        self.rescanner._cond.wait(1)
+    return self.rescanner.get_delta()
+
+  def test_nothing_is_swept_without_baseline(self):
+    time.sleep(0.1)
+    self.assertEquals(0, self.rescanner._sweep_count)
+    self.assertEquals(None, self.rescanner.get_delta())
+
+  def test_baseline_has_no_changes(self):
+    self.set_baseline(['a.txt', 'sub/deeper/b.txt'], time.time())
+    self.assertEquals(None, self.finish_sweep())
+    self.assertEquals(None, self.finish_sweep())
+
+  def test_changes_during_index_walk(self):
+    # The index missed c.txt and still has the removed x.txt and gone/y.txt.
+    self.touch('c.txt')
+    self.set_baseline(['a.txt', 'x.txt', 'gone/y.txt', 'sub/deeper/b.txt'], time.time())
+    delta = self.finish_sweep()
+    self.assertEquals(set([self.path('c.txt')]), delta.added_files)
+    self.assertEquals(set([self.path('x.txt')]), delta.removed_files)
+    self.assertEquals(set([self.path('gone')]), delta.removed_dirs)
+
+  def test_dirs_unchanged_since_index_walk_are_trusted(self):
+    # Files that the indexer chose to leave out, e.g. ones git ignores.
+    self.set_baseline(['sub/deeper/b.txt'], time.time() + 60)
+    self.assertEquals(None, self.finish_sweep())
+
+  def test_first_sweep_trusts_index_for_entry_types(self):
+    stated = []
+    real_get_mode = self.rescanner._get_mode
+    def get_mode(path):
+      stated.append(path)
+      return real_get_mode(path)
+    self.rescanner._get_mode = get_mode
+    self.touch('sub/left_out.txt')
+    self.set_baseline(['a.txt', 'sub/deeper/b.txt'], time.time() + 60)
+    self.assertEquals(None, self.finish_sweep())
+    # Only the entry that the index doesn't have was stat'ed.
+    self.assertEquals([self.path('sub/left_out.txt')], stated)
+
+  def test_changes(self):
+    self.set_baseline(['a.txt', 'sub/deeper/b.txt'], time.time())
+    self.finish_sweep()
+    time.sleep(1.2) # let st_mtime advance a second
+    self.touch('c.txt')
+    self.touch('.svn/ignored.txt')
+    os.unlink(self.path('a.txt'))
+    os.mkdir(self.path('new'))
+    self.touch('new/d.txt')
+    shutil.rmtree(self.path('sub/deeper'))
+    delta = self.finish_sweep()
+    self.assertEquals(set([self.path('c.txt'), self.path('new/d.txt')]), delta.added_files)
+    self.assertEquals(set([self.path('a.txt')]), delta.removed_files)
+    self.assertEquals(set([self.path('sub/deeper')]), delta.removed_dirs)
+    self.assertEquals(None, self.finish_sweep())
@@ -0,0 +1,82 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+
+from basename_ranker import rank_basenames
+from file_table import FileTable
+from src import db_index_shard
+
+class ProvisionalShardManager(object):
+  """
+  Stands in for a DBShardManager while the first index is still being built,
+  so that the files found so far can be searched. Files are only ever
+  added, in batches, and their basenames go to a single in-process shard
+  that scans them without building any indices.
+
+  Its results are always marked truncated, since more files may turn up.
+  """
+  def __init__(self, dirs):
+    self.dirs = dirs
+    self.file_table = FileTable()
+    self._shard = db_index_shard.DBIndexShard([])
+
+  def add_files(self, filenames):
+    """
+    Adds filenames, which must not have been added before. The shard drops
+    basenames it already has.
+    """
+    basenames = []
+    for f in filenames:
+      dirname, basename = os.path.split(f)
+      self.file_table.add(dirname, basename)
+      basenames.append(basename)
+    self._shard.add_basenames(basenames)
+
+  @property
+  def file_tables(self):
+    return [self.file_table]
+
+  @property
+  def num_shards(self):
+    return 1
+
+  @property
+  def status(self):
+    return "%i files found so far" % self.file_table.num_files
+
+  def close(self):
+    pass
+
+  def search_basenames(self, basename_query):
+    hits, truncated = self._shard.search_basenames(basename_query)
+    return list(hits), True
+
+  def search_ranked_basenames(self, basename_query, max_hits = None):
+    lower_hits, truncated = self.search_basenames(basename_query)
+    basenames = [self.file_table.get_basename(self.file_table.get_file_ids_with_lower_basename(lower_hit)[0])
+                 for lower_hit in lower_hits]
+    return rank_basenames(basename_query, basenames, max_hits), truncated
+
+  def begin_search_ranked_basenames(self, basename_query, max_hits = None):
+    # Like a LocalPool shard, the search runs when its result is asked for.
+    return _ProvisionalRankedBasenameSearch(self, basename_query, max_hits)
+
+class _ProvisionalRankedBasenameSearch(object):
+  def __init__(self, shard_manager, basename_query, max_hits):
+    self._shard_manager = shard_manager
+    self._basename_query = basename_query
+    self._max_hits = max_hits
+
+  def get(self):
+    return self._shard_manager.search_ranked_basenames(self._basename_query, self._max_hits)
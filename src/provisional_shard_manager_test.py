@@ -0,0 +1,33 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+from provisional_shard_manager import ProvisionalShardManager
+from query import Query
+from query_cache import QueryCache
+
+class ProvisionalShardManagerTest(unittest.TestCase):
+  def test_grows(self):
+    m = ProvisionalShardManager(["a/"])
+    self.assertEquals([], Query("foo").execute(m, QueryCache()).filenames)
+
+    m.add_files(["a/foo.txt", "a/bar.txt"])
+    res = Query("foo").execute(m, QueryCache())
+    self.assertEquals(["a/foo.txt"], res.filenames)
+    self.assertTrue(res.truncated)
+
+    m.add_files(["a/b/foo.txt"])
+    self.assertEquals(set(["a/foo.txt", "a/b/foo.txt"]),
+                      set(Query("foo").execute(m, QueryCache()).filenames))
+    self.assertEquals(3, m.file_table.num_files)
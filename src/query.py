@@ -21,9 +21,14 @@ from basename_ranker import BasenameRanker
 from query_result import QueryResult
 from trace_event import *
 
-def _is_in_base_path(filename, base_path):
+def _normalize_base_path(base_path):
   expanded_base_path = os.path.expandvars(os.path.expanduser(base_path))
-  normalized_base_path = os.path.abspath(os.path.realpath(expanded_base_path))
+  return os.path.abspath(os.path.realpath(expanded_base_path))
+
+def _is_in_base_path(filename, base_path):
+  return _is_in_normalized_base_path(filename, _normalize_base_path(base_path))
+
+def _is_in_normalized_base_path(filename, normalized_base_path):
   normalized_filename = os.path.abspath(filename)
   common = os.path.commonprefix([normalized_base_path, normalized_filename])
   return common == normalized_base_path
@@ -56,8 +61,9 @@ def _filter_for_base_path(base_result, query):
     res.debug_info = copy.deepcopy(base_result.debug_info)
     res.truncated = base_result.truncated
 
+    normalized_base_path = _normalize_base_path(query.base_path)
     for hit,rank in base_result.hits:
-      if _is_in_base_path(hit, query.base_path):
+      if _is_in_normalized_base_path(hit, normalized_base_path):
         res.filenames.append(hit)
         res.ranks.append(rank)
     return res
@@ -88,11 +94,19 @@ def _apply_global_rank_adjustment(base_result, indexed_dirs, query):
     active_dir_orders[i] = len(active_dir_orders)
   active_dir_orders = [(x,y) for x,y in active_dir_orders.items()]
 
+  # hit_cmp runs O(n log n) times, so look up each hit's order just once.
+  order_by_filename = {}
   def get_order(f):
+    res = order_by_filename.get(f)
+    if res != None:
+      return res
+    res = sys.maxint
     for d,order in active_dir_orders:
       if f.startswith(d):
-        return order
-    return sys.maxint
+        res = order
+        break
+    order_by_filename[f] = res
+    return res
 
   def hit_cmp(x,y):
     # directory order trumps everything
@@ -144,26 +158,13 @@ def _rerank(hits):
     res.append((hits[i][0], res[i-1][1] + delta))
   return res
 
-def _filter_result_for_exact_matches(query_text, base_result):
-  """
-  Returns a new QueryResult object containing only filenames that exactly
-  match the provided query.
-  """
-  res = QueryResult()
-  res.debug_info = copy.deepcopy(base_result.debug_info)
-  res.truncated = base_result.truncated
-
-  for hit,rank in base_result.hits:
-    if _is_exact_match(query_text, hit):
-      res.filenames.append(hit)
-      res.ranks.append(rank)
-  return res
-
 def _is_dirmatch(lower_dirpart_query, filename):
+  return _is_dirname_match(lower_dirpart_query, os.path.dirname(filename))
+
+def _is_dirname_match(lower_dirpart_query, dirname):
   if lower_dirpart_query == '':
     return True
 
-  dirname = os.path.dirname(filename)
   lower_dirname = dirname.lower()
   if lower_dirname.endswith(lower_dirpart_query):
     return True
@@ -229,6 +230,9 @@ class Query(object):
 
     assert self.max_hits >= 0
 
+    if self.exact_match:
+      return self._execute_exact(shard_manager)
+
     res = query_cache.try_get(self)
     if not res:
       res_was_cache_hit = False
@@ -242,10 +246,7 @@ class Query(object):
     if self.base_path:
       res = _filter_for_base_path(res, self)
 
-    if self.exact_match:
-      final_res = _filter_result_for_exact_matches(self.text, res)
-    else:
-      final_res = _apply_global_rank_adjustment(res, shard_manager.dirs, self)
+    final_res = _apply_global_rank_adjustment(res, shard_manager.dirs, self)
 
     if self.debug:
       final_res.debug_info.append({"res_was_cache_hit": res_was_cache_hit})
@@ -254,6 +255,48 @@ class Query(object):
                                     })
     return final_res
 
+  def _execute_exact(self, shard_manager):
+    """
+    Answers an exact_match query from the hash indices of the file tables,
+    without searching the shards. The files whose basename is that of the
+    query match, or if there are none, those whose basename is it plus one or
+    more extensions, e.g. foo.cc or foo.tar.gz for foo.
+    """
+    basename_query = os.path.basename(self.text)
+    if basename_query == '':
+      return QueryResult()
+    lower_basename_query = basename_query.lower()
+    file_tables = shard_manager.file_tables
+
+    filenames = []
+    for file_table in file_tables:
+      for file_id in file_table.get_file_ids_with_lower_basename(lower_basename_query):
+        filename = file_table.get_filename(file_id)
+        if _is_exact_match(self.text, filename):
+          filenames.append(filename)
+    if not len(filenames):
+      for file_table in file_tables:
+        for file_id in file_table.get_file_ids_with_lower_stem(lower_basename_query):
+          filename = file_table.get_filename(file_id)
+          stem_end = len(filename) - len(os.path.basename(filename)) + len(basename_query)
+          if _is_exact_match(self.text, filename[:stem_end]):
+            filenames.append(filename)
+    filenames.sort()
+
+    if self.base_path:
+      normalized_base_path = _normalize_base_path(self.base_path)
+      filenames = [f for f in filenames
+                   if _is_in_normalized_base_path(f, normalized_base_path)]
+
+    hits = []
+    basename_ranker = BasenameRanker()
+    for filename in filenames[:self.max_hits]:
+      hits.append((filename, basename_ranker.rank_query(basename_query, os.path.basename(filename))))
+    res = QueryResult(hits=hits, truncated=len(filenames) > self.max_hits)
+    if self.debug:
+      res.debug_info.append({"res_was_cache_hit": False})
+    return res
+
   def execute_nocache(self, shard_manager, query_cache):
     # What we'll actually return
     truncated = False
@@ -267,36 +310,94 @@ class Query(object):
       basename_query = self.text
     lower_dirpart_query = dirpart_query.lower()
 
-    # Get the files
-    files = []
+    # Get the matching files as (file_table, file_id) pairs, the index being
+    # made of one file table per partition. Whether a directory matches is
+    # remembered per dir trie node, since many files share a directory.
+    file_tables = shard_manager.file_tables
+    dirmatch_memos = dict([(id(t), {}) for t in file_tables])
+    def is_dirmatch(file_table, file_id):
+      if lower_dirpart_query == '':
+        return True
+      dirmatch_by_dirname_id = dirmatch_memos[id(file_table)]
+      dirname_id = file_table.get_dirname_id(file_id)
+      res = dirmatch_by_dirname_id.get(dirname_id)
+      if res == None:
+        res = _is_dirname_match(lower_dirpart_query, file_table.dir_trie.get_path(dirname_id))
+        dirmatch_by_dirname_id[dirname_id] = res
+      return res
+
     if len(basename_query):
-      basename_hits, truncated = shard_manager.search_basenames(basename_query)
-      for hit in basename_hits:
-        hit_files = shard_manager.files_by_lower_basename[hit]
-        for f in hit_files:
-          if _is_dirmatch(lower_dirpart_query, f):
-            files.append(f)
-    else:
-      i = 0
-      start = time.time()
-      timeout = start + self._dir_search_timeout
-      for f in shard_manager.files:
-        if _is_dirmatch(lower_dirpart_query, f):
-          files.append(f)
+      return self._execute_basename_nocache(shard_manager, basename_query, lower_dirpart_query, is_dirmatch)
+
+    matches = []
+    i = 0
+    start = time.time()
+    timeout = start + self._dir_search_timeout
+    for file_table in file_tables:
+      for file_id in xrange(len(file_table)):
+        if file_table.is_removed(file_id):
+          continue
+        if is_dirmatch(file_table, file_id):
+          matches.append((file_table, file_id))
         i += 1
         if i % 1000 == 0:
           if time.time() >= timeout:
             truncated = True
             break
+      if truncated:
+        break
 
-    # Rank the results
+    # Rank the results. Only the first max_hits survive truncation in
+    # execute, so only those get their full filename built.
     trace_begin("rank_results")
     hits = []
     basename_ranker = BasenameRanker()
-    for f in files:
-      basename = os.path.basename(f)
-      rank = basename_ranker.rank_query(basename_query, basename)
-      hits.append((f,rank))
+    rank_by_basename = {}
+    for file_table, file_id in matches[:self.max_hits]:
+      basename = file_table.get_basename(file_id)
+      rank = rank_by_basename.get(basename)
+      if rank == None:
+        rank = basename_ranker.rank_query(basename_query, basename)
+        rank_by_basename[basename] = rank
+      hits.append((file_table.get_filename(file_id), rank))
     trace_end("rank_results")
 
     return QueryResult(hits=hits, truncated=truncated)
+
+  def _execute_basename_nocache(self, shard_manager, basename_query, lower_dirpart_query, is_dirmatch):
+    """
+    Finds the best max_hits files whose basename matches basename_query. The
+    shards rank their own hits, and since a basename ranks the same for all of
+    its files, their merged hits are expanded to files in order until there
+    are max_hits of them. When files get filtered by directory, the shards
+    cannot know how many of their hits will survive, so they send them all.
+    """
+    if lower_dirpart_query == '':
+      max_basename_hits = self.max_hits
+    else:
+      max_basename_hits = None
+    ranked_basenames, truncated = shard_manager.search_ranked_basenames(basename_query, max_basename_hits)
+
+    trace_begin("expand_results")
+    hits = []
+    basename_ranker = BasenameRanker()
+    for basename, rank in ranked_basenames:
+      if len(hits) >= self.max_hits:
+        break
+      for file_table in shard_manager.file_tables:
+        for file_id in file_table.get_file_ids_with_lower_basename(basename.lower()):
+          if len(hits) >= self.max_hits:
+            break
+          if not is_dirmatch(file_table, file_id):
+            continue
+          # The shard ranked one spelling of the lower basename. Others, which
+          # differ only in case, may rank differently.
+          file_basename = file_table.get_basename(file_id)
+          if file_basename == basename:
+            file_rank = rank
+          else:
+            file_rank = basename_ranker.rank_query(basename_query, file_basename)
+          hits.append((file_table.get_filename(file_id), file_rank))
+    trace_end("expand_results")
+
+    return QueryResult(hits=hits, truncated=truncated)
@@ -15,19 +15,12 @@ import os
 import unittest
 import query
 
-from basename_ranker import BasenameRanker
+from basename_ranker import BasenameRanker, rank_basenames
+from file_table import FileTable
 from query import Query
 from query_cache import QueryCache
 from query_result import QueryResult
 
-def make_result(hits):
-  res = QueryResult()
-  for h in hits:
-    res.filenames.append(h)
-    res.ranks.append(10)
-  return res
-
-
 class FakeDBShardManager(object):
   """
   A super-simple implementation of the DBShardManager interface for use
@@ -35,21 +28,22 @@ class FakeDBShardManager(object):
   """
   def __init__(self, files = [], dirs = []):
     self.dirs = dirs
-    self.files = files
-    self.files_by_lower_basename = {}
+    self.file_table = FileTable()
     for f in files:
-      bn = os.path.basename(f).lower()
-      if bn not in self.files_by_lower_basename:
-        self.files_by_lower_basename[bn] = []
-      self.files_by_lower_basename[bn].append(f)
+      self.file_table.add_file(f)
+
+  @property
+  def file_tables(self):
+    return [self.file_table]
 
-  def search_basenames(self, basename_query):
-    res = []
+  def search_ranked_basenames(self, basename_query, max_hits = None):
+    res = {}
     lower_basename_query = basename_query.lower()
-    for bn in self.files_by_lower_basename.keys():
-      if bn.find(lower_basename_query) != -1:
-        res.append(bn)
-    return res, False
+    for bn in self.file_table.basenames:
+      lower_bn = bn.lower()
+      if lower_bn.find(lower_basename_query) != -1:
+        res.setdefault(lower_bn, bn)
+    return rank_basenames(basename_query, res.values(), max_hits), False
 
 class MockQuery(Query):
   def __init__(self, *args, **kwargs):
@@ -97,24 +91,6 @@ class QueryTest(unittest.TestCase):
 
     self.assertFalse(query._is_exact_match("a/bcd.txt", "b/bcd.txt"))
 
-  def test_filter_result_for_exact_matches(self):
-    res = make_result(["a/bcd.txt", "b/bcd.txt"])
-
-    exact_res = query._filter_result_for_exact_matches("bcd.txt", res)
-    self.assertEquals(len(exact_res.ranks), len(exact_res.filenames))
-    self.assertEquals(2, len(exact_res.filenames))
-    self.assertEquals(["a/bcd.txt", "b/bcd.txt"], exact_res.filenames)
-
-    exact_res = query._filter_result_for_exact_matches("b/bcd.txt", res)
-    self.assertEquals(len(exact_res.ranks), len(exact_res.filenames))
-    self.assertEquals(1, len(exact_res.filenames))
-    self.assertEquals(["b/bcd.txt"], exact_res.filenames)
-
-    exact_res = query._filter_result_for_exact_matches("x/bcd.txt", res)
-    self.assertEquals(len(exact_res.ranks), len(exact_res.filenames))
-    self.assertEquals(0, len(exact_res.filenames))
-    self.assertEquals([], exact_res.filenames)
-
   def test_global_rank_adjustment_puts_suffixes_into_predictable_order(self):
     # render_widget.cpp should be get re-ranked higher than render_widget.h
     in_res = QueryResult(hits=[("/render_widget.h", 10),
@@ -263,11 +239,59 @@ class QueryTest(unittest.TestCase):
     shard_manager = FakeDBShardManager(["foo/bar.txt", "foo/rebar.txt"])
     query_cache = QueryCache()
 
+    q = MockQuery("bar.txt", 10, exact_match=True)
+    res = q.execute(shard_manager, query_cache)
+    self.assertEquals(["foo/bar.txt"], res.filenames)
+    self.assertFalse(q.did_call_execute_nocache)
+
+    res = MockQuery("foo/bar.txt", 10, exact_match=True).execute(shard_manager, query_cache)
+    self.assertEquals(["foo/bar.txt"], res.filenames)
+
+    res = MockQuery("ar.txt", 10, exact_match=True).execute(shard_manager, query_cache)
+    self.assertTrue(res.is_empty())
+
+  def test_exact_match_truncation(self):
+    shard_manager = FakeDBShardManager(["a/bcd.txt", "b/bcd.txt", "c/bcd.txt"])
+    query_cache = QueryCache()
+
+    res = MockQuery("bcd.txt", 2, exact_match=True).execute(shard_manager, query_cache)
+    self.assertEquals(["a/bcd.txt", "b/bcd.txt"], res.filenames)
+    self.assertTrue(res.truncated)
+
+    res = MockQuery("bcd.txt", 3, exact_match=True).execute(shard_manager, query_cache)
+    self.assertEquals(3, len(res.filenames))
+    self.assertFalse(res.truncated)
+
+    # Only the files in base_path count.
+    q = MockQuery("bcd.txt", 1, exact_match=True)
+    q.base_path = "b"
+    res = q.execute(shard_manager, query_cache)
+    self.assertEquals(["b/bcd.txt"], res.filenames)
+    self.assertFalse(res.truncated)
+
+  def test_exact_match_of_stem(self):
+    shard_manager = FakeDBShardManager(["foo/bar.txt", "foo/bar.h", "foo/rebar.txt", "x/baz.cc"])
+    query_cache = QueryCache()
+
+    res = MockQuery("baz", 10, exact_match=True).execute(shard_manager, query_cache)
+    self.assertEquals(["x/baz.cc"], res.filenames)
+
     res = MockQuery("bar", 10, exact_match=True).execute(shard_manager, query_cache)
+    self.assertEquals(["foo/bar.h", "foo/bar.txt"], res.filenames)
+
+    shard_manager.file_table.add_file("x/qux.tar.gz")
+    res = MockQuery("qux", 10, exact_match=True).execute(shard_manager, query_cache)
+    self.assertEquals(["x/qux.tar.gz"], res.filenames)
+    res = MockQuery("x/qux.tar", 10, exact_match=True).execute(shard_manager, query_cache)
+    self.assertEquals(["x/qux.tar.gz"], res.filenames)
+
+    res = MockQuery("y/baz", 10, exact_match=True).execute(shard_manager, query_cache)
     self.assertTrue(res.is_empty())
 
-    res = MockQuery("bar.txt", 10, exact_match=True).execute(shard_manager, query_cache)
-    self.assertEquals(["foo/bar.txt"], res.filenames)
+    # A file with the basename itself wins over those with an extension.
+    shard_manager.file_table.add_file("x/baz")
+    res = MockQuery("baz", 10, exact_match=True).execute(shard_manager, query_cache)
+    self.assertEquals(["x/baz"], res.filenames)
 
   def test_empty_dir_query(self):
     shard_manager = FakeDBShardManager(["foo/bar.txt", "foo/rebar.txt"])
@@ -317,6 +341,32 @@ class QueryTest(unittest.TestCase):
     self.assertEquals([BasenameRanker().rank_query("bar", os.path.basename(res.filenames[0])),
                        BasenameRanker().rank_query("bar", os.path.basename(res.filenames[1]))], res.ranks)
 
+  def test_nocache_materializes_only_max_hits(self):
+    shard_manager = FakeDBShardManager(["foo/bar.txt", "foo/rebar.txt", "blah/bar.txt"])
+    query_cache = QueryCache()
+
+    res = MockQuery("bar", 2).execute_nocache(shard_manager, query_cache)
+    self.assertEquals(2, len(res.filenames))
+    res = MockQuery("foo/", 1).execute_nocache(shard_manager, query_cache)
+    self.assertEquals(["foo/bar.txt"], res.filenames)
+
+  def test_nocache_keeps_best_ranked_hits(self):
+    shard_manager = FakeDBShardManager(["a/rebar.txt", "b/bar.txt", "c/bar.txt", "d/barn.txt"])
+    query_cache = QueryCache()
+
+    res = MockQuery("bar", 2).execute_nocache(shard_manager, query_cache)
+    self.assertEquals(set(["b/bar.txt", "c/bar.txt"]), set(res.filenames))
+    res = MockQuery("b/bar", 1).execute_nocache(shard_manager, query_cache)
+    self.assertEquals(["b/bar.txt"], res.filenames)
+
+  def test_nocache_ranks_basenames_differing_in_case(self):
+    shard_manager = FakeDBShardManager(["a/FooBar.txt", "b/foobar.txt"])
+    query_cache = QueryCache()
+
+    res = MockQuery("bar").execute_nocache(shard_manager, query_cache)
+    self.assertEquals(BasenameRanker().rank_query("bar", "FooBar.txt"), res.rank_of("a/FooBar.txt"))
+    self.assertEquals(BasenameRanker().rank_query("bar", "foobar.txt"), res.rank_of("b/foobar.txt"))
+
   def test_adjustment_creates_decreasing_hit_order(self):
     initial_result = QueryResult.from_dict({'hits': [('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/fast/js/script-tests/char-at.js', 12.0), ('/Users/nduca/home/quickopen/test_data/cr_files_basenames.json', 10.800000000000001), ('/Users/nduca/Local/chrome/src/chrome/browser/resources/options2/instant_confirm_overlay.js', 9.3000000000000007), ('/Users/nduca/Local/chrome/src/chrome/browser/resources/options/instant_confirm_overlay.js', 9.3000000000000007), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/svg/dynamic-updates/script-tests/SVGCircleElement-dom-requiredFeatures.js', 8.5999999999999996), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/svg/dom/SVGScriptElement/resources/script-set-href-p9pass.js', 7.5), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/dom/xhtml/level3/core/domconfigurationcansetparameter03.js', 7.0), ('/Users/nduca/Local/chrome/src/chrome/browser/resources/options2/chromeos/cellular_plan_element.js', 9.3000000000000007), ('/Users/nduca/Local/chrome/src/chrome/browser/resources/options/chromeos/cellular_plan_element.js', 9.3000000000000007), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/dom/svg/level3/xpath/Conformance_Expressions.js', 10.0), ('/Users/nduca/Local/chrome/src/third_party/WebKit/Source/WebCore/inspector/front-end/ResourceResponseView.js', 9.3000000000000007), ('/Users/nduca/home/trace_event_viewer/third_party/chrome/shared/js/cr/ui/focus_outline_manager.js', 7.5), ('/Users/nduca/Local/chrome/src/chrome/browser/resources/shared/js/cr/ui/focus_outline_manager.js', 7.5), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/svg/dom/SVGScriptElement/resources/script-set-href-p2fail.js', 7.5), ('/Users/nduca/Local/chrome/src/third_party/WebKit/Source/WebCore/inspector/front-end/InspectorView.js', 7.0), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/dom/xhtml/level1/core/hc_characterdatadeletedatamiddle.js', 10.0), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/dom/html/level1/core/hc_characterdatadeletedatamiddle.js', 10.0), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/http/tests/security/xssAuditor/resources/base-href/really-safe-script.js', 7.5), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/dom/xhtml/level1/core/hc_attrreplacechild1.js', 7.5), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/dom/html/level1/core/hc_attrreplacechild1.js', 7.5), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/fast/dom/Geolocation/script-tests/timeout-clear-watch.js', 7.0), ('/Users/nduca/Local/chrome/src/chrome/test/data/extensions/api_test/history/search_after_add.js', 7.0), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/svg/dom/SVGScriptElement/resources/script-set-href-p5fail.js', 7.5), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/svg/dynamic-updates/script-tests/SVGRectElement-dom-y-attr.js', 7.5), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/dom/xhtml/level3/core/documentrenamenode03.js', 7.0), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/dom/xhtml/level1/core/hc_textsplittextfour.js', 7.5), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/dom/html/level1/core/hc_textsplittextfour.js', 7.5), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/fast/dom/Orientation/script-tests/create-event-orientationchange.js', 13.5), ('/Users/nduca/Local/chrome/src/chrome/browser/resources/connection_manager.js', 10.5), ('/Users/nduca/home/trace_event_viewer/third_party/chrome/shared/js/cr.js', 14.0), ('/Users/nduca/Local/chrome/src/chrome/common/extensions/docs/examples/extensions/plugin_settings/domui/js/cr.js', 14.0), ('/Users/nduca/Local/chrome/src/chrome/browser/resources/shared/js/cr.js', 14.0), ('/Users/nduca/Local/chrome/src/third_party/WebKit/LayoutTests/fast/js/mozilla/eval/script-tests/exhaustive-global-strictcaller-indirect-strictcode.js', 7.0), ('/Users/nduca/home/trace_event_viewer/third_party/chrome/shared/js/event_tracker.js', 7.5), ('/Users/nduca/Local/chrome/src/chrome/browser/resources/shared/js/event_tracker.js', 7.5)], 'debug_info': [], 'truncated': True})
     dirs = ['/Users/nduca/Local/ndbg', '/Users/nduca/Local/quickopen', '/Users/nduca/home', '/Users/nduca/Local/chrome']
@@ -77,7 +77,7 @@ def CMDrun(parser):
       service = src.daemon.create(options.host, options.port, options.test)
       if trace_is_enabled():
         service.add_delayed_task(flush_trace_event, 5, service)
-      db_stub = src.db_stub.DBStub(options.settings, service)
+      db_stub = src.db_stub.DBStub(options.settings, service, options.snapshot)
       prelaunchd = src.prelaunchd.PrelaunchDaemon(service)
 
       service.run()
@@ -203,6 +203,7 @@ def main(parser):
   parser.add_option('--host', dest='host', action='store', help='Hostname to listen on')
   parser.add_option('--port', dest='port', action='store', help='Port to run on')
   parser.add_option('--settings', dest='settings', action='store', default='~/.quickopend', help='Settings file to use')
+  parser.add_option('--snapshot', dest='snapshot', action='store', help='Index snapshot file to use, defaults to the settings file with .snapshot appended')
   parser.add_option('--test', dest='test', action='store_true', default=False, help='Adds test hooks')
   parser.add_option('--trace', dest='trace', action='store_true', default=False, help='Records performance tracing information to quickopen.trace')
   parser.add_option('--foreground', dest='foreground', action='store_true', default=False, help='Starts quickopend in the foreground instead of forking')
@@ -218,6 +219,13 @@ def main(parser):
     settings.register('port', int, src.default_port.get())
     options.settings = settings
 
+    # Tests start lots of daemons on temporary settings files, so only snapshot
+    # when asked to explicitly.
+    if options.snapshot:
+      options.snapshot = os.path.expanduser(options.snapshot)
+    elif not options.test:
+      options.snapshot = settings_file + '.snapshot'
+
     if not options.port:
       options.port = settings.port
     else:
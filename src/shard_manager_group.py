@@ -0,0 +1,66 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from basename_ranker import merge_ranked_basenames
+from trace_event import *
+
+class ShardManagerGroup(object):
+  """
+  Searches several shard managers as if they were one, for Query.execute. All
+  of them start their basename search before any result is waited for.
+
+  dirs are the dirs to rank results by, which may include dirs nested in the
+  ones that the shard managers index.
+  """
+  def __init__(self, dirs, shard_managers):
+    self.dirs = dirs
+    self.shard_managers = shard_managers
+
+  @property
+  def file_tables(self):
+    res = []
+    for m in self.shard_managers:
+      res.extend(m.file_tables)
+    return res
+
+  @property
+  def num_shards(self):
+    return sum([m.num_shards for m in self.shard_managers])
+
+  def search_basenames(self, basename_query):
+    hits, truncated = self.search_ranked_basenames(basename_query)
+    return [basename.lower() for basename, rank in hits], truncated
+
+  def search_ranked_basenames(self, basename_query, max_hits = None):
+    return self.begin_search_ranked_basenames(basename_query, max_hits).get()
+
+  def begin_search_ranked_basenames(self, basename_query, max_hits = None):
+    return _GroupRankedBasenameSearch([m.begin_search_ranked_basenames(basename_query, max_hits)
+                                       for m in self.shard_managers], max_hits)
+
+class _GroupRankedBasenameSearch(object):
+  def __init__(self, searches, max_hits):
+    self._searches = searches
+    self._max_hits = max_hits
+
+  def get(self):
+    trace_begin("gather_group_results")
+    ranked_lists = []
+    truncated = False
+    for search in self._searches:
+      search_hits, search_truncated = search.get()
+      truncated |= search_truncated
+      ranked_lists.append(search_hits)
+    hits = merge_ranked_basenames(ranked_lists, self._max_hits)
+    trace_end("gather_group_results")
+    return hits, truncated
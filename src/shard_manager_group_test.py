@@ -0,0 +1,37 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+from provisional_shard_manager import ProvisionalShardManager
+from query import Query
+from query_cache import QueryCache
+from shard_manager_group import ShardManagerGroup
+
+class ShardManagerGroupTest(unittest.TestCase):
+  def test_searches_all_shard_managers(self):
+    a = ProvisionalShardManager(["/a"])
+    a.add_files(["/a/foo.txt", "/a/bar.txt"])
+    b = ProvisionalShardManager(["/b"])
+    b.add_files(["/b/x/foo.txt", "/b/baz.txt"])
+    group = ShardManagerGroup(["/a", "/b"], [a, b])
+    self.assertEquals(2, group.num_shards)
+
+    res = Query("foo").execute(group, QueryCache())
+    self.assertEquals(set(["/a/foo.txt", "/b/x/foo.txt"]), set(res.filenames))
+    self.assertEquals(["/b/x/foo.txt"],
+                      Query("x/foo").execute(group, QueryCache()).filenames)
+    self.assertEquals(set(["/a/bar.txt", "/b/baz.txt"]),
+                      set(Query("ba").execute(group, QueryCache()).filenames))
+    self.assertEquals(["/b/x/foo.txt"],
+                      Query("x/").execute(group, QueryCache()).filenames)
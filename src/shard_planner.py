@@ -0,0 +1,73 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import math
+import multiprocessing
+import time
+
+import db_index_shard
+
+# What a search pays for each shard process that it goes to, in seconds: the
+# round trip of a search over shard_transport, about 10us when measured with
+# shard_transport_test.py, plus room for waking the process on a busy machine.
+SHARD_PROCESS_OVERHEAD = 0.00005
+
+# The most basenames that the scan cost is measured on.
+SCAN_COST_SAMPLE_SIZE = 1000
+
+def measure_scan_cost(basenames, engine = db_index_shard.ENGINE_REGEX):
+  """
+  Returns the time in seconds per basename that a shard of engine, built from
+  a sample of basenames, takes to search. The queries are every other letter
+  of some of the sampled basenames. Few basenames match them, so the shard
+  scans instead of stopping at its first hits.
+  """
+  step = max(1, len(basenames) / SCAN_COST_SAMPLE_SIZE)
+  sample = basenames[::step][:SCAN_COST_SAMPLE_SIZE]
+  if not len(sample):
+    return 0
+  shard = db_index_shard.DBIndexShard(sample, engine)
+  times = []
+  for i in range(8):
+    query = sample[i * len(sample) / 8][::2]
+    if query == '':
+      continue
+    start = time.time()
+    shard.search_basenames(query)
+    times.append(time.time() - start)
+  if not len(times):
+    return 0
+  times.sort()
+  return times[len(times) / 2] / len(sample)
+
+def plan_num_shards(num_basenames, scan_cost, num_cpus, overhead = SHARD_PROCESS_OVERHEAD):
+  """
+  Returns how many shards to split num_basenames across so that searches,
+  which take scan_cost seconds per basename, are fastest on num_cpus cores.
+
+  A search over N shards takes about num_basenames * scan_cost / N, plus
+  overhead for each of the N - 1 shard processes. That is least for N =
+  sqrt(num_basenames * scan_cost / overhead), which is then kept between 1
+  and num_cpus. One shard means that there are no shard processes at all.
+  """
+  if num_cpus <= 1 or num_basenames == 0:
+    return 1
+  n = int(math.sqrt(num_basenames * scan_cost / overhead))
+  return max(1, min(n, num_cpus))
+
+def plan_num_shards_for(basenames, engine = db_index_shard.ENGINE_REGEX):
+  """Returns plan_num_shards for basenames on this machine."""
+  num_cpus = multiprocessing.cpu_count()
+  if num_cpus <= 1:
+    return 1
+  return plan_num_shards(len(basenames), measure_scan_cost(basenames, engine), num_cpus)
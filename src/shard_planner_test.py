@@ -0,0 +1,42 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+import shard_planner
+
+class ShardPlannerTest(unittest.TestCase):
+  def test_plan_num_shards(self):
+    # 1us per basename and 100us per shard process.
+    self.assertEquals(1, shard_planner.plan_num_shards(0, 0.000001, 8, 0.0001))
+    self.assertEquals(1, shard_planner.plan_num_shards(100, 0.000001, 8, 0.0001))
+    self.assertEquals(3, shard_planner.plan_num_shards(1000, 0.000001, 8, 0.0001))
+    self.assertEquals(8, shard_planner.plan_num_shards(10000, 0.000001, 8, 0.0001))
+    self.assertEquals(10, shard_planner.plan_num_shards(10000, 0.000001, 16, 0.0001))
+    self.assertEquals(16, shard_planner.plan_num_shards(1000000, 0.000001, 16, 0.0001))
+    self.assertEquals(1, shard_planner.plan_num_shards(1000000, 0.000001, 1, 0.0001))
+
+  def test_measure_scan_cost(self):
+    self.assertEquals(0, shard_planner.measure_scan_cost([]))
+    basenames = ["file%i_%s.txt" % (i, "abcdefgh"[i % 8]) for i in range(3000)]
+    self.assertTrue(shard_planner.measure_scan_cost(basenames) > 0)
+
+  def test_plan_num_shards_for(self):
+    orig_cpu_count = shard_planner.multiprocessing.cpu_count
+    try:
+      shard_planner.multiprocessing.cpu_count = lambda: 1
+      self.assertEquals(1, shard_planner.plan_num_shards_for(["a.txt"] * 100))
+      shard_planner.multiprocessing.cpu_count = lambda: 64
+      self.assertEquals(1, shard_planner.plan_num_shards_for(["a.txt", "b.txt"]))
+    finally:
+      shard_planner.multiprocessing.cpu_count = orig_cpu_count
@@ -0,0 +1,244 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import array
+import collections
+import cPickle
+import multiprocessing
+import os
+import struct
+import threading
+
+# Every message, both ways, is a header followed by payload_length bytes.
+_HEADER = struct.Struct('!BI') # kind, payload_length
+_SEARCH_ARGS = struct.Struct('!ii') # key, max_hits or -1 for None
+_RANKED_IDS_HEADER = struct.Struct('!BI') # truncated, number of ids
+
+# Requests
+_CALL = 0 # payload: pickled (fn, args)
+_SEARCH = 1 # payload: _SEARCH_ARGS, then the utf8 query
+_EXIT = 2
+
+# Responses
+_RESULT = 0 # payload: the pickled result
+_ERROR = 1 # payload: the error message
+_RANKED_IDS = 2 # payload: _RANKED_IDS_HEADER, then the ids as a native int
+                # array, then their ranks as a native double array
+
+# Parent side ends of the pipes of all ShardProcesses, which every newly
+# forked worker closes so that it does not keep other workers' pipes open.
+# Pipes are only created, forked into a worker and closed with _fork_lock
+# held, so that no worker is forked while some pipe is open in the parent but
+# not in _parent_fds, as the worker side ends are until the fork is done.
+_parent_fds = set()
+_fork_lock = threading.Lock()
+
+def _read_exactly(fd, n):
+  """Reads n bytes from fd, or returns None at end of file."""
+  chunks = []
+  while n > 0:
+    data = os.read(fd, n)
+    if not data:
+      return None
+    chunks.append(data)
+    n -= len(data)
+  return ''.join(chunks)
+
+def _write_all(fd, data):
+  while len(data):
+    n = os.write(fd, data)
+    data = data[n:]
+
+def _write_message(fd, kind, payload):
+  _write_all(fd, _HEADER.pack(kind, len(payload)) + payload)
+
+def _read_message(fd):
+  """Returns (kind, payload), or (None, None) at end of file."""
+  header = _read_exactly(fd, _HEADER.size)
+  if header == None:
+    return (None, None)
+  kind, n = _HEADER.unpack(header)
+  payload = _read_exactly(fd, n)
+  if payload == None:
+    return (None, None)
+  return (kind, payload)
+
+def _format_error(ex):
+  message = "%s: %s" % (type(ex).__name__, ex)
+  if isinstance(message, unicode):
+    message = message.encode('utf8')
+  return message
+
+def _worker_main(request_fd, response_fd, initializer, initargs, search_fn):
+  for fd in list(_parent_fds):
+    try:
+      os.close(fd)
+    except OSError:
+      pass
+  init_error = None
+  if initializer:
+    try:
+      initializer(*initargs)
+    except Exception, ex:
+      init_error = _format_error(ex)
+
+  while True:
+    kind, payload = _read_message(request_fd)
+    if kind == None or kind == _EXIT:
+      break
+    try:
+      if init_error:
+        raise Exception("Shard process init failed: %s" % init_error)
+      if kind == _SEARCH:
+        key, max_hits = _SEARCH_ARGS.unpack(payload[:_SEARCH_ARGS.size])
+        if max_hits == -1:
+          max_hits = None
+        query = payload[_SEARCH_ARGS.size:].decode('utf8')
+        ids, ranks, truncated = search_fn(key, query, max_hits)
+        response = (_RANKED_IDS,
+                    _RANKED_IDS_HEADER.pack(truncated, len(ids)) + ids.tostring() + ranks.tostring())
+      else:
+        fn, args = cPickle.loads(payload)
+        response = (_RESULT, cPickle.dumps(fn(*args), cPickle.HIGHEST_PROTOCOL))
+    except Exception, ex:
+      response = (_ERROR, _format_error(ex))
+    _write_message(response_fd, response[0], response[1])
+
+class _AsyncResult(object):
+  def __init__(self, shard_process):
+    self._shard_process = shard_process
+    self.ready = False
+    self._value = None
+    self._error = None
+
+  def _set(self, kind, payload):
+    if kind == _RESULT:
+      self._value = cPickle.loads(payload)
+    elif kind == _RANKED_IDS:
+      truncated, n = _RANKED_IDS_HEADER.unpack(payload[:_RANKED_IDS_HEADER.size])
+      ids = array.array('i')
+      ranks = array.array('d')
+      ranks_start = _RANKED_IDS_HEADER.size + n * ids.itemsize
+      ids.fromstring(payload[_RANKED_IDS_HEADER.size:ranks_start])
+      ranks.fromstring(payload[ranks_start:])
+      self._value = (ids, ranks, bool(truncated))
+    elif kind == _ERROR:
+      self._error = payload
+    else:
+      self._error = "Shard process went away"
+    self.ready = True
+
+  def get(self):
+    self._shard_process._wait_for(self)
+    if self._error:
+      raise Exception(self._error)
+    return self._value
+
+class ShardProcess(object):
+  """
+  A long-lived shard process that is talked to over a pair of pipes with a
+  fixed binary framing, in place of a multiprocessing.Pool(1). apply and
+  apply_async pickle their call like a Pool does, for the occasional big
+  request. Searches, which happen on every keystroke, go through
+  begin_search: the query is sent as utf8 and search_fn(key, query, max_hits)
+  in the process returns an array of int ids and an array of their float
+  ranks, which come back as raw bytes. There
+  are no handler threads: a result is read when it is asked for.
+
+  initializer(*initargs) runs in the process as soon as it is forked, with
+  initargs inherited through the fork rather than pickled.
+
+  Processes are forked from whichever thread creates them, usually a
+  BackgroundIndexer's. That is safe because the process only ever runs
+  _worker_main, which touches nothing but its pipes and the initializer and
+  shard functions. Those work on data of their own, and take none of the
+  locks that other threads may have held at the fork, such as logging's.
+  Python itself resets the GIL and the import lock in the child.
+
+  Requests are answered in order. One is only sent once the previous one
+  has been answered, so that neither side can block on a full pipe while
+  the other does too.
+  """
+  def __init__(self, initializer = None, initargs = (), search_fn = None):
+    with _fork_lock:
+      request_r, request_w = os.pipe()
+      response_r, response_w = os.pipe()
+      _parent_fds.update([request_w, response_r])
+      self._process = multiprocessing.Process(target=_worker_main,
+                                              args=(request_r, response_w,
+                                                    initializer, initargs, search_fn))
+      self._process.daemon = True
+      self._process.start()
+      os.close(request_r)
+      os.close(response_w)
+    self._request_fd = request_w
+    self._response_fd = response_r
+    self._lock = threading.Lock()
+    self._pending = collections.deque()
+
+  def _send(self, kind, payload):
+    res = _AsyncResult(self)
+    with self._lock:
+      self._read_responses()
+      _write_message(self._request_fd, kind, payload)
+      self._pending.append(res)
+    return res
+
+  def _read_responses(self, until = None):
+    """Reads responses until until is ready, or all of them if it is None."""
+    while len(self._pending) and not (until and until.ready):
+      kind, payload = _read_message(self._response_fd)
+      self._pending.popleft()._set(kind, payload)
+
+  def _wait_for(self, res):
+    with self._lock:
+      self._read_responses(res)
+
+  def apply_async(self, fn, args = ()):
+    return self._send(_CALL, cPickle.dumps((fn, args), cPickle.HIGHEST_PROTOCOL))
+
+  def apply(self, fn, args = ()):
+    return self.apply_async(fn, args).get()
+
+  def begin_search(self, key, query, max_hits = None):
+    """
+    Starts search_fn(key, query, max_hits). get() on the result returns
+    (ids, ranks, truncated).
+    """
+    if isinstance(query, unicode):
+      query = query.encode('utf8')
+    if max_hits == None:
+      max_hits = -1
+    return self._send(_SEARCH, _SEARCH_ARGS.pack(key, max_hits) + query)
+
+  def close(self):
+    if self._request_fd == None:
+      return
+    with self._lock:
+      self._read_responses()
+      try:
+        _write_message(self._request_fd, _EXIT, '')
+      except OSError:
+        pass
+      with _fork_lock:
+        _parent_fds.difference_update([self._request_fd, self._response_fd])
+        os.close(self._request_fd)
+        os.close(self._response_fd)
+      self._request_fd = None
+      self._response_fd = None
+
+  def join(self):
+    self._process.join()
+
+  def terminate(self):
+    self._process.terminate()
@@ -0,0 +1,158 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import array
+import multiprocessing
+import os
+import threading
+import time
+import unittest
+
+from shard_transport import ShardProcess
+
+state = {}
+
+def set_state(key, value):
+  state[key] = value
+
+def get_state(key):
+  return state[key]
+
+def fail(message):
+  raise Exception(message)
+
+def get_open_files():
+  res = set()
+  for fd in os.listdir('/proc/self/fd'):
+    try:
+      res.add(os.readlink(os.path.join('/proc/self/fd', fd)))
+    except OSError:
+      pass
+  return res
+
+def get_pipe_name(fd):
+  return "pipe:[%i]" % os.fstat(fd).st_ino
+
+def search(key, query, max_hits):
+  ids = array.array('i', [ord(c) for c in query][:max_hits])
+  ranks = array.array('d', [id / 2.0 for id in ids])
+  return ids, ranks, key == 1
+
+class ShardProcessTest(unittest.TestCase):
+  def setUp(self):
+    self.shard = ShardProcess(set_state, ("init", 3), search)
+
+  def tearDown(self):
+    self.shard.close()
+    self.shard.join()
+
+  def test_apply(self):
+    self.assertEquals(3, self.shard.apply(get_state, ("init",)))
+    self.shard.apply(set_state, ("x", [1, 2]))
+    self.assertEquals([1, 2], self.shard.apply(get_state, ("x",)))
+
+  def test_apply_async_in_order(self):
+    a = self.shard.apply_async(set_state, ("x", 1))
+    b = self.shard.apply_async(get_state, ("x",))
+    self.assertEquals(1, b.get())
+    self.assertEquals(None, a.get())
+
+  def test_error(self):
+    self.assertRaises(Exception, lambda: self.shard.apply(fail, ("boom",)))
+    self.assertEquals(3, self.shard.apply(get_state, ("init",)))
+
+  def test_begin_search(self):
+    ids, ranks, truncated = self.shard.begin_search(0, "ab").get()
+    self.assertEquals(array.array('i', [97, 98]), ids)
+    self.assertEquals(array.array('d', [48.5, 49]), ranks)
+    self.assertFalse(truncated)
+    ids, ranks, truncated = self.shard.begin_search(1, u"\u00e9").get()
+    self.assertEquals(array.array('i', [0xe9]), ids)
+    self.assertTrue(truncated)
+    ids, ranks, truncated = self.shard.begin_search(0, "abc", 2).get()
+    self.assertEquals(array.array('i', [97, 98]), ids)
+    ids, ranks, truncated = self.shard.begin_search(0, "", 2).get()
+    self.assertEquals(0, len(ids))
+    self.assertEquals(0, len(ranks))
+
+  def test_init_error(self):
+    shard = ShardProcess(fail, ("bad init",), search)
+    try:
+      self.assertRaises(Exception, lambda: shard.apply(get_state, ("init",)))
+      self.assertRaises(Exception, lambda: shard.begin_search(0, "a").get())
+    finally:
+      shard.close()
+      shard.join()
+
+  def test_workers_do_not_keep_sibling_pipes_open(self):
+    if not os.path.exists('/proc/self/fd'):
+      return
+    shards = []
+    def create_shards():
+      for i in range(3):
+        shards.append(ShardProcess(set_state, ("init", i), search))
+    threads = [threading.Thread(target=create_shards) for i in range(3)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    try:
+      for shard in shards:
+        sibling_pipes = set()
+        for sibling in shards:
+          if sibling is not shard:
+            sibling_pipes.update([get_pipe_name(sibling._request_fd),
+                                  get_pipe_name(sibling._response_fd)])
+        self.assertEquals(set(), shard.apply(get_open_files) & sibling_pipes)
+
+      # So a worker that goes away is noticed while its siblings live on.
+      shards[0].terminate()
+      shards[0].join()
+      self.assertRaises(Exception, lambda: shards[0].apply(get_state, ("init",)))
+    finally:
+      for shard in shards:
+        shard.close()
+        shard.join()
+
+  def test_close_twice(self):
+    self.shard.close()
+    self.shard.close()
+    self.shard = ShardProcess()
+
+def noop_search(key, query, max_hits):
+  return array.array('i'), array.array('d'), False
+
+def noop_search_pickled(key, query, max_hits):
+  return [], False
+
+def time_searches(begin_search, num_searches):
+  start = time.time()
+  for i in range(num_searches):
+    begin_search().get()
+  return (time.time() - start) / num_searches
+
+if __name__ == '__main__':
+  N = 5000
+  pool = multiprocessing.Pool(1)
+  t = time_searches(lambda: pool.apply_async(noop_search_pickled, (0, u"foo", None)), N)
+  print "multiprocessing.Pool(1).apply_async: %.1fus per search" % (t * 1000000)
+  pool.close()
+  pool.join()
+
+  shard = ShardProcess(search_fn = noop_search)
+  t = time_searches(lambda: shard.apply_async(noop_search_pickled, (0, u"foo", None)), N)
+  print "ShardProcess.apply_async: %.1fus per search" % (t * 1000000)
+  t = time_searches(lambda: shard.begin_search(0, u"foo"), N)
+  print "ShardProcess.begin_search: %.1fus per search" % (t * 1000000)
+  shard.close()
+  shard.join()
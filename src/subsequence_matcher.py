@@ -0,0 +1,136 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+def has_numpy():
+  return numpy != None
+
+class SubsequenceMatcher(object):
+  """
+  Finds the strings that contain a query as a subsequence, which is what the
+  .*a.*b.*c.* superfuzzy regex tests, without any backtracking.
+
+  When NumPy is available, all strings are tested in one batched pass: the
+  strings are kept as one flat array of character codes plus per-string offsets,
+  and each step of the pass advances every string's match state by one column.
+  Otherwise each string is matched greedily with str.find, which is still linear
+  in the length of the string.
+  """
+  def __init__(self, strings, use_numpy = None):
+    if use_numpy == None:
+      use_numpy = has_numpy()
+    if use_numpy and not has_numpy():
+      raise Exception("NumPy is not available")
+    self.strings = strings
+    self._use_numpy = use_numpy
+    if use_numpy:
+      self._init_arrays()
+
+  def _init_arrays(self):
+    lengths = numpy.array([len(s) for s in self.strings], dtype=numpy.int32)
+    starts = numpy.zeros(len(self.strings), dtype=numpy.int32)
+    if len(self.strings):
+      starts[1:] = numpy.cumsum(lengths)[:-1]
+    text = u"".join(self.strings)
+    chars = numpy.frombuffer(text.encode('utf-32-le'), dtype=numpy.int32)
+    if len(chars) != len(text):
+      # Narrow python builds count surrogate pairs as two characters, which
+      # would throw the offsets off. Use the plain python matcher instead.
+      self._use_numpy = False
+      return
+    self._chars = chars
+    self._starts = starts
+    self._lengths = lengths
+
+  def match(self, query, ids = None, limit = None):
+    """
+    Matches query against the strings, or against only the strings whose ids are
+    given in the sorted list ids. If limit is given, at most that many of the
+    lowest matching ids are returned.
+
+    Returns (matching_ids, positions) where matching_ids is sorted and
+    positions[i] is a tuple giving, for each letter of the query, the index in
+    strings[matching_ids[i]] that the letter was matched to.
+    """
+    if ids == None:
+      ids = range(len(self.strings))
+    if len(query) == 0:
+      ids = list(ids)[:limit]
+      return ids, [() for i in ids]
+    if self._use_numpy:
+      matching_ids, positions = self._match_numpy(query, ids)
+      return matching_ids[:limit], positions[:limit]
+    return self._match_python(query, ids, limit)
+
+  def _match_python(self, query, ids, limit):
+    matching_ids = []
+    positions = []
+    for id in ids:
+      if len(matching_ids) == limit:
+        break
+      s = self.strings[id]
+      cur = []
+      i = -1
+      for c in query:
+        i = s.find(c, i + 1)
+        if i == -1:
+          break
+        cur.append(i)
+      if i == -1:
+        continue
+      matching_ids.append(id)
+      positions.append(tuple(cur))
+    return matching_ids, positions
+
+  def _match_numpy(self, query, ids):
+    ids = numpy.asarray(ids, dtype=numpy.int32)
+    m = len(query)
+
+    # Visit the rows longest first, so that the rows still having a column j
+    # are always a prefix of the visiting order.
+    lengths = self._lengths[ids]
+    order = numpy.argsort(-lengths, kind='mergesort')
+    ids = ids[order]
+    lengths = lengths[order]
+    starts = self._starts[ids]
+    ascending_lengths = lengths[::-1]
+
+    # The query codes, with a trailing value that no character can have, so
+    # rows that have matched the full query never advance again.
+    codes = numpy.zeros(m + 1, dtype=numpy.int32)
+    codes[:m] = numpy.frombuffer(query.encode('utf-32-le'), dtype=numpy.int32)
+    codes[m] = -1
+
+    state = numpy.zeros(len(ids), dtype=numpy.int32)
+    positions = numpy.zeros((len(ids), m), dtype=numpy.int32)
+    width = 0
+    if len(ids):
+      width = lengths[0]
+    for j in range(width):
+      # Number of rows with more than j characters.
+      k = len(ids) - numpy.searchsorted(ascending_lengths, j, side='right')
+      cur_state = state[:k]
+      hit = self._chars[starts[:k] + j] == codes[cur_state]
+      rows = numpy.nonzero(hit)[0]
+      positions[rows, cur_state[rows]] = j
+      cur_state += hit
+
+    matched = numpy.nonzero(state == m)[0]
+    matched = matched[numpy.argsort(ids[matched], kind='mergesort')]
+    matching_ids = ids[matched].tolist()
+    positions = [tuple(p) for p in positions[matched].tolist()]
+    return matching_ids, positions
@@ -0,0 +1,73 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import random
+import re
+import unittest
+
+import subsequence_matcher
+from subsequence_matcher import SubsequenceMatcher
+
+class SubsequenceMatcherTest(unittest.TestCase):
+  def get_matchers(self, strings):
+    matchers = [SubsequenceMatcher(strings, use_numpy=False)]
+    if subsequence_matcher.has_numpy():
+      matchers.append(SubsequenceMatcher(strings, use_numpy=True))
+    return matchers
+
+  def test_basic(self):
+    strings = ["render_widget_host.cc", "rwh", "foo.cc", "", "wrh"]
+    for m in self.get_matchers(strings):
+      self.assertEquals(([0, 1], [(0, 7, 14), (0, 1, 2)]), m.match("rwh"))
+      self.assertEquals(([1], [(0, 1, 2)]), m.match("rwh", [1, 2, 3, 4]))
+      self.assertEquals(([0, 2], [(19,), (4,)]), m.match("c", [0, 2]))
+      self.assertEquals(([], []), m.match("rwhx"))
+      self.assertEquals(([], []), m.match("rwh", []))
+
+  def test_matches_superfuzzy_regex(self):
+    files_by_basename = json.load(open('test_data/cr_files_by_basename_five_percent.json'))
+    strings = sorted(set([b.lower() for b in files_by_basename.keys()]))
+    for q in ["a", "rwh", "render", "rwhvc", ".cc", "zzzzz", "unittest.cc", "w_v"]:
+      regex = re.compile(".*%s.*" % ".*".join([re.escape(c) for c in q]))
+      expected = [i for i in range(len(strings)) if regex.match(strings[i])]
+      for m in self.get_matchers(strings):
+        ids, positions = m.match(q)
+        self.assertEquals(expected, ids)
+        for i in range(len(ids)):
+          self.assertEquals(q, "".join([strings[ids[i]][p] for p in positions[i]]))
+
+  def test_limit(self):
+    strings = ["ab", "b", "xab", "axb", "ba"]
+    for m in self.get_matchers(strings):
+      self.assertEquals(([0, 2], [(0, 1), (1, 2)]), m.match("ab", limit=2))
+      self.assertEquals(([0, 2, 3], [(0, 1), (1, 2), (0, 2)]), m.match("ab", limit=10))
+      self.assertEquals(([0], [()]), m.match("", limit=1))
+
+  @unittest.skipUnless(subsequence_matcher.has_numpy(), "NumPy is not installed")
+  def test_numpy_matches_python(self):
+    files_by_basename = json.load(open('test_data/cr_files_by_basename_five_percent.json'))
+    strings = sorted(set([b.lower() for b in files_by_basename.keys()]))
+    strings.extend(["", u"caf\u00e9.cc", "a"])
+    python_matcher = SubsequenceMatcher(strings, use_numpy=False)
+    numpy_matcher = SubsequenceMatcher(strings, use_numpy=True)
+    r = random.Random(0)
+    for i in range(50):
+      s = strings[r.randrange(len(strings))]
+      q = "".join([c for c in s if r.random() < 0.3])
+      ids = sorted(r.sample(range(len(strings)), 200))
+      limit = r.choice([None, 1, 10])
+      self.assertEquals(python_matcher.match(q), numpy_matcher.match(q), "query %s" % q)
+      self.assertEquals(python_matcher.match(q, ids, limit), numpy_matcher.match(q, ids, limit),
+                        "query %s" % q)
+    self.assertEquals(python_matcher.match(u"\u00e9"), numpy_matcher.match(u"\u00e9"))
@@ -0,0 +1,172 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import array
+
+# The number of characters of each suffix that the first sorting round copies.
+_FIRST_ROUND_LENGTH = 16
+
+def _rank_groups(order, begin, keys, ranks, groups, is_final):
+  """
+  Given the keys of the entries of order from begin on, which are sorted by
+  them, gives each run of entries with equal keys the rank of its first entry
+  and appends the (begin, end) of the runs of more than one entry to groups,
+  unless is_final(key) says that the key holds all of their suffix.
+  """
+  group_begin = begin
+  prev_key = keys[0]
+  for pos in xrange(len(keys)):
+    if keys[pos] != prev_key:
+      if begin + pos - group_begin > 1 and not is_final(prev_key):
+        groups.append((group_begin, begin + pos))
+      group_begin = begin + pos
+      prev_key = keys[pos]
+    ranks[order[begin + pos]] = group_begin
+  if begin + len(keys) - group_begin > 1 and not is_final(prev_key):
+    groups.append((group_begin, begin + len(keys)))
+
+class SuffixArray(object):
+  """
+  A suffix array over a list of strings. Each entry points at one suffix of one
+  of the strings, and entries are kept sorted by the text of that suffix. All
+  suffixes starting with some text q then sit in one contiguous range of the
+  array, which is found by binary search in O(|q| log n).
+
+  Suffixes never run past the end of their string, so matches never straddle two
+  strings.
+  """
+  def __init__(self, strings):
+    self.strings = strings
+
+    # The suffixes are sorted by prefix doubling rather than by their text,
+    # which would copy out every suffix. Positions are those of the strings
+    # laid end to end. order is kept sorted by the first k characters of the
+    # suffixes, and the suffixes in the group [begin, end) of order that share
+    # those characters have rank begin. Sorting a group by the ranks of the
+    # suffixes k further on then sorts it by their first 2k characters. A
+    # suffix that ends sooner comes first, and equal suffixes of different
+    # strings go in the order of their positions. The first round sorts on
+    # short copied prefixes, which already tell most suffixes apart.
+    ids = array.array('i')
+    offsets = array.array('i')
+    ends = array.array('i')
+    prefixes = []
+    for id in range(len(strings)):
+      s = strings[id]
+      n = len(s)
+      ids.extend(array.array('i', [id]) * n)
+      offsets.extend(array.array('i', range(n)))
+      ends.extend(array.array('i', [len(prefixes) + n]) * n)
+      prefixes.extend([s[offset:offset + _FIRST_ROUND_LENGTH] for offset in range(n)])
+    n = len(prefixes)
+    order = range(n)
+    order.sort(key=prefixes.__getitem__)
+    ranks = array.array('i', [0]) * n
+    groups = []
+    if n:
+      _rank_groups(order, 0, [prefixes[i] for i in order], ranks, groups,
+                   lambda prefix: len(prefix) < _FIRST_ROUND_LENGTH)
+    del prefixes
+
+    max_len = max([len(s) for s in strings] or [0])
+    k = _FIRST_ROUND_LENGTH
+    while len(groups) and k < max_len:
+      next_groups = []
+      for begin, end in groups:
+        # The keys are all taken before the group's ranks change.
+        keyed = []
+        for i in order[begin:end]:
+          if i + k < ends[i]:
+            keyed.append((ranks[i + k], i))
+          else:
+            keyed.append((-1, i))
+        keyed.sort()
+        order[begin:end] = [i for key, i in keyed]
+        _rank_groups(order, begin, [key for key, i in keyed], ranks, next_groups,
+                     lambda key: key == -1)
+      groups = next_groups
+      k *= 2
+    self._ids = array.array('i', [ids[i] for i in order])
+    self._offsets = array.array('i', [offsets[i] for i in order])
+
+  @staticmethod
+  def from_snapshot(strings, snapshot, prefix):
+    res = SuffixArray([])
+    res.strings = strings
+    res._ids = snapshot.get_array(prefix + "ids")
+    res._offsets = snapshot.get_array(prefix + "offsets")
+    return res
+
+  def get_snapshot_sections(self, prefix):
+    return {prefix + "ids": self._ids,
+            prefix + "offsets": self._offsets}
+
+  def __len__(self):
+    return len(self._ids)
+
+  def _suffix(self, i):
+    return self.strings[self._ids[i]][self._offsets[i]:]
+
+  def _lower_bound(self, q):
+    """Index of the first suffix that is >= q."""
+    lo = 0
+    hi = len(self._ids)
+    while lo < hi:
+      mid = (lo + hi) / 2
+      if self._suffix(mid) < q:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  def _upper_bound(self, q):
+    """Index of the first suffix that is past every suffix starting with q."""
+    n = len(q)
+    lo = 0
+    hi = len(self._ids)
+    while lo < hi:
+      mid = (lo + hi) / 2
+      if self._suffix(mid)[:n] <= q:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo
+
+  def find_range(self, q):
+    """Returns (begin, end) of the entries whose suffix starts with q."""
+    return (self._lower_bound(q), self._upper_bound(q))
+
+  def get_ids_containing(self, q):
+    """Returns a sorted list of ids of the strings containing q."""
+    begin, end = self.find_range(q)
+    return sorted(set(self._ids[begin:end]))
+
+  def get_ids_starting_with(self, q):
+    """Returns a sorted list of ids of the strings starting with q."""
+    begin, end = self.find_range(q)
+    ids = []
+    for i in range(begin, end):
+      if self._offsets[i] == 0:
+        ids.append(self._ids[i])
+    ids.sort()
+    return ids
+
+  def get_id_of(self, q):
+    """Returns the id of the string equal to q, or None."""
+    i = self._lower_bound(q)
+    n = len(self._ids)
+    while i < n and self._suffix(i) == q:
+      if self._offsets[i] == 0:
+        return self._ids[i]
+      i += 1
+    return None
@@ -0,0 +1,57 @@
+# Copyright 2012 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import random
+import unittest
+
+from suffix_array import SuffixArray
+
+class SuffixArrayTest(unittest.TestCase):
+  def setUp(self):
+    self.strings = ["foo.cc", "foo.h", "foobar.cc", "barfoo.cc", "bar.cc", "b"]
+    self.sa = SuffixArray(self.strings)
+
+  def test_len(self):
+    self.assertEquals(sum([len(s) for s in self.strings]), len(self.sa))
+
+  def test_containing(self):
+    for q in ["foo", "o.c", "bar", "b", ".cc", "z", "foo.cc", "foo.ccc", ""]:
+      expected = [i for i in range(len(self.strings)) if self.strings[i].find(q) != -1]
+      if q == "":
+        expected = [i for i in range(len(self.strings)) if len(self.strings[i])]
+      self.assertEquals(expected, self.sa.get_ids_containing(q), "query %s" % q)
+
+  def test_starting_with(self):
+    self.assertEquals([0, 1, 2], self.sa.get_ids_starting_with("foo"))
+    self.assertEquals([0, 1], self.sa.get_ids_starting_with("foo."))
+    self.assertEquals([3, 4, 5], self.sa.get_ids_starting_with("b"))
+    self.assertEquals([], self.sa.get_ids_starting_with("oo"))
+
+  def test_id_of(self):
+    self.assertEquals(5, self.sa.get_id_of("b"))
+    self.assertEquals(0, self.sa.get_id_of("foo.cc"))
+    self.assertEquals(None, self.sa.get_id_of("foo"))
+    self.assertEquals(None, self.sa.get_id_of("oo.cc"))
+
+  def test_order_matches_sorting_suffixes(self):
+    r = random.Random(0)
+    strings = ["".join([r.choice("ab.") for j in range(r.randint(0, 12))]) for i in range(200)]
+    strings.extend(["aaaaaaaa", "aaaa", "aaaaaaaa", u"\u00e9a"])
+    sa = SuffixArray(strings)
+    entries = []
+    for id in range(len(strings)):
+      for offset in range(len(strings[id])):
+        entries.append((strings[id][offset:], id, offset))
+    entries.sort()
+    self.assertEquals([e[1] for e in entries], list(sa._ids))
+    self.assertEquals([e[2] for e in entries], list(sa._offsets))